@@ -20,12 +20,14 @@ ACTIVITY_TYPES = {
     "income_updated": {"module": "finances", "action": "editó ingreso", "icon": "TrendingUp", "color": "blue"},
     "income_deleted": {"module": "finances", "action": "eliminó ingreso", "icon": "TrendingUp", "color": "red"},
     "income_collected": {"module": "finances", "action": "cobró", "icon": "CheckCircle", "color": "emerald"},
+    "incomes_imported": {"module": "finances", "action": "importó ingresos", "icon": "Upload", "color": "emerald"},
     
     # Finanzas - Gastos
     "expense_created": {"module": "finances", "action": "registró gasto", "icon": "TrendingDown", "color": "orange"},
     "expense_updated": {"module": "finances", "action": "editó gasto", "icon": "TrendingDown", "color": "blue"},
     "expense_deleted": {"module": "finances", "action": "eliminó gasto", "icon": "TrendingDown", "color": "red"},
     "expense_paid": {"module": "finances", "action": "pagó", "icon": "CheckCircle", "color": "emerald"},
+    "expenses_imported": {"module": "finances", "action": "importó gastos", "icon": "Upload", "color": "orange"},
     
     # Finanzas - Inversiones
     "investment_created": {"module": "finances", "action": "registró inversión", "icon": "PiggyBank", "color": "purple"},
@@ -3,10 +3,15 @@ Activity & Notification Service for Mindora
 Sistema de registro de actividad y notificaciones por email
 """
 
+import logging
 import uuid
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List, Dict, Any
 from enum import Enum
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
 
 # ==========================================
 # CONSTANTES Y ENUMS
@@ -395,23 +400,79 @@ async def update_notification_preferences(
     return current
 
 
-async def should_send_email(
-    db,
-    username: str,
-    action: str
-) -> bool:
+# Ventana de agrupación (minutos) según el modo de digest del usuario.
+# "instant" no envía al momento: agrupa las ráfagas de eventos en ventanas cortas.
+DIGEST_WINDOW_MINUTES = {
+    "instant": 5,
+    "daily": 60 * 24,
+    "weekly": 60 * 24 * 7
+}
+
+# Máximo de eventos guardados por digest (el contador total se mantiene aparte)
+MAX_EVENTS_PER_DIGEST = 50
+
+# Reintentos de envío: espera base (se duplica en cada intento) y máximo de intentos
+DIGEST_RETRY_BASE_MINUTES = 5
+MAX_DIGEST_ATTEMPTS = 5
+
+# Un digest en "sending" por más tiempo se considera abandonado (p. ej. reinicio)
+DIGEST_CLAIM_TIMEOUT_MINUTES = 15
+
+# Reintentos del upsert cuando otro fan-out abrió el mismo digest pendiente a la vez
+DIGEST_UPSERT_ATTEMPTS = 3
+
+# Mapeo de acción a categoría de preferencia
+ACTION_TO_PREFERENCE = {
+    "commented": "comments",
+    "comment_edited": "comments",
+    "mentioned": "mentions",
+    "invited": "invitations",
+    "invite_accepted": "invitations",
+    "collaborator_added": "permission_changes",
+    "collaborator_removed": "permission_changes",
+    "role_changed": "permission_changes",
+    "task_created": "task_updates",
+    "task_completed": "task_updates",
+    "task_moved": "task_updates",
+    "edited": "resource_changes",
+    "created": "resource_changes",
+    "deleted": "resource_changes"
+}
+
+
+async def get_notification_preferences_bulk(db, usernames: List[str]) -> Dict[str, dict]:
     """
-    Determinar si se debe enviar email basado en preferencias del usuario.
+    Obtener preferencias de notificación de varios usuarios en una sola consulta.
+    Los usuarios sin preferencias guardadas reciben los valores por defecto.
     """
-    prefs = await get_notification_preferences(db, username)
+    if not usernames:
+        return {}
+    
+    stored = await db.notification_preferences.find(
+        {"username": {"$in": list(usernames)}},
+        {"_id": 0}
+    ).to_list(len(usernames))
     
+    prefs_by_user = {p["username"]: p for p in stored}
+    
+    return {
+        username: prefs_by_user.get(username) or {"username": username, **DEFAULT_NOTIFICATION_PREFERENCES}
+        for username in usernames
+    }
+
+
+def get_email_digest_mode(prefs: dict, action: str) -> Optional[str]:
+    """
+    Determinar el modo de envío de email para una acción según las preferencias.
+    Retorna "instant", "daily", "weekly" o None si no se debe enviar.
+    """
     # Si emails deshabilitados globalmente
     if not prefs.get("email_enabled", True):
-        return False
+        return None
     
-    # Si está en digest mode (no instant)
-    if prefs.get("email_digest") != "instant":
-        return False
+    digest_mode = prefs.get("email_digest", "instant")
+    if digest_mode not in DIGEST_WINDOW_MINUTES:
+        return None
     
     # Verificar quiet hours
     quiet = prefs.get("quiet_hours", {})
@@ -419,41 +480,36 @@ async def should_send_email(
         # TODO: Implementar lógica de quiet hours con timezone
         pass
     
-    # Mapear acción a categoría de preferencia
-    action_to_pref = {
-        "commented": "comments",
-        "comment_edited": "comments",
-        "mentioned": "mentions",
-        "invited": "invitations",
-        "invite_accepted": "invitations",
-        "collaborator_added": "permission_changes",
-        "collaborator_removed": "permission_changes",
-        "role_changed": "permission_changes",
-        "task_created": "task_updates",
-        "task_completed": "task_updates",
-        "task_moved": "task_updates",
-        "edited": "resource_changes",
-        "created": "resource_changes",
-        "deleted": "resource_changes"
-    }
-    
-    pref_key = action_to_pref.get(action, "resource_changes")
+    pref_key = ACTION_TO_PREFERENCE.get(action, "resource_changes")
     notify_on = prefs.get("notify_on", {})
     
-    return notify_on.get(pref_key, False)
+    if not notify_on.get(pref_key, False):
+        return None
+    
+    return digest_mode
+
+
+async def should_send_email(
+    db,
+    username: str,
+    action: str
+) -> bool:
+    """
+    Determinar si se debe enviar email inmediato basado en preferencias del usuario.
+    """
+    prefs = await get_notification_preferences(db, username)
+    return get_email_digest_mode(prefs, action) == "instant"
 
 
 # ==========================================
 # FUNCIONES DE ENVÍO DE NOTIFICACIONES
 # ==========================================
 
-async def process_activity_notification(
-    db,
-    activity: dict,
-    send_email_func
-) -> None:
+async def process_activity_notification(db, activity: dict) -> None:
     """
-    Procesar una actividad y enviar notificaciones si corresponde.
+    Procesar una actividad y encolarla en el digest de cada destinatario.
+    Preferencias y usuarios se cargan con una consulta cada una para todos los
+    destinatarios; el envío real lo hace flush_notification_digests.
     """
     action = activity.get("action")
     
@@ -467,13 +523,6 @@ async def process_activity_notification(
     resource_type = activity.get("resource_type")
     resource_id = activity.get("resource_id")
     
-    # Obtener info del actor
-    actor = await db.users.find_one(
-        {"username": actor_id},
-        {"_id": 0, "full_name": 1}
-    )
-    actor_name = actor.get("full_name", actor_id) if actor else actor_id
-    
     recipients = set()
     
     # Determinar destinatarios según configuración
@@ -497,35 +546,190 @@ async def process_activity_notification(
         mentioned = activity.get("metadata", {}).get("mentioned_users", [])
         recipients.update(mentioned)
     
-    # Enviar emails a cada destinatario que tenga habilitada la notificación
+    if not recipients:
+        return
+    
+    # Preferencias de todos los destinatarios en una consulta
+    prefs_by_user = await get_notification_preferences_bulk(db, list(recipients))
+    
+    digest_modes = {}
     for recipient in recipients:
-        should_send = await should_send_email(db, recipient, action)
+        mode = get_email_digest_mode(prefs_by_user[recipient], action)
+        if mode:
+            digest_modes[recipient] = mode
+    
+    if not digest_modes:
+        return
+    
+    # Actor y destinatarios en una consulta
+    users = await db.users.find(
+        {"username": {"$in": [actor_id, *digest_modes.keys()]}},
+        {"_id": 0, "username": 1, "full_name": 1, "email": 1}
+    ).to_list(len(digest_modes) + 1)
+    users_by_username = {u["username"]: u for u in users}
+    
+    actor = users_by_username.get(actor_id)
+    actor_name = actor.get("full_name", actor_id) if actor else actor_id
+    
+    event = {
+        "activity_id": activity.get("id"),
+        "action": action,
+        "template": config["template"],
+        "subject": config["subject"].format(
+            actor_name=actor_name,
+            resource_name=resource_name
+        ),
+        "actor_name": actor_name,
+        "resource_name": resource_name,
+        "resource_type": RESOURCE_TYPE_NAMES.get(resource_type, resource_type),
+        "metadata": activity.get("metadata", {}),
+        "timestamp": activity.get("created_at")
+    }
+    
+    now = datetime.now(timezone.utc)
+    operations = []
+    
+    for recipient, mode in digest_modes.items():
+        user = users_by_username.get(recipient)
+        if not user or not user.get("email"):
+            continue
         
-        if should_send:
-            user = await db.users.find_one(
-                {"username": recipient},
-                {"_id": 0, "email": 1}
-            )
+        send_after = now + timedelta(minutes=DIGEST_WINDOW_MINUTES[mode])
+        
+        # Un digest abierto por (usuario, modo): los eventos nuevos se agregan
+        # hasta que vence la ventana y el scheduler lo reclama.
+        operations.append(UpdateOne(
+            {"username": recipient, "digest_mode": mode, "status": "pending"},
+            {
+                "$push": {"events": {"$each": [event], "$slice": -MAX_EVENTS_PER_DIGEST}},
+                "$inc": {"event_count": 1},
+                "$set": {"recipient_email": user["email"]},
+                "$setOnInsert": {
+                    "id": f"dig_{uuid.uuid4().hex[:12]}",
+                    "created_at": now.isoformat(),
+                    "send_after": send_after.isoformat()
+                }
+            },
+            upsert=True
+        ))
+    
+    if operations:
+        await upsert_pending_digests(db, operations)
+
+
+async def upsert_pending_digests(db, operations: List[UpdateOne]) -> None:
+    """
+    Aplicar los upserts de digests pendientes.
+    El índice único parcial (username, digest_mode) con status "pending" hace que
+    dos fan-outs concurrentes no abran dos digests: el upsert que pierde la carrera
+    falla con clave duplicada y se reintenta, agregándose al digest ya creado.
+    """
+    for attempt in range(DIGEST_UPSERT_ATTEMPTS):
+        try:
+            await db.notification_digests.bulk_write(operations, ordered=False)
+            return
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if attempt + 1 == DIGEST_UPSERT_ATTEMPTS or any(err.get("code") != 11000 for err in write_errors):
+                raise
+            operations = [operations[err["index"]] for err in write_errors]
+
+
+async def flush_notification_digests(db, send_email_func) -> int:
+    """
+    Enviar los digests cuya ventana ya venció.
+    Cada digest se reclama atómicamente antes de enviarse, de modo que los
+    eventos que lleguen mientras tanto abren un digest nuevo. Si el envío falla,
+    el digest vuelve a "pending" con espera exponencial; tras MAX_DIGEST_ATTEMPTS
+    queda en "failed". Los reclamados hace más de DIGEST_CLAIM_TIMEOUT_MINUTES se liberan.
+    Retorna la cantidad de emails enviados.
+    """
+    now = datetime.now(timezone.utc)
+    now_str = now.isoformat()
+    sent = 0
+    
+    # Liberar digests reclamados por un envío que nunca terminó
+    stale_before = (now - timedelta(minutes=DIGEST_CLAIM_TIMEOUT_MINUTES)).isoformat()
+    await db.notification_digests.update_many(
+        {"status": "sending", "claimed_at": {"$lte": stale_before}},
+        {"$set": {"status": "pending"}, "$unset": {"claimed_at": ""}}
+    )
+    
+    while True:
+        digest = await db.notification_digests.find_one_and_update(
+            {"status": "pending", "send_after": {"$lte": now_str}},
+            {"$set": {"status": "sending", "claimed_at": now_str}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        
+        if not digest:
+            break
+        
+        events = digest.get("events", [])
+        event_count = digest.get("event_count", len(events))
+        
+        if events:
+            if event_count == 1:
+                event = events[0]
+                subject = event["subject"]
+                template = event["template"]
+                context = {
+                    "actor_name": event["actor_name"],
+                    "resource_name": event["resource_name"],
+                    "resource_type": event["resource_type"],
+                    "action": event["action"],
+                    "metadata": event.get("metadata", {}),
+                    "timestamp": event.get("timestamp")
+                }
+            else:
+                subject = f"🔔 Tienes {event_count} novedades en Mindora"
+                template = "activity_digest"
+                context = {
+                    "events": events,
+                    "event_count": event_count,
+                    "digest_mode": digest.get("digest_mode")
+                }
             
-            if user and user.get("email"):
-                subject = config["subject"].format(
-                    actor_name=actor_name,
-                    resource_name=resource_name
-                )
-                
-                await send_email_func(
-                    recipient_email=user["email"],
+            # El sender de producción no lanza: informa el error en {"success": False}
+            try:
+                result = await send_email_func(
+                    recipient_email=digest["recipient_email"],
                     subject=subject,
-                    template=config["template"],
-                    context={
-                        "actor_name": actor_name,
-                        "resource_name": resource_name,
-                        "resource_type": RESOURCE_TYPE_NAMES.get(resource_type, resource_type),
-                        "action": action,
-                        "metadata": activity.get("metadata", {}),
-                        "timestamp": activity.get("created_at")
-                    }
+                    template=template,
+                    context=context
                 )
+            except Exception as e:
+                await release_failed_digest(db, digest, str(e))
+                continue
+            if not (result or {}).get("success"):
+                await release_failed_digest(db, digest, (result or {}).get("error") or "Envío no confirmado")
+                continue
+            sent += 1
+        
+        await db.notification_digests.delete_one({"id": digest["id"]})
+    
+    return sent
+
+
+async def release_failed_digest(db, digest: dict, error: str) -> None:
+    """Devolver un digest a la cola con espera exponencial (o marcarlo fallido)"""
+    attempts = digest.get("attempts", 0) + 1
+    update = {"attempts": attempts, "last_error": error}
+    
+    if attempts >= MAX_DIGEST_ATTEMPTS:
+        update["status"] = "failed"
+        logger.error(f"❌ Digest {digest['id']} descartado tras {attempts} intentos: {error}")
+    else:
+        delay = DIGEST_RETRY_BASE_MINUTES * 2 ** (attempts - 1)
+        update["status"] = "pending"
+        update["send_after"] = (datetime.now(timezone.utc) + timedelta(minutes=delay)).isoformat()
+        logger.warning(f"⚠️ Error enviando digest {digest['id']} (intento {attempts}), reintento en {delay} min: {error}")
+    
+    await db.notification_digests.update_one(
+        {"id": digest["id"]},
+        {"$set": update, "$unset": {"claimed_at": ""}}
+    )
 
 
 async def get_resource_owner(db, resource_type: str, resource_id: str) -> Optional[str]:
@@ -569,6 +773,22 @@ async def get_resource_collaborators_usernames(
     return [p["principal_id"] for p in permissions]
 
 
+async def ensure_notification_digest_indexes(db) -> None:
+    """
+    Crear los índices usados por la cola de digests de notificaciones.
+    """
+    # Un solo digest pendiente por (usuario, modo)
+    await db.notification_digests.create_index(
+        [("username", 1), ("digest_mode", 1)],
+        unique=True,
+        partialFilterExpression={"status": "pending"},
+        name="pending_digest_per_user_mode"
+    )
+    await db.notification_digests.create_index([("status", 1), ("send_after", 1)])
+    await db.notification_digests.create_index([("status", 1), ("claimed_at", 1)])
+    await db.notification_preferences.create_index("username")
+
+
 # ==========================================
 # HELPERS
 # ==========================================
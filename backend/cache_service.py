@@ -0,0 +1,94 @@
+"""
+Cache Service - Cache en memoria acotado (LRU) con vencimiento por entrada
+Lo usan los caches de proceso (permisos, contexto de finanzas, pronóstico, IGV,
+configuración de contactos).
+Los índices secundarios permiten invalidar por usuario, recurso o empresa
+sin recorrer todas las claves.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache LRU con tamaño máximo y TTL.
+    `indexes` define índices secundarios: nombre → función que obtiene el valor
+    de índice a partir de la clave (p. ej. {"user": lambda key: key[0]}).
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        indexes: Optional[Dict[str, Callable[[Hashable], Hashable]]] = None
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # clave → (expira, valor)
+        self._index_fns = indexes or {}
+        self._indexes: Dict[str, Dict[Hashable, Set[Hashable]]] = {name: {} for name in self._index_fns}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= time.monotonic():
+            self.pop(key)
+            return default
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value, ttl: Optional[float] = None) -> None:
+        now = time.monotonic()
+        if key in self._data:
+            self._data.move_to_end(key)
+        else:
+            for name, index_fn in self._index_fns.items():
+                self._indexes[name].setdefault(index_fn(key), set()).add(key)
+        self._data[key] = (now + (self.ttl if ttl is None else ttl), value)
+
+        # Descartar vencidos al inicio (los menos usados) y lo que exceda el tamaño
+        while self._data:
+            oldest_key, (expires, _) = next(iter(self._data.items()))
+            if len(self._data) <= self.maxsize and expires > now:
+                break
+            self.pop(oldest_key)
+
+    def pop(self, key, default=None) -> Any:
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return default
+        for name, index_fn in self._index_fns.items():
+            index = self._indexes[name]
+            value = index_fn(key)
+            keys = index.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[value]
+        return entry[1]
+
+    def invalidate(self, index: str, value: Hashable) -> int:
+        """Eliminar todas las entradas cuyo índice `index` vale `value`"""
+        keys = list(self._indexes[index].get(value, ()))
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def keys(self) -> list:
+        return list(self._data.keys())
+
+    def clear(self) -> None:
+        self._data.clear()
+        for index in self._indexes.values():
+            index.clear()
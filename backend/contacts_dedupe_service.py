@@ -0,0 +1,417 @@
+"""
+Contacts Dedupe Service - Detección y fusión de contactos duplicados
+Los candidatos se agrupan por bloques (contactos que comparten una match_key:
+teléfono, email o nombre normalizado) con una agregación sobre el índice, así
+solo se comparan los pares dentro de cada bloque y no todos contra todos.
+Cada par recibe un puntaje barato (coincidencias exactas + similitud de nombre
+por trigramas) y los pares sobre el umbral se unen en grupos de fusión.
+
+La búsqueda corre como trabajo en segundo plano (colección contact_dedupe_jobs);
+la fusión reasigna en bloque las referencias de ingresos, gastos y mensajes de WhatsApp.
+"""
+
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from itertools import combinations
+from typing import Dict, List, Optional
+
+from contacts_service import (
+    build_contact_search_fields, contact_full_name, phone_digits
+)
+from whatsapp_conversation_service import rebuild_whatsapp_conversations
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_MIN_SCORE = 0.5
+MAX_BLOCK_SIZE = 50  # bloques más grandes (p. ej. nombres muy comunes) no aportan sugerencias útiles
+MAX_DEDUPE_SUGGESTIONS = 2000
+DEDUPE_FETCH_CHUNK = 5000
+MAX_MERGE_DUPLICATES = 50
+
+# Peso de cada tipo de coincidencia en el puntaje (se satura en 1.0)
+MATCH_WEIGHTS = {"tel": 0.5, "email": 0.4, "name": 0.3}
+
+DEDUPE_PROJECTION = {
+    "_id": 0, "id": 1, "contact_type": 1, "nombre": 1, "apellidos": 1, "whatsapp": 1,
+    "email": 1, "search_name": 1, "match_keys": 1, "created_at": 1
+}
+
+# Un trabajo "running" sin terminar después de esto se considera abandonado (reinicio del proceso)
+DEDUPE_JOB_TIMEOUT_MINUTES = 15
+
+# Trabajos en ejecución en este proceso
+_running_jobs = set()
+
+# Referencias a las tareas lanzadas: el event loop solo guarda referencias débiles
+_job_tasks = set()
+
+
+# ==========================================
+# PUNTAJE
+# ==========================================
+
+def name_trigrams(name: str) -> set:
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_similarity(a: str, b: str) -> float:
+    """Similitud de Jaccard entre los trigramas de dos nombres normalizados"""
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+    grams_a, grams_b = name_trigrams(a), name_trigrams(b)
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def score_pair(a: dict, b: dict) -> tuple:
+    """Puntaje (0-1) de que dos contactos sean la misma persona y las razones"""
+    shared = set(a.get("match_keys", [])) & set(b.get("match_keys", []))
+    reasons = sorted({key.split(":", 1)[0] for key in shared})
+
+    score = sum(MATCH_WEIGHTS[reason] for reason in reasons if reason != "name")
+    similarity = name_similarity(a.get("search_name", ""), b.get("search_name", ""))
+    score += MATCH_WEIGHTS["name"] * similarity
+    if "name" not in reasons and similarity >= 0.6:
+        reasons.append("similar_name")
+
+    return round(min(score, 1.0), 3), reasons
+
+
+def pick_primary(contacts: List[dict]) -> dict:
+    """Contacto que se conserva: el más completo y, a igualdad, el más antiguo"""
+    def completeness(contact):
+        filled = sum(1 for field in ("nombre", "apellidos", "whatsapp", "email") if contact.get(field))
+        return -filled, contact.get("created_at") or "", contact["id"]
+    return min(contacts, key=completeness)
+
+
+# ==========================================
+# BÚSQUEDA DE DUPLICADOS
+# ==========================================
+
+async def find_duplicate_suggestions(
+    db,
+    scope: dict,
+    contact_type: Optional[str] = None,
+    min_score: float = DEDUPE_MIN_SCORE
+) -> dict:
+    """Sugerencias de fusión del ámbito (grupos de contactos probablemente duplicados)"""
+    match = dict(scope)
+    if contact_type:
+        match["contact_type"] = contact_type
+
+    # Bloques: contactos del mismo tipo que comparten una clave
+    pipeline = [
+        {"$match": {**match, "match_keys.0": {"$exists": True}}},
+        {"$project": {"_id": 0, "id": 1, "contact_type": 1, "match_keys": 1}},
+        {"$unwind": "$match_keys"},
+        {"$group": {
+            "_id": {"key": "$match_keys", "type": "$contact_type"},
+            "ids": {"$push": "$id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1, "$lte": MAX_BLOCK_SIZE}}},
+        {"$project": {"_id": 0, "ids": 1}}
+    ]
+    blocks = [block["ids"] async for block in db.contacts.aggregate(pipeline, allowDiskUse=True)]
+
+    candidate_ids = sorted({contact_id for ids in blocks for contact_id in ids})
+    contacts: Dict[str, dict] = {}
+    for start in range(0, len(candidate_ids), DEDUPE_FETCH_CHUNK):
+        chunk = candidate_ids[start:start + DEDUPE_FETCH_CHUNK]
+        async for contact in db.contacts.find({**match, "id": {"$in": chunk}}, DEDUPE_PROJECTION):
+            contacts[contact["id"]] = contact
+
+    # Puntaje de cada par distinto dentro de los bloques
+    pairs: Dict[tuple, tuple] = {}
+    for ids in blocks:
+        for pair in combinations(sorted(set(ids)), 2):
+            if pair in pairs or pair[0] not in contacts or pair[1] not in contacts:
+                continue
+            pairs[pair] = score_pair(contacts[pair[0]], contacts[pair[1]])
+
+    # Grupos: unión de los pares que superan el umbral
+    parent: Dict[str, str] = {}
+
+    def find(contact_id):
+        parent.setdefault(contact_id, contact_id)
+        while parent[contact_id] != contact_id:
+            parent[contact_id] = parent[parent[contact_id]]
+            contact_id = parent[contact_id]
+        return contact_id
+
+    accepted = {pair: result for pair, result in pairs.items() if result[0] >= min_score}
+    for a, b in accepted:
+        parent[find(a)] = find(b)
+
+    groups: Dict[str, dict] = {}
+    for (a, b), (score, reasons) in accepted.items():
+        group = groups.setdefault(find(a), {"ids": set(), "score": 0.0, "reasons": set()})
+        group["ids"].update((a, b))
+        group["score"] = max(group["score"], score)
+        group["reasons"].update(reasons)
+
+    suggestions = []
+    for group in groups.values():
+        members = [contacts[contact_id] for contact_id in group["ids"]]
+        primary = pick_primary(members)
+        suggestions.append({
+            "primary_id": primary["id"],
+            "duplicate_ids": sorted(c["id"] for c in members if c["id"] != primary["id"]),
+            "score": group["score"],
+            "reasons": sorted(group["reasons"]),
+            "contacts": [
+                {
+                    "id": c["id"],
+                    "contact_type": c.get("contact_type"),
+                    "name": contact_full_name(c),
+                    "whatsapp": c.get("whatsapp", ""),
+                    "email": c.get("email", ""),
+                    "created_at": c.get("created_at")
+                }
+                for c in sorted(members, key=lambda c: c["id"] != primary["id"])
+            ]
+        })
+
+    suggestions.sort(key=lambda s: (-s["score"], s["primary_id"]))
+
+    return {
+        "stats": {
+            "blocks": len(blocks),
+            "candidates": len(contacts),
+            "pairs_scored": len(pairs),
+            "groups": len(suggestions)
+        },
+        "suggestions": suggestions[:MAX_DEDUPE_SUGGESTIONS],
+        "truncated": len(suggestions) > MAX_DEDUPE_SUGGESTIONS
+    }
+
+
+# ==========================================
+# TRABAJOS EN SEGUNDO PLANO
+# ==========================================
+
+async def create_dedupe_job(
+    db,
+    requested_by: str,
+    scope: dict,
+    contact_type: Optional[str] = None,
+    min_score: float = DEDUPE_MIN_SCORE
+) -> dict:
+    """Registrar la búsqueda de duplicados e iniciarla en segundo plano"""
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "requested_by": requested_by,
+        "scope": scope,
+        "contact_type": contact_type,
+        "min_score": min_score,
+        "status": "queued",
+        "stats": None,
+        "suggestions": [],
+        "truncated": False,
+        "error": None,
+        "created_at": now,
+        "started_at": None,
+        "finished_at": None
+    }
+
+    await db.contact_dedupe_jobs.insert_one(job)
+    job.pop("_id", None)
+
+    start_dedupe_job(db, job["id"])
+    return job
+
+
+def start_dedupe_job(db, job_id: str) -> None:
+    if job_id not in _running_jobs:
+        task = asyncio.create_task(run_dedupe_job(db, job_id))
+        _job_tasks.add(task)
+        task.add_done_callback(_job_tasks.discard)
+
+
+async def run_dedupe_job(db, job_id: str) -> None:
+    """
+    Calcular las sugerencias y guardarlas en el trabajo.
+    El trabajo se reclama de forma atómica (queued → running): con varios workers
+    reanudando trabajos, solo uno lo ejecuta.
+    """
+    if job_id in _running_jobs:
+        return
+    _running_jobs.add(job_id)
+
+    try:
+        started = datetime.now(timezone.utc)
+        job = await db.contact_dedupe_jobs.find_one_and_update(
+            {"id": job_id, "status": "queued"},
+            {"$set": {"status": "running", "started_at": started.isoformat()}},
+            projection={"_id": 0, "suggestions": 0}
+        )
+        if not job:
+            return
+
+        result = await find_duplicate_suggestions(
+            db, job["scope"], job.get("contact_type"), job.get("min_score", DEDUPE_MIN_SCORE)
+        )
+
+        finished = datetime.now(timezone.utc)
+        result["stats"]["duration_ms"] = int((finished - started).total_seconds() * 1000)
+        await db.contact_dedupe_jobs.update_one(
+            {"id": job_id},
+            {"$set": {**result, "status": "completed", "finished_at": finished.isoformat()}}
+        )
+        logger.info(f"👥 Búsqueda de duplicados {job_id}: {result['stats']['groups']} grupo(s)")
+
+    except Exception as e:
+        logger.error(f"❌ Error en búsqueda de duplicados {job_id}: {str(e)}")
+        await db.contact_dedupe_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    finally:
+        _running_jobs.discard(job_id)
+
+
+async def requeue_stale_dedupe_jobs(db, job_id: Optional[str] = None) -> int:
+    """Devolver a la cola los trabajos "running" abandonados (todos o uno)"""
+    stale = (datetime.now(timezone.utc) - timedelta(minutes=DEDUPE_JOB_TIMEOUT_MINUTES)).isoformat()
+    query = {"status": "running", "started_at": {"$lte": stale}}
+    if job_id:
+        query["id"] = job_id
+    result = await db.contact_dedupe_jobs.update_many(query, {"$set": {"status": "queued"}})
+    return result.modified_count
+
+
+async def get_dedupe_job(db, job_id: str) -> Optional[dict]:
+    """Leer un trabajo; si quedó abandonado se vuelve a lanzar"""
+    job = await db.contact_dedupe_jobs.find_one({"id": job_id}, {"_id": 0})
+    if job and job["status"] == "running" and await requeue_stale_dedupe_jobs(db, job_id):
+        job["status"] = "queued"
+        start_dedupe_job(db, job_id)
+    return job
+
+
+async def resume_dedupe_jobs(db) -> int:
+    """
+    Volver a lanzar las búsquedas en cola o interrumpidas por un reinicio.
+    Corre en cada worker; el reclamo atómico de run_dedupe_job evita ejecuciones dobles.
+    """
+    await requeue_stale_dedupe_jobs(db)
+    pending = await db.contact_dedupe_jobs.find({"status": "queued"}, {"_id": 0, "id": 1}).to_list(None)
+
+    for job in pending:
+        start_dedupe_job(db, job["id"])
+
+    return len(pending)
+
+
+async def ensure_dedupe_job_indexes(db) -> None:
+    await db.contact_dedupe_jobs.create_index("id", unique=True)
+    await db.contact_dedupe_jobs.create_index("status")
+
+
+# ==========================================
+# FUSIÓN
+# ==========================================
+
+def merge_contact_fields(primary: dict, duplicates: List[dict]) -> dict:
+    """
+    Campos del contacto fusionado: se conservan los del principal y se completan
+    los vacíos con los duplicados; etiquetas y campos personalizados se unen.
+    """
+    merged = {
+        "apellidos": primary.get("apellidos", ""),
+        "email": primary.get("email", ""),
+        "custom_fields": dict(primary.get("custom_fields") or {}),
+        "labels": list(primary.get("labels") or [])
+    }
+    for duplicate in duplicates:
+        for field in ("apellidos", "email"):
+            if not merged[field] and duplicate.get(field):
+                merged[field] = duplicate[field]
+        for field_id, value in (duplicate.get("custom_fields") or {}).items():
+            if merged["custom_fields"].get(field_id) in (None, "", []):
+                merged["custom_fields"][field_id] = value
+        for label in duplicate.get("labels") or []:
+            if label not in merged["labels"]:
+                merged["labels"].append(label)
+    return merged
+
+
+async def merge_contacts(
+    db,
+    primary: dict,
+    duplicates: List[dict],
+    whatsapp_workspace_ids: List[str]
+) -> dict:
+    """
+    Fusionar los duplicados en el contacto principal.
+    Primero se reasignan en bloque las referencias (ingresos, gastos, gastos fijos y
+    mensajes de WhatsApp) y solo después se eliminan los duplicados.
+    """
+    primary_id = primary["id"]
+    duplicate_ids = [d["id"] for d in duplicates]
+    now = datetime.now(timezone.utc).isoformat()
+
+    update = merge_contact_fields(primary, duplicates)
+    name = contact_full_name({**primary, **update})
+
+    # Los mensajes se guardan por teléfono: los de otros números pasan al del principal
+    primary_phone = phone_digits(primary.get("whatsapp"))
+    duplicate_phones = sorted({phone_digits(d.get("whatsapp")) for d in duplicates} - {"", primary_phone})
+
+    operations = [
+        db.finanzas_incomes.update_many(
+            {"client_id": {"$in": duplicate_ids}},
+            {"$set": {"client_id": primary_id, "client_name": name, "updated_at": now}}
+        ),
+        db.finanzas_expenses.update_many(
+            {"vendor_id": {"$in": duplicate_ids}},
+            {"$set": {"vendor_id": primary_id, "vendor_name": name, "updated_at": now}}
+        ),
+        db.finanzas_fixed_expenses.update_many(
+            {"vendor_id": {"$in": duplicate_ids}},
+            {"$set": {"vendor_id": primary_id, "vendor_name": name, "updated_at": now}}
+        )
+    ]
+    if primary_phone and duplicate_phones and whatsapp_workspace_ids:
+        operations.append(db.whatsapp_messages.update_many(
+            {
+                "workspace_id": {"$in": whatsapp_workspace_ids},
+                "channel": "whatsapp",
+                "contact_phone": {"$in": duplicate_phones}
+            },
+            {"$set": {"contact_phone": primary_phone}}
+        ))
+
+    results = await asyncio.gather(*operations)
+
+    # Los resúmenes de conversación de los números fusionados se recalculan en el del principal
+    if len(results) > 3 and results[3].modified_count:
+        await db.whatsapp_conversations.delete_many({
+            "workspace_id": {"$in": whatsapp_workspace_ids},
+            "phone": {"$in": duplicate_phones}
+        })
+        await rebuild_whatsapp_conversations(db, whatsapp_workspace_ids, [primary_phone])
+
+    search_fields = build_contact_search_fields({**primary, **update})
+    await db.contacts.update_one(
+        {"id": primary_id},
+        {"$set": {**update, **search_fields, "updated_at": now}}
+    )
+    await db.contacts.delete_many({"id": {"$in": duplicate_ids}})
+
+    return {
+        "primary_id": primary_id,
+        "merged_ids": duplicate_ids,
+        "repointed": {
+            "incomes": results[0].modified_count,
+            "expenses": results[1].modified_count,
+            "fixed_expenses": results[2].modified_count,
+            "whatsapp_messages": results[3].modified_count if len(results) > 3 else 0
+        }
+    }
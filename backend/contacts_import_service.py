@@ -0,0 +1,440 @@
+"""
+Contacts Import Service - Importación masiva de contactos desde CSV o vCard
+Lee el archivo en streaming, normaliza teléfonos y campos personalizados, detecta
+duplicados por bloques (contra la base, con el índice de match_keys, y dentro del
+mismo archivo) y escribe con insert_many.
+"""
+
+import csv
+import io
+import re
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from contacts_service import (
+    FIELD_CONFIG_COLLECTION, LABEL_CONFIG_COLLECTION, CreateContactRequest, build_contact_search_fields,
+    config_version_update, contact_scope, get_contact_config, invalidate_contact_config, phone_digits
+)
+from search_service import normalize_search_text
+
+IMPORT_FORMATS = ("csv", "vcf")
+IMPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_CONTACTS = 100000
+MAX_REPORTED_ERRORS = 1000
+
+# Código de país por defecto para números locales (sin "+")
+COUNTRY_DIAL_CODES = {
+    "PE": "51", "MX": "52", "AR": "54", "CL": "56", "CO": "57", "EC": "593",
+    "VE": "58", "BO": "591", "PY": "595", "UY": "598", "BR": "55", "ES": "34",
+    "US": "1", "CA": "1", "CR": "506", "PA": "507", "GT": "502", "HN": "504",
+    "SV": "503", "NI": "505", "DO": "1", "PR": "1", "CU": "53", "FR": "33",
+    "DE": "49", "IT": "39", "GB": "44", "PT": "351",
+}
+
+DIAL_CODES_LONGEST_FIRST = sorted(set(COUNTRY_DIAL_CODES.values()), key=len, reverse=True)
+
+# Encabezados aceptados para los campos fijos (además de los nombres de campo)
+HEADER_ALIASES = {
+    "nombre": "nombre",
+    "nombres": "nombre",
+    "first name": "nombre",
+    "given name": "nombre",
+    "apellido": "apellidos",
+    "apellidos": "apellidos",
+    "last name": "apellidos",
+    "family name": "apellidos",
+    "whatsapp": "whatsapp",
+    "telefono": "whatsapp",
+    "celular": "whatsapp",
+    "movil": "whatsapp",
+    "phone": "whatsapp",
+    "mobile": "whatsapp",
+    "email": "email",
+    "correo": "email",
+    "e-mail": "email",
+    "empresa": "company",
+    "company": "company",
+    "organizacion": "company",
+    "etiquetas": "labels",
+    "labels": "labels",
+}
+
+LIST_SEPARATOR = re.compile(r"[;,|]")
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+# ==========================================
+# LECTURA DE ARCHIVOS
+# ==========================================
+
+def iter_csv_records(stream) -> Iterator[Tuple[int, dict]]:
+    """Filas del CSV como (línea, {encabezado: valor})"""
+    reader = csv.DictReader(stream)
+    for line, row in enumerate(reader, start=2):  # la fila 1 es el encabezado
+        yield line, {key: value for key, value in row.items() if key is not None}
+
+
+def _unescape_vcard(value: str) -> str:
+    return value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def _vcard_to_record(properties: List[Tuple[str, str]]) -> dict:
+    """Convertir las propiedades de una tarjeta a los encabezados del importador"""
+    record: Dict[str, str] = {}
+    for name, value in properties:
+        if name == "N":
+            parts = value.split(";")
+            record.setdefault("apellidos", _unescape_vcard(parts[0]).strip())
+            if len(parts) > 1:
+                record.setdefault("nombre", _unescape_vcard(parts[1]).strip())
+        elif name == "FN":
+            record.setdefault("fn", _unescape_vcard(value).strip())
+        elif name == "TEL":
+            record.setdefault("whatsapp", _unescape_vcard(value).strip())
+        elif name == "EMAIL":
+            record.setdefault("email", _unescape_vcard(value).strip())
+        elif name == "ORG":
+            record.setdefault("company", _unescape_vcard(value.split(";")[0]).strip())
+        elif name == "CATEGORIES":
+            record.setdefault("labels", _unescape_vcard(value))
+
+    # Sin N: separar el nombre completo en nombre y apellidos
+    if not record.get("nombre") and record.get("fn"):
+        record["nombre"], _, apellidos = record["fn"].partition(" ")
+        record["apellidos"] = record.get("apellidos") or apellidos
+    record.pop("fn", None)
+    return record
+
+
+def iter_vcard_records(stream) -> Iterator[Tuple[int, dict]]:
+    """Tarjetas del archivo vCard como (línea de BEGIN, registro), con líneas plegadas unidas"""
+    properties: Optional[List[Tuple[str, str]]] = None
+    start_line = 0
+    pending = None
+    pending_line = 0
+
+    def flush_line(raw: str):
+        nonlocal properties
+        if properties is None or ":" not in raw:
+            return
+        head, value = raw.split(":", 1)
+        name = head.split(";")[0].split(".")[-1].upper()  # "item1.TEL;TYPE=CELL" → "TEL"
+        properties.append((name, value))
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and pending is not None:
+            pending += line[1:]  # línea plegada (RFC 6350)
+            continue
+
+        if pending is not None:
+            upper = pending.strip().upper()
+            if upper == "BEGIN:VCARD":
+                properties, start_line = [], pending_line
+            elif upper == "END:VCARD":
+                if properties is not None:
+                    yield start_line, _vcard_to_record(properties)
+                properties = None
+            else:
+                flush_line(pending)
+        pending, pending_line = line, line_number
+
+    if pending is not None and pending.strip().upper() == "END:VCARD" and properties is not None:
+        yield start_line, _vcard_to_record(properties)
+
+
+# ==========================================
+# NORMALIZACIÓN
+# ==========================================
+
+def normalize_phone(value: Optional[str], dial_code: str) -> str:
+    """
+    Teléfono en el formato de la interfaz ("+51 987 654 321").
+    Los números sin "+" ni código de país reciben el código por defecto.
+    """
+    raw = (value or "").strip()
+    digits = phone_digits(raw)
+    if not digits:
+        return ""
+
+    if raw.startswith(("+", "00")):
+        digits = digits[2:] if raw.startswith("00") else digits
+        code = next((c for c in DIAL_CODES_LONGEST_FIRST if digits.startswith(c)), "")
+    elif digits.startswith(dial_code) and len(digits) > 10:
+        code = dial_code
+    else:
+        code, digits = dial_code, dial_code + digits.lstrip("0")
+
+    local = digits[len(code):]
+    grouped = re.sub(r"(\d{3})(\d{3})(\d{3,4})", r"\1 \2 \3", local)
+    return f"+{code} {grouped}".strip() if code else f"+{digits}"
+
+
+def build_field_maps(field_config: Optional[dict], label_config: Optional[dict]) -> Tuple[dict, dict]:
+    """Campos personalizados y etiquetas por nombre normalizado (y por id)"""
+    fields = {}
+    for field in (field_config or {}).get("fields", []):
+        fields[normalize_search_text(field["name"])] = field
+        fields[field["id"].lower()] = field
+
+    labels = {}
+    for label in (label_config or {}).get("labels", []):
+        labels[normalize_search_text(label["name"])] = label["id"]
+        labels[label["id"].lower()] = label["id"]
+    return fields, labels
+
+
+def convert_custom_value(field: dict, value: str):
+    """Validar y convertir el valor de un campo personalizado; lanza ValueError si no es válido"""
+    field_type = field.get("field_type", "text")
+    options = field.get("options") or []
+
+    if field_type == "number":
+        try:
+            number = float(value.replace(",", ""))
+        except ValueError:
+            raise ValueError(f"{field['name']}: se esperaba un número")
+        return int(number) if number.is_integer() else number
+    if field_type == "date" and not DATE_PATTERN.match(value):
+        raise ValueError(f"{field['name']}: formato esperado YYYY-MM-DD")
+    if field_type == "select":
+        match = next((o for o in options if o.lower() == value.lower()), None)
+        if options and match is None:
+            raise ValueError(f"{field['name']}: opción no válida '{value}'")
+        return match or value
+    if field_type == "multiselect":
+        selected = []
+        for item in (v.strip() for v in LIST_SEPARATOR.split(value)):
+            if not item:
+                continue
+            match = next((o for o in options if o.lower() == item.lower()), None)
+            if options and match is None:
+                raise ValueError(f"{field['name']}: opción no válida '{item}'")
+            selected.append(match or item)
+        return selected
+    return value
+
+
+def map_record(record: dict, fields: dict, labels: dict, new_labels: dict, dial_code: str) -> Tuple[dict, dict, List[str]]:
+    """
+    Convertir un registro en (datos de CreateContactRequest, campos extra, errores).
+    Las etiquetas desconocidas se agregan a `new_labels` para crearlas en lote.
+    """
+    data = {"custom_fields": {}, "labels": []}
+    extra = {}
+    errors = []
+
+    for header, value in record.items():
+        value = (value or "").strip()
+        if not value:
+            continue
+        key = normalize_search_text(header)
+        target = HEADER_ALIASES.get(key)
+
+        if target == "labels":
+            for name in (v.strip() for v in LIST_SEPARATOR.split(value)):
+                if not name:
+                    continue
+                normalized = normalize_search_text(name)
+                if normalized not in labels:
+                    label_id = f"label_{uuid.uuid4().hex[:8]}"
+                    new_labels[normalized] = {"id": label_id, "name": name, "color": "#3B82F6"}
+                    labels[normalized] = label_id
+                if labels[normalized] not in data["labels"]:
+                    data["labels"].append(labels[normalized])
+        elif target == "company":
+            extra["company"] = value
+        elif target:
+            data[target] = value
+        elif key in fields:
+            field = fields[key]
+            try:
+                data["custom_fields"][field["id"]] = convert_custom_value(field, value)
+            except ValueError as e:
+                errors.append(str(e))
+
+    if "whatsapp" in data:
+        data["whatsapp"] = normalize_phone(data["whatsapp"], dial_code)
+    if not data.get("nombre"):
+        errors.append("nombre: es obligatorio")
+    if not data.get("whatsapp"):
+        errors.append("whatsapp: es obligatorio")
+    data.setdefault("apellidos", "")
+
+    required = {f["id"]: f for f in fields.values() if f.get("is_required")}
+    for field_id, field in required.items():
+        if field_id not in data["custom_fields"]:
+            errors.append(f"{field['name']}: es obligatorio")
+
+    return data, extra, errors
+
+
+# ==========================================
+# IMPORTACIÓN
+# ==========================================
+
+async def import_contacts(
+    db,
+    file,
+    file_format: str,
+    contact_type: str,
+    username: str,
+    company_id: Optional[str] = None,
+    workspace_id: Optional[str] = None,
+    country: str = "PE",
+    dry_run: bool = False
+) -> dict:
+    """
+    Importar contactos desde un archivo CSV o vCard (binario).
+    Retorna el resumen con importados, duplicados y el reporte de errores por fila.
+    """
+    dial_code = COUNTRY_DIAL_CODES.get((country or "PE").upper(), "51")
+
+    field_config = await get_contact_config(db, FIELD_CONFIG_COLLECTION, username, contact_type)
+    label_config = await get_contact_config(db, LABEL_CONFIG_COLLECTION, username, contact_type)
+    fields, labels = build_field_maps(field_config, label_config)
+    new_labels: Dict[str, dict] = {}
+
+    scope = contact_scope(company_id, workspace_id, username)
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="" if file_format == "csv" else None)
+    records = iter_csv_records(stream) if file_format == "csv" else iter_vcard_records(stream)
+
+    errors: List[dict] = []
+    duplicates: List[dict] = []
+    error_count = 0
+    duplicate_count = 0
+    imported = 0
+    row_count = 0
+    seen_keys: Dict[str, int] = {}  # claves del archivo → línea donde aparecieron
+    chunk: List[Tuple[int, dict]] = []
+
+    def report_error(line: int, messages: List[str]):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"row": line, "errors": messages})
+
+    def report_duplicate(line: int, reason: str, existing_id: Optional[str] = None, existing_row: Optional[int] = None):
+        nonlocal duplicate_count
+        duplicate_count += 1
+        if len(duplicates) < MAX_REPORTED_ERRORS:
+            duplicates.append({"row": line, "reason": reason, "existing_id": existing_id, "existing_row": existing_row})
+
+    async def flush(pending: List[Tuple[int, dict]]):
+        nonlocal imported
+
+        # Un solo lookup indexado por bloque: teléfonos y emails del bloque contra la base
+        keys = {key for _, doc in pending for key in doc["match_keys"] if not key.startswith("name:")}
+        existing: Dict[str, str] = {}
+        if keys:
+            cursor = db.contacts.find(
+                {**scope, "match_keys": {"$in": list(keys)}},
+                {"_id": 0, "id": 1, "match_keys": 1}
+            )
+            async for contact in cursor:
+                for key in contact.get("match_keys", []):
+                    if key in keys:
+                        existing.setdefault(key, contact["id"])
+
+        documents = []
+        for line, doc in pending:
+            match = next((key for key in doc["match_keys"] if key in existing), None)
+            if match:
+                report_duplicate(line, match.split(":", 1)[0], existing_id=existing[match])
+                continue
+            documents.append(doc)
+
+        if documents and not dry_run:
+            await db.contacts.insert_many(documents, ordered=False)
+        imported += len(documents)
+
+    now = datetime.now(timezone.utc).isoformat()
+
+    for line, record in records:
+        if not any((value or "").strip() for value in record.values()):
+            continue
+
+        row_count += 1
+        if row_count > MAX_IMPORT_CONTACTS:
+            report_error(line, [f"Se superó el máximo de {MAX_IMPORT_CONTACTS} contactos por archivo"])
+            break
+
+        data, extra, messages = map_record(record, fields, labels, new_labels, dial_code)
+        if messages:
+            report_error(line, messages)
+            continue
+
+        try:
+            request = CreateContactRequest(
+                contact_type=contact_type, company_id=company_id, workspace_id=workspace_id, **data
+            )
+        except ValidationError as e:
+            report_error(line, [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()])
+            continue
+
+        contact = {
+            "id": f"contact_{uuid.uuid4().hex[:12]}",
+            "contact_type": request.contact_type,
+            "nombre": request.nombre,
+            "apellidos": request.apellidos,
+            "whatsapp": request.whatsapp,
+            "email": request.email or "",
+            "custom_fields": request.custom_fields or {},
+            "labels": request.labels or [],
+            **extra,
+            "owner_username": username,
+            "workspace_id": workspace_id,
+            "company_id": company_id,
+            "created_at": now,
+            "updated_at": now
+        }
+        contact.update(build_contact_search_fields(contact))
+
+        # Duplicados dentro del mismo archivo (por teléfono o email)
+        repeated = next((key for key in contact["match_keys"] if key in seen_keys and not key.startswith("name:")), None)
+        if repeated:
+            report_duplicate(line, repeated.split(":", 1)[0], existing_row=seen_keys[repeated])
+            continue
+        for key in contact["match_keys"]:
+            if not key.startswith("name:"):
+                seen_keys[key] = line
+
+        chunk.append((line, contact))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+
+    if chunk:
+        await flush(chunk)
+
+    errors.sort(key=lambda e: e["row"])
+    duplicates.sort(key=lambda d: d["row"])
+
+    if new_labels and imported and not dry_run:
+        await db.contact_label_configs.update_one(
+            {"contact_type": contact_type, "owner_username": username},
+            config_version_update({
+                "$push": {"labels": {"$each": list(new_labels.values())}},
+                "$setOnInsert": {"contact_type": contact_type, "owner_username": username, "created_at": now},
+                "$set": {"updated_at": now}
+            }),
+            upsert=True
+        )
+        invalidate_contact_config(username, contact_type)
+
+    return {
+        "format": file_format,
+        "contact_type": contact_type,
+        "dry_run": dry_run,
+        "rows": row_count,
+        "imported": imported,
+        "duplicates": duplicate_count,
+        "failed": error_count,
+        "created_labels": [label["name"] for label in new_labels.values()],
+        "errors": errors,
+        "duplicate_rows": duplicates,
+        "errors_truncated": error_count > len(errors) or duplicate_count > len(duplicates)
+    }
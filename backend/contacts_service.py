@@ -1,11 +1,25 @@
 """
 Contacts Service for MindoraMap - CRM básico con campos personalizados
+
+Uso como comando para completar los campos de búsqueda de contactos existentes:
+    python contacts_service.py
 """
+import asyncio
+import os
+import re
 from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional, Literal
+from typing import Callable, Dict, List, Optional, Literal
 from datetime import datetime, timezone
 from uuid import uuid4
 
+from pymongo import UpdateOne
+
+from search_service import (
+    MAX_TOKEN_LENGTH, normalize_search_text, build_search_tokens, query_tokens,
+    encode_search_cursor, decode_search_cursor
+)
+from cache_service import TTLCache
+
 
 # Tipos de campo válidos
 VALID_FIELD_TYPES = ['text', 'number', 'textarea', 'date', 'time', 'select', 'multiselect']
@@ -122,3 +136,389 @@ class UpdateCustomFieldRequest(BaseModel):
         if v not in VALID_FIELD_TYPES:
             return 'text'
         return v
+
+
+# ==========================================
+# BÚSQUEDA (tokens normalizados por prefijo)
+# ==========================================
+
+# Campos de búsqueda internos: no se devuelven en las respuestas
+CONTACT_PROJECTION = {"_id": 0, "search_name": 0, "search_tokens": 0, "search_version": 0, "match_keys": 0}
+
+# Versión de los campos de búsqueda: al cambiar cómo se generan, el backfill los recalcula
+CONTACT_SEARCH_VERSION = 2
+
+CONTACT_TEXT_FIELDS = ("nombre", "apellidos", "name", "email", "company")
+CONTACT_PHONE_FIELDS = ("whatsapp", "phone")
+
+# Dígitos de un número local (sin código de país) que también se indexan
+LOCAL_PHONE_DIGITS = 9
+MIN_PHONE_QUERY_DIGITS = 3
+MIN_MATCH_PHONE_DIGITS = 7
+
+PHONE_QUERY_PATTERN = re.compile(r"^[\d\s()+.-]+$")
+
+
+def phone_digits(value: Optional[str]) -> str:
+    """Solo los dígitos de un teléfono ("+51 987-654-321" → "51987654321")"""
+    return re.sub(r"\D", "", value or "")
+
+
+def contact_full_name(contact: dict) -> str:
+    nombre = contact.get("nombre", "") or contact.get("name", "")
+    apellidos = contact.get("apellidos", "")
+    return f"{nombre} {apellidos}".strip() if apellidos else nombre
+
+
+def build_contact_match_keys(contact: dict) -> List[str]:
+    """
+    Claves exactas para detectar duplicados: teléfono (sus últimos 9 dígitos),
+    email en minúsculas y nombre completo normalizado.
+    """
+    keys = set()
+    for field in CONTACT_PHONE_FIELDS:
+        digits = phone_digits(contact.get(field))
+        if len(digits) >= MIN_MATCH_PHONE_DIGITS:
+            keys.add(f"tel:{digits[-LOCAL_PHONE_DIGITS:]}")
+
+    email = (contact.get("email") or "").strip().lower()
+    if "@" in email:
+        keys.add(f"email:{email}")
+
+    name = normalize_search_text(contact_full_name(contact))
+    if name:
+        keys.add(f"name:{name}")
+    return sorted(keys)
+
+
+def contact_scope(company_id: Optional[str], workspace_id: Optional[str], username: str) -> dict:
+    """Ámbito de un contacto: empresa, workspace compartido o contactos personales"""
+    if company_id:
+        return {"company_id": company_id}
+    if workspace_id:
+        return {"workspace_id": workspace_id}
+    return {"owner_username": username, "workspace_id": None}
+
+
+def build_contact_search_fields(contact: dict) -> dict:
+    """
+    Nombre completo normalizado (orden) y prefijos de nombre, apellidos, empresa y de la
+    parte local del email, más los dígitos del número local de los teléfonos.
+    El dominio del email y el código de país no se indexan: "gm" o "51" coincidirían con todos.
+    """
+    texts = [contact.get(field) for field in CONTACT_TEXT_FIELDS if field != "email"]
+    texts.append((contact.get("email") or "").split("@")[0])
+
+    phones = [
+        digits[-LOCAL_PHONE_DIGITS:]
+        for digits in (phone_digits(contact.get(field)) for field in CONTACT_PHONE_FIELDS)
+        if digits
+    ]
+
+    return {
+        "search_name": normalize_search_text(contact_full_name(contact)),
+        "search_tokens": build_search_tokens(texts, extra_words=phones),
+        "search_version": CONTACT_SEARCH_VERSION,
+        "match_keys": build_contact_match_keys(contact)
+    }
+
+
+def contact_query_tokens(query: Optional[str]) -> List[str]:
+    """
+    Tokens de una búsqueda: un teléfono se busca por sus dígitos (un número completo,
+    por su número local); un texto, por palabra.
+    """
+    query = (query or "").strip()
+    if PHONE_QUERY_PATTERN.match(query):
+        digits = phone_digits(query)
+        if len(digits) >= MIN_PHONE_QUERY_DIGITS:
+            return [digits[-LOCAL_PHONE_DIGITS:]]
+    return query_tokens(query)
+
+
+def contact_name_prefix_query(query: Optional[str]) -> Optional[dict]:
+    """
+    Filtro de nombre completo que empieza con la búsqueda: un prefijo anclado que
+    usa el índice de search_name. None si la búsqueda es un teléfono o está vacía.
+    """
+    query = (query or "").strip()
+    if PHONE_QUERY_PATTERN.match(query):
+        return None
+    words = query_tokens(query)
+    if not words:
+        return None
+    return {"search_name": {"$regex": f"^{re.escape(' '.join(words))}"}}
+
+
+def rank_contact(contact: dict, query: str) -> tuple:
+    """
+    Orden de relevancia: nombre completo que empieza con la búsqueda, luego nombres
+    con alguna palabra que empieza con ella y al final las coincidencias por
+    email, empresa o teléfono; a igual relevancia, por nombre.
+    """
+    words = query_tokens(query)
+    name = contact.get("search_name", "")
+    if words and name.startswith(" ".join(words)):
+        rank = 0
+    elif words and all(any(part.startswith(word) for part in name.split()) for word in words):
+        rank = 1
+    else:
+        rank = 2
+    return rank, name, contact.get("id", "")
+
+
+# ==========================================
+# LISTADO PAGINADO
+# ==========================================
+
+CONTACT_PAGE_MAX = 1000
+CONTACT_COUNT_CAP = 100000
+
+# Siempre se devuelven (el cursor usa created_at + id)
+CONTACT_BASE_FIELDS = ("id", "created_at")
+
+FIELD_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)?$")
+
+
+def build_contact_projection(fields: Optional[str]) -> dict:
+    """
+    Proyección a partir de `fields=nombre,apellidos,custom_fields.field_x`.
+    Sin `fields` se devuelven todos los campos (salvo los de búsqueda).
+    Lanza ValueError si un campo no es válido.
+    """
+    if not fields:
+        return dict(CONTACT_PROJECTION)
+
+    projection = {"_id": 0, **{field: 1 for field in CONTACT_BASE_FIELDS}}
+    for field in (f.strip() for f in fields.split(",")):
+        if not field:
+            continue
+        if not FIELD_PATTERN.match(field) or field.startswith(("search_", "match_")):
+            raise ValueError(f"Campo no válido: {field}")
+        projection[field] = 1
+    return projection
+
+
+def build_custom_field_filters(filters: Optional[List[str]]) -> dict:
+    """
+    Filtros por valor de campo personalizado, con el formato `field_id:valor`.
+    Varios valores del mismo campo coinciden con cualquiera de ellos.
+    Los valores numéricos coinciden como texto o número; en multiselect basta un elemento.
+    """
+    query = {}
+    for item in filters or []:
+        field_id, separator, value = item.partition(":")
+        if not separator or not FIELD_PATTERN.match(field_id):
+            raise ValueError(f"Filtro de campo personalizado no válido: {item}")
+
+        candidates = query.setdefault(f"custom_fields.{field_id}", {"$in": []})["$in"]
+        candidates.append(value)
+        try:
+            candidates.append(float(value))
+        except ValueError:
+            pass
+    return query
+
+
+def apply_contact_cursor(query: dict, cursor: Optional[str]) -> dict:
+    """Continuar después del cursor (orden created_at/id descendente); lanza ValueError si es inválido"""
+    if not cursor:
+        return query
+
+    created_at, contact_id = decode_search_cursor(cursor, 2)
+    return {
+        "$and": [
+            query,
+            {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": contact_id}}
+            ]}
+        ]
+    }
+
+
+# ==========================================
+# CACHE DE CONFIGURACIÓN (CAMPOS Y ETIQUETAS)
+# ==========================================
+
+FIELD_CONFIG_COLLECTION = "contact_field_configs"
+LABEL_CONFIG_COLLECTION = "contact_label_configs"
+
+# Respaldo para cambios hechos por otros procesos; en este proceso se invalida al escribir
+CONTACT_CONFIG_TTL_SECONDS = 60
+CONTACT_CONFIG_MAX_ENTRIES = 5000
+
+# Los validadores no vencen por cambios (la clave incluye la versión); el TTL solo libera memoria
+CUSTOM_FIELD_VALIDATOR_TTL_SECONDS = 3600
+CUSTOM_FIELD_VALIDATOR_MAX_ENTRIES = 2000
+
+# Configuraciones leídas: (colección, owner, tipo) → config (None si no existe)
+_contact_config_cache = TTLCache(
+    CONTACT_CONFIG_MAX_ENTRIES,
+    CONTACT_CONFIG_TTL_SECONDS,
+    indexes={"owner": lambda key: key[1], "owner_type": lambda key: (key[1], key[2])}
+)
+
+# Validadores compilados por versión de configuración: (owner, tipo, versión) → validador
+_custom_field_validators = TTLCache(
+    CUSTOM_FIELD_VALIDATOR_MAX_ENTRIES,
+    CUSTOM_FIELD_VALIDATOR_TTL_SECONDS,
+    indexes={"owner": lambda key: key[0], "owner_type": lambda key: (key[0], key[1])}
+)
+
+_NOT_CACHED = object()
+
+NUMBER_PATTERN = re.compile(r"^-?\d+(\.\d+)?$")
+TIME_PATTERN = re.compile(r"^\d{2}:\d{2}$")
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def config_version_update(update: dict) -> dict:
+    """Agregar el incremento de versión a un update de configuración"""
+    return {**update, "$inc": {"version": 1}}
+
+
+def invalidate_contact_config(owner_username: str, contact_type: Optional[str] = None) -> None:
+    """Descartar las configuraciones y validadores cacheados de un usuario (o de un tipo)"""
+    for cache in (_contact_config_cache, _custom_field_validators):
+        if contact_type is None:
+            cache.invalidate("owner", owner_username)
+        else:
+            cache.invalidate("owner_type", (owner_username, contact_type))
+
+
+async def get_contact_config(db, collection: str, owner_username: str, contact_type: str) -> Optional[dict]:
+    """
+    Configuración de campos o etiquetas desde el cache (sin _id).
+    El documento es compartido: no debe modificarse.
+    """
+    key = (collection, owner_username, contact_type)
+    cached = _contact_config_cache.get(key, _NOT_CACHED)
+    if cached is not _NOT_CACHED:
+        return cached
+
+    config = await db[collection].find_one(
+        {"contact_type": contact_type, "owner_username": owner_username},
+        {"_id": 0}
+    )
+    _contact_config_cache.set(key, config)
+    return config
+
+
+def compile_field_check(field: dict) -> Callable:
+    """Función que valida un valor del campo y retorna el mensaje de error (o None)"""
+    field_type = field.get("field_type", "text")
+    name = field.get("name", field["id"])
+    options = set(field.get("options") or [])
+
+    if field_type == "number":
+        def check(value):
+            if isinstance(value, bool) or not (
+                isinstance(value, (int, float)) or (isinstance(value, str) and NUMBER_PATTERN.match(value.strip()))
+            ):
+                return f"{name} debe ser un número válido"
+    elif field_type in ("date", "time"):
+        pattern = DATE_PATTERN if field_type == "date" else TIME_PATTERN
+        expected = "YYYY-MM-DD" if field_type == "date" else "HH:MM"
+
+        def check(value):
+            if not isinstance(value, str) or not pattern.match(value):
+                return f"{name} debe tener el formato {expected}"
+    elif field_type == "select":
+        def check(value):
+            if options and value not in options:
+                return f"{name}: opción no válida"
+    elif field_type == "multiselect":
+        def check(value):
+            if not isinstance(value, list):
+                return f"{name} debe ser una lista"
+            if options and not options.issuperset(value):
+                return f"{name}: opción no válida"
+    else:
+        def check(value):
+            if not isinstance(value, (str, int, float)):
+                return f"{name} debe ser texto"
+    return check
+
+
+def compile_custom_field_validator(fields: List[dict]) -> Callable[[Optional[dict]], List[str]]:
+    """
+    Validador de custom_fields para una configuración.
+    Valida el tipo y las opciones de los campos configurados con valor; las claves
+    desconocidas y los valores vacíos se aceptan tal cual (obligatoriedad en el formulario).
+    """
+    checks = {field["id"]: compile_field_check(field) for field in fields}
+
+    def validate(custom_fields: Optional[dict]) -> List[str]:
+        errors = []
+        for field_id, value in (custom_fields or {}).items():
+            check = checks.get(field_id)
+            if check is None or value is None or value == "" or value == []:
+                continue
+            error = check(value)
+            if error:
+                errors.append(error)
+        return errors
+
+    return validate
+
+
+async def get_custom_field_validator(db, owner_username: str, contact_type: str) -> Callable:
+    """Validador compilado una vez por versión de la configuración de campos"""
+    config = await get_contact_config(db, FIELD_CONFIG_COLLECTION, owner_username, contact_type) or {}
+    key = (owner_username, contact_type, config.get("version", 0))
+
+    validator = _custom_field_validators.get(key)
+    if validator is None:
+        validator = compile_custom_field_validator(config.get("fields", []))
+        _custom_field_validators.set(key, validator)
+    return validator
+
+
+async def backfill_contact_search_fields(db, batch_size: int = 500) -> int:
+    """Completar (o recalcular) los campos de búsqueda de los contactos de una versión anterior"""
+    updated = 0
+    projection = {"_id": 1, **{field: 1 for field in CONTACT_TEXT_FIELDS + CONTACT_PHONE_FIELDS}}
+    cursor = db.contacts.find({"search_version": {"$ne": CONTACT_SEARCH_VERSION}}, projection)
+
+    operations = []
+    async for contact in cursor:
+        operations.append(UpdateOne({"_id": contact["_id"]}, {"$set": build_contact_search_fields(contact)}))
+        if len(operations) >= batch_size:
+            await db.contacts.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+
+    if operations:
+        await db.contacts.bulk_write(operations, ordered=False)
+        updated += len(operations)
+
+    return updated
+
+
+async def ensure_contact_indexes(db) -> None:
+    """Índices de búsqueda y de listado en cada ámbito (empresa, workspace, personal)"""
+    for scope in ("company_id", "workspace_id", "owner_username"):
+        await db.contacts.create_index([(scope, 1), ("search_tokens", 1), ("search_name", 1)])
+        await db.contacts.create_index([(scope, 1), ("search_name", 1)])
+        await db.contacts.create_index([(scope, 1), ("match_keys", 1)])
+        # Listado paginado por tipo, del más reciente al más antiguo
+        await db.contacts.create_index([(scope, 1), ("contact_type", 1), ("created_at", -1), ("id", -1)])
+
+
+async def _backfill_from_command_line():
+    """Completar los campos de búsqueda de todos los contactos desde la línea de comandos"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL'))
+    db = client[os.environ.get('DB_NAME', 'mindmap_db')]
+
+    await ensure_contact_indexes(db)
+    count = await backfill_contact_search_fields(db)
+    print(f"Campos de búsqueda completados en {count} contacto(s)")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_backfill_from_command_line())
@@ -0,0 +1,267 @@
+"""
+Deletion Job Service - Eliminaciones masivas en segundo plano
+Un trabajo de eliminación es una lista de pasos (colección + filtro) que se procesan
+por bloques de _id, con una pausa entre bloques para no afectar la latencia del resto
+de la aplicación. El progreso queda en la colección deletion_jobs.
+
+Lo usan la eliminación de empresas, la eliminación masiva de usuarios y vaciar la papelera.
+"""
+
+import asyncio
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+DELETION_CHUNK_SIZE = 500
+DELETION_THROTTLE_SECONDS = 0.05
+
+# Un trabajo "running" sin avance por más tiempo se considera abandonado y puede reclamarse
+DELETION_JOB_TIMEOUT_MINUTES = 10
+
+# Trabajos en ejecución en este proceso (evita ejecutar dos veces el mismo)
+_running_jobs = set()
+
+# Referencias a las tareas lanzadas: el event loop solo guarda referencias débiles
+_job_tasks = set()
+
+
+def deletion_step(collection: str, query: dict, label: Optional[str] = None, update: Optional[dict] = None) -> dict:
+    """
+    Definir un paso del trabajo.
+    Sin `update` se eliminan los documentos que coinciden con `query`; con `update`
+    se actualizan, y el update debe hacer que dejen de coincidir (p. ej. marcar isDeleted).
+    Filtro y update se guardan serializados: MongoDB no acepta claves con '$' en documentos.
+    """
+    return {
+        "collection": collection,
+        "label": label or collection,
+        "query": json.dumps(query),
+        "update": json.dumps(update) if update else None,
+        "expected": None,
+        "processed": 0,
+        "done": False
+    }
+
+
+async def create_deletion_job(
+    db,
+    job_type: str,
+    requested_by: str,
+    steps: List[dict],
+    target: Optional[dict] = None
+) -> dict:
+    """Registrar un trabajo e iniciarlo en segundo plano (el conteo de cada paso lo hace el trabajo)"""
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type,
+        "requested_by": requested_by,
+        "target": target or {},
+        "status": "queued",
+        "steps": steps,
+        "expected": None,
+        "processed": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "started_at": None,
+        "finished_at": None
+    }
+
+    await db.deletion_jobs.insert_one(job)
+    job.pop("_id", None)
+
+    start_deletion_job(db, job["id"])
+    return job
+
+
+def start_deletion_job(db, job_id: str) -> None:
+    """Lanzar la ejecución del trabajo como tarea en segundo plano"""
+    if job_id not in _running_jobs:
+        task = asyncio.create_task(run_deletion_job(db, job_id))
+        _job_tasks.add(task)
+        task.add_done_callback(_job_tasks.discard)
+
+
+class DeletionJobClaimLost(Exception):
+    """Otro worker reclamó el trabajo (este se dio por abandonado)"""
+
+
+def _claimable_query(job_id: str) -> dict:
+    """Trabajos en cola o en ejecución sin avance reciente"""
+    stale = (datetime.now(timezone.utc) - timedelta(minutes=DELETION_JOB_TIMEOUT_MINUTES)).isoformat()
+    return {
+        "id": job_id,
+        "$or": [
+            {"status": "queued"},
+            {"status": "running", "heartbeat_at": {"$lte": stale}},
+            {"status": "running", "heartbeat_at": {"$exists": False}}
+        ]
+    }
+
+
+async def run_deletion_job(db, job_id: str) -> None:
+    """
+    Procesar los pasos pendientes del trabajo por bloques, registrando el progreso.
+    El trabajo se reclama de forma atómica (claim_id): con varios workers reanudando
+    trabajos, solo uno lo ejecuta. Cada bloque renueva heartbeat_at y exige el reclamo;
+    si otro worker lo tomó por abandonado, este se detiene.
+    """
+    if job_id in _running_jobs:
+        return
+    _running_jobs.add(job_id)
+    claim_id = uuid.uuid4().hex
+    owned = {"id": job_id, "claim_id": claim_id}
+
+    try:
+        now = datetime.now(timezone.utc).isoformat()
+        job = await db.deletion_jobs.find_one_and_update(
+            _claimable_query(job_id),
+            {"$set": {"status": "running", "claim_id": claim_id, "claimed_at": now, "heartbeat_at": now}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return
+
+        started = {"started_at": job.get("started_at") or now}
+
+        # Contar lo que procesará cada paso (solo la primera vez, fuera de la petición)
+        uncounted = [index for index, step in enumerate(job["steps"]) if step.get("expected") is None]
+        if uncounted:
+            counts = await asyncio.gather(*[
+                db[job["steps"][index]["collection"]].count_documents(json.loads(job["steps"][index]["query"]))
+                for index in uncounted
+            ])
+            for index, count in zip(uncounted, counts):
+                job["steps"][index]["expected"] = count
+                started[f"steps.{index}.expected"] = count
+            started["expected"] = sum(step["expected"] for step in job["steps"])
+
+        await _update_owned(db, owned, {"$set": started})
+
+        for index, step in enumerate(job["steps"]):
+            if step.get("done"):
+                continue
+
+            collection = db[step["collection"]]
+            query = json.loads(step["query"])
+            update = json.loads(step["update"]) if step.get("update") else None
+
+            while True:
+                chunk = await collection.find(query, {"_id": 1}).limit(DELETION_CHUNK_SIZE).to_list(DELETION_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                ids = {"_id": {"$in": [doc["_id"] for doc in chunk]}}
+                if update:
+                    result = await collection.update_many(ids, update)
+                    processed = result.modified_count
+                else:
+                    result = await collection.delete_many(ids)
+                    processed = result.deleted_count
+
+                now = datetime.now(timezone.utc).isoformat()
+                await _update_owned(db, owned, {
+                    "$inc": {f"steps.{index}.processed": processed, "processed": processed},
+                    "$set": {"updated_at": now, "heartbeat_at": now}
+                })
+
+                if len(chunk) < DELETION_CHUNK_SIZE:
+                    break
+                await asyncio.sleep(DELETION_THROTTLE_SECONDS)
+
+            await _update_owned(db, owned, {"$set": {f"steps.{index}.done": True}})
+
+        now = datetime.now(timezone.utc).isoformat()
+        await _update_owned(db, owned, {"$set": {"status": "completed", "finished_at": now, "updated_at": now}})
+        logger.info(f"🗑️ Trabajo de eliminación {job_id} ({job['type']}) completado")
+
+    except DeletionJobClaimLost:
+        logger.warning(f"⚠️ Trabajo de eliminación {job_id} reclamado por otro worker; se detiene aquí")
+    except Exception as e:
+        logger.error(f"❌ Error en trabajo de eliminación {job_id}: {str(e)}")
+        await db.deletion_jobs.update_one(
+            owned,
+            {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    finally:
+        _running_jobs.discard(job_id)
+
+
+async def _update_owned(db, owned: dict, update: dict) -> None:
+    """Actualizar el trabajo solo si este worker conserva el reclamo"""
+    result = await db.deletion_jobs.update_one(owned, update)
+    if not result.matched_count:
+        raise DeletionJobClaimLost()
+
+
+def format_deletion_job(job: dict) -> dict:
+    """Vista pública del trabajo con su porcentaje de avance"""
+    expected = job.get("expected", 0) or 0
+    processed = job.get("processed", 0) or 0
+
+    if job.get("status") == "completed":
+        percent = 100
+    elif expected:
+        percent = min(99, int(processed * 100 / expected))
+    else:
+        percent = 0
+
+    return {
+        "id": job["id"],
+        "type": job["type"],
+        "status": job["status"],
+        "target": job.get("target", {}),
+        "progress": {"processed": processed, "expected": expected, "percent": percent},
+        "steps": [
+            {
+                "label": step["label"],
+                "processed": step.get("processed", 0),
+                "expected": step.get("expected") or 0,
+                "done": step.get("done", False)
+            }
+            for step in job.get("steps", [])
+        ],
+        "error": job.get("error"),
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at")
+    }
+
+
+async def get_deletion_job(db, job_id: str) -> Optional[dict]:
+    """Leer un trabajo; si quedó abandonado se vuelve a lanzar (el reclamo decide quién lo toma)"""
+    job = await db.deletion_jobs.find_one({"id": job_id}, {"_id": 0})
+    if job and job["status"] in ("queued", "running"):
+        stale = (datetime.now(timezone.utc) - timedelta(minutes=DELETION_JOB_TIMEOUT_MINUTES)).isoformat()
+        if job["status"] == "queued" or (job.get("heartbeat_at") or "") <= stale:
+            start_deletion_job(db, job_id)
+    return job
+
+
+async def resume_deletion_jobs(db) -> int:
+    """
+    Reanudar los trabajos interrumpidos (p. ej. por un reinicio del servidor).
+    Corre en cada worker; el reclamo atómico de run_deletion_job evita ejecuciones dobles.
+    """
+    pending = await db.deletion_jobs.find(
+        {"status": {"$in": ["queued", "running"]}},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+
+    for job in pending:
+        start_deletion_job(db, job["id"])
+
+    return len(pending)
+
+
+async def ensure_deletion_job_indexes(db) -> None:
+    await db.deletion_jobs.create_index("id", unique=True)
+    await db.deletion_jobs.create_index([("status", 1), ("heartbeat_at", 1)])
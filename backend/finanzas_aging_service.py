@@ -0,0 +1,338 @@
+"""
+Finanzas Aging Service - Antigüedad de cuentas por cobrar y por pagar
+Clasifica los saldos abiertos por días de atraso (al día, 1-30, 31-60, 61-90, 90+)
+con un solo pipeline por tipo: totales por tramo, por cliente/proveedor y por proyecto.
+El detalle se pagina con cursor sobre los campos guardados (due_date o date + id):
+el filtro por tramo se traduce a un rango de fechas y solo la página se clasifica.
+"""
+
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+# Tramos: (clave, etiqueta, límite inferior de días de atraso)
+AGING_BUCKETS = [
+    ("current", "Al día", 0),
+    ("1_30", "1-30 días", 1),
+    ("31_60", "31-60 días", 31),
+    ("61_90", "61-90 días", 61),
+    ("90_plus", "Más de 90 días", 91),
+]
+
+AGING_KINDS = {
+    "receivables": {
+        "collection": "finanzas_incomes",
+        "statuses": ["pending", "partial"],
+        "party": ("client_id", "client_name"),
+        "open_amount": {"$subtract": [
+            {"$ifNull": ["$amount", 0]},
+            {"$ifNull": ["$paid_amount", 0]}
+        ]}
+    },
+    "payables": {
+        "collection": "finanzas_expenses",
+        "statuses": ["pending"],
+        "party": ("vendor_id", "vendor_name"),
+        "open_amount": {"$ifNull": ["$amount", 0]}
+    }
+}
+
+AGING_GROUP_LIMIT = 50
+AGING_PAGE_MAX = 200
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def aging_today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def aging_match(kind: str, company_id: str, workspace_id: str) -> dict:
+    """Filtro de saldos abiertos de la empresa"""
+    return {
+        "company_id": company_id,
+        "workspace_id": workspace_id,
+        "status": {"$in": AGING_KINDS[kind]["statuses"]}
+    }
+
+
+def aging_stages(kind: str, company_id: str, workspace_id: str, today: str) -> List[dict]:
+    """
+    Etapas comunes: saldos abiertos con su vencimiento efectivo (due_date o date),
+    días de atraso y tramo de antigüedad.
+    """
+    return [{"$match": aging_match(kind, company_id, workspace_id)}] + aging_classify_stages(kind, today)
+
+
+def aging_classify_stages(kind: str, today: str) -> List[dict]:
+    """Proyección con vencimiento efectivo, días de atraso y tramo de cada documento"""
+    spec = AGING_KINDS[kind]
+    party_id, party_name = spec["party"]
+
+    bucket_branches = [
+        {"case": {"$gte": ["$days_overdue", lower]}, "then": key}
+        for key, _, lower in reversed(AGING_BUCKETS[1:])
+    ]
+
+    return [
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "description": 1,
+            "date": 1,
+            "due_date": 1,
+            "amount": 1,
+            "paid_amount": 1,
+            "status": 1,
+            "project_id": 1,
+            "project_name": 1,
+            "party_id": f"${party_id}",
+            "party_name": f"${party_name}",
+            "open_amount": {"$round": [spec["open_amount"], 2]},
+            "effective_due": {"$substrCP": [
+                {"$ifNull": [{"$cond": [{"$eq": ["$due_date", ""]}, None, "$due_date"]}, {"$ifNull": ["$date", today]}]},
+                0, 10
+            ]}
+        }},
+        {"$set": {
+            "days_overdue": {"$max": [0, {"$floor": {"$divide": [
+                {"$subtract": [
+                    {"$dateFromString": {"dateString": today}},
+                    {"$dateFromString": {"dateString": "$effective_due", "onError": {"$dateFromString": {"dateString": today}}}}
+                ]},
+                DAY_MS
+            ]}}]}
+        }},
+        {"$set": {
+            "aging_bucket": {"$switch": {"branches": bucket_branches, "default": "current"}}
+        }}
+    ]
+
+
+def bucket_sums() -> dict:
+    """Acumuladores $group con el saldo de cada tramo"""
+    return {
+        key: {"$sum": {"$cond": [{"$eq": ["$aging_bucket", key]}, "$open_amount", 0]}}
+        for key, _, _ in AGING_BUCKETS
+    }
+
+
+def format_group(group: dict, fallback_name: str) -> dict:
+    buckets = {key: round(group.get(key, 0), 2) for key, _, _ in AGING_BUCKETS}
+    return {
+        "id": group["_id"],
+        "name": group.get("name") or fallback_name,
+        "total": round(group["total"], 2),
+        "count": group["count"],
+        "buckets": buckets
+    }
+
+
+async def get_aging_report(
+    db,
+    kind: str,
+    company_id: str,
+    workspace_id: str,
+    group_limit: int = AGING_GROUP_LIMIT
+) -> dict:
+    """Totales exactos de antigüedad por tramo, cliente/proveedor y proyecto (un solo pipeline)"""
+    today = aging_today()
+    spec = AGING_KINDS[kind]
+
+    group_fields = {
+        "name": {"$last": "$party_name"},
+        "total": {"$sum": "$open_amount"},
+        "count": {"$sum": 1},
+        **bucket_sums()
+    }
+
+    pipeline = aging_stages(kind, company_id, workspace_id, today) + [
+        {"$facet": {
+            "buckets": [
+                {"$bucket": {
+                    "groupBy": "$days_overdue",
+                    "boundaries": [lower for _, _, lower in AGING_BUCKETS],
+                    "default": AGING_BUCKETS[-1][2],
+                    "output": {"total": {"$sum": "$open_amount"}, "count": {"$sum": 1}}
+                }}
+            ],
+            "parties": [
+                {"$group": {"_id": {"$ifNull": ["$party_id", "$party_name"]}, **group_fields}},
+                {"$sort": {"total": -1, "_id": 1}},
+                {"$limit": group_limit}
+            ],
+            "party_count": [
+                {"$group": {"_id": {"$ifNull": ["$party_id", "$party_name"]}}},
+                {"$count": "count"}
+            ],
+            "projects": [
+                {"$group": {"_id": "$project_id", **group_fields, "name": {"$last": "$project_name"}}},
+                {"$sort": {"total": -1, "_id": 1}},
+                {"$limit": group_limit}
+            ],
+            "project_count": [
+                {"$group": {"_id": "$project_id"}},
+                {"$count": "count"}
+            ]
+        }}
+    ]
+
+    result = (await db[spec["collection"]].aggregate(pipeline).to_list(1))[0]
+
+    by_lower = {bucket["_id"]: bucket for bucket in result["buckets"]}
+    buckets = []
+    for key, label, lower in AGING_BUCKETS:
+        bucket = by_lower.get(lower, {})
+        buckets.append({
+            "key": key,
+            "label": label,
+            "total": round(bucket.get("total", 0), 2),
+            "count": bucket.get("count", 0)
+        })
+
+    party_count = result["party_count"][0]["count"] if result["party_count"] else 0
+    project_count = result["project_count"][0]["count"] if result["project_count"] else 0
+
+    return {
+        "kind": kind,
+        "company_id": company_id,
+        "as_of": today,
+        "total": round(sum(b["total"] for b in buckets), 2),
+        "count": sum(b["count"] for b in buckets),
+        "buckets": buckets,
+        "parties": [format_group(g, "Sin contacto") for g in result["parties"]],
+        "parties_total": party_count,
+        "projects": [format_group(g, "Sin proyecto") for g in result["projects"]],
+        "projects_total": project_count
+    }
+
+
+# Claves de paginación: con vencimiento (due_date) y sin vencimiento (se usa date)
+AGING_SORT_KEYS = ("due_date", "date")
+NO_DUE_DATE = [None, ""]
+
+
+def bucket_due_range(bucket: str, today: str) -> dict:
+    """
+    Rango de fechas (como texto, comparable con YYYY-MM-DD y con fechas ISO) cuyo
+    vencimiento cae en el tramo: días de atraso entre el límite inferior y el siguiente.
+    """
+    bounds = [lower for _, _, lower in AGING_BUCKETS]
+    position = [key for key, _, _ in AGING_BUCKETS].index(bucket)
+    today_date = datetime.strptime(today, "%Y-%m-%d")
+
+    def days_ago(days: int) -> str:
+        return (today_date - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    if position == 0:
+        return {"$gte": today}
+
+    date_range = {"$lt": days_ago(bounds[position] - 1)}
+    if position + 1 < len(bounds):
+        date_range["$gte"] = days_ago(bounds[position + 1] - 1)
+    return date_range
+
+
+def encode_aging_cursor(item: dict) -> str:
+    """Cursor opaco (vencimiento guardado + id) del último documento de una página"""
+    raw = json.dumps([item.get("sort_key"), item.get("id")])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+
+def decode_aging_cursor(cursor: str) -> Tuple[str, str]:
+    """Leer un cursor; lanza ValueError si es inválido"""
+    try:
+        due, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(due, str) or not isinstance(doc_id, str):
+        raise ValueError("Cursor inválido")
+    return due, doc_id
+
+
+async def get_aging_items(
+    db,
+    kind: str,
+    company_id: str,
+    workspace_id: str,
+    bucket: Optional[str] = None,
+    party_id: Optional[str] = None,
+    project_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50
+) -> dict:
+    """
+    Detalle paginado de saldos abiertos (del más antiguo al más reciente),
+    filtrable por tramo, cliente/proveedor y proyecto.
+    Filtros, cursor, orden y límite se aplican sobre campos guardados e indexados
+    (due_date + id y, sin vencimiento, date + id); los días de atraso y el tramo
+    se calculan solo para los documentos de la página.
+    """
+    today = aging_today()
+    spec = AGING_KINDS[kind]
+    party_field, party_name_field = spec["party"]
+
+    base = aging_match(kind, company_id, workspace_id)
+    conditions = []
+    if party_id:
+        conditions.append({"$or": [
+            {party_field: party_id},
+            {party_field: None, party_name_field: party_id}
+        ]})
+    if project_id:
+        base["project_id"] = project_id
+
+    due_range = bucket_due_range(bucket, today) if bucket else None
+    after = decode_aging_cursor(cursor) if cursor else None
+
+    # Una consulta por clave, cada una ordenada por su índice; se mezclan en memoria
+    pages = []
+    for sort_key in AGING_SORT_KEYS:
+        key_conditions = list(conditions)
+        if sort_key == "due_date":
+            key_conditions.append({"due_date": {"$nin": NO_DUE_DATE}})
+        else:
+            key_conditions.append({"due_date": {"$in": NO_DUE_DATE}})
+        if due_range:
+            key_conditions.append({sort_key: due_range})
+        if after:
+            due, doc_id = after
+            key_conditions.append({"$or": [
+                {sort_key: {"$gt": due}},
+                {sort_key: due, "id": {"$gt": doc_id}}
+            ]})
+
+        pipeline = [
+            {"$match": {**base, "$and": key_conditions}},
+            {"$sort": {sort_key: 1, "id": 1}},
+            {"$limit": limit + 1},
+            {"$set": {"sort_key": f"${sort_key}"}}
+        ]
+        classify = aging_classify_stages(kind, today)
+        classify[0]["$project"]["sort_key"] = 1
+        pages += await db[spec["collection"]].aggregate(pipeline + classify).to_list(limit + 1)
+
+    items = sorted(pages, key=lambda item: (item.get("sort_key") or "", item["id"]))[:limit + 1]
+    has_more = len(items) > limit
+    items = items[:limit]
+    next_cursor = encode_aging_cursor(items[-1]) if has_more else None
+
+    for item in items:
+        item.pop("sort_key", None)
+
+    return {
+        "items": items,
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    }
+
+
+async def ensure_aging_indexes(db) -> None:
+    """Índices de la paginación del detalle: por vencimiento y por fecha"""
+    for kind in AGING_KINDS.values():
+        collection = db[kind["collection"]]
+        for sort_key in AGING_SORT_KEYS:
+            await collection.create_index(
+                [("company_id", 1), ("workspace_id", 1), ("status", 1), (sort_key, 1), ("id", 1)]
+            )
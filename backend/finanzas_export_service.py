@@ -0,0 +1,237 @@
+"""
+Finanzas Export Service - Exportación CSV/XLSX en streaming
+Las filas se leen de un cursor de Motor y se escriben a medida que llegan,
+calculando IGV y totales al vuelo, sin cargar el listado completo en memoria.
+"""
+
+import csv
+import io
+import tempfile
+import unicodedata
+from urllib.parse import quote
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from finanzas_service import IGV_RATE
+
+EXPORT_BATCH_SIZE = 500
+CSV_FLUSH_ROWS = 200
+XLSX_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+# (encabezado, función que obtiene el valor del documento, ¿se suma en la fila de totales?)
+ExportColumn = Tuple[str, Callable[[dict], object], bool]
+
+
+def _money(value) -> float:
+    return round(value or 0, 2)
+
+
+def _income_igv(income: dict) -> float:
+    """IGV de ventas: los ingresos se registran con IGV incluido"""
+    amount = income.get("amount", 0) or 0
+    return amount - amount / (1 + IGV_RATE)
+
+
+def _income_collected(income: dict) -> float:
+    if income.get("status") == "collected":
+        return income.get("amount", 0) or 0
+    return income.get("paid_amount", 0) or 0
+
+
+def _expense_base(expense: dict) -> float:
+    if "base_imponible" in expense:
+        return expense["base_imponible"]
+    return expense.get("amount", 0) or 0
+
+
+INCOME_COLUMNS: List[ExportColumn] = [
+    ("Fecha", lambda d: (d.get("date") or "")[:10], False),
+    ("Descripción", lambda d: d.get("description") or "", False),
+    ("Fuente", lambda d: d.get("source") or "", False),
+    ("Cliente", lambda d: d.get("client_name") or "", False),
+    ("Proyecto", lambda d: d.get("project_name") or "", False),
+    ("Estado", lambda d: d.get("status") or "", False),
+    ("Monto", lambda d: _money(d.get("amount")), True),
+    ("Base imponible", lambda d: _money((d.get("amount", 0) or 0) - _income_igv(d)), True),
+    ("IGV", lambda d: _money(_income_igv(d)), True),
+    ("Cobrado", lambda d: _money(_income_collected(d)), True),
+    ("Pendiente", lambda d: _money((d.get("amount", 0) or 0) - _income_collected(d)), True),
+    ("Vencimiento", lambda d: (d.get("due_date") or "")[:10], False),
+]
+
+EXPENSE_COLUMNS: List[ExportColumn] = [
+    ("Fecha", lambda d: (d.get("date") or "")[:10], False),
+    ("Descripción", lambda d: d.get("description") or "", False),
+    ("Categoría", lambda d: d.get("category") or "", False),
+    ("Proveedor", lambda d: d.get("vendor_name") or "", False),
+    ("Proyecto", lambda d: d.get("project_name") or "", False),
+    ("Estado", lambda d: d.get("status") or "", False),
+    ("Prioridad", lambda d: d.get("priority") or "", False),
+    ("Incluye IGV", lambda d: "Sí" if d.get("includes_igv") else "No", False),
+    ("Monto", lambda d: _money(d.get("amount")), True),
+    ("Base imponible", lambda d: _money(_expense_base(d)), True),
+    ("IGV", lambda d: _money(d.get("igv_gasto")), True),
+    ("Vencimiento", lambda d: (d.get("due_date") or "")[:10], False),
+]
+
+INVESTMENT_COLUMNS: List[ExportColumn] = [
+    ("Fecha", lambda d: (d.get("date") or "")[:10], False),
+    ("Descripción", lambda d: d.get("description") or "", False),
+    ("Proyecto", lambda d: d.get("project_name") or "", False),
+    ("Estado", lambda d: d.get("status") or "", False),
+    ("Objetivo", lambda d: d.get("objective") or "", False),
+    ("Monto", lambda d: _money(d.get("amount")), True),
+    ("Retorno esperado", lambda d: _money(d.get("expected_return")), True),
+    ("Retorno real", lambda d: _money(d.get("actual_return")), True),
+]
+
+# Vista Balance General: movimientos de caja (ingresos cobrados y gastos pagados) con saldo acumulado
+BALANCE_COLUMNS: List[ExportColumn] = [
+    ("Fecha", lambda d: (d.get("date") or "")[:10], False),
+    ("Tipo", lambda d: "Ingreso" if d["kind"] == "income" else "Gasto", False),
+    ("Descripción", lambda d: d.get("description") or "", False),
+    ("Proyecto", lambda d: d.get("project_name") or "", False),
+    ("Ingreso", lambda d: _money(d["inflow"]), True),
+    ("Gasto", lambda d: _money(d["outflow"]), True),
+    ("Saldo", lambda d: _money(d["balance"]), False),
+]
+
+EXPORT_COLUMNS = {
+    "incomes": INCOME_COLUMNS,
+    "expenses": EXPENSE_COLUMNS,
+    "investments": INVESTMENT_COLUMNS,
+    "balance": BALANCE_COLUMNS,
+}
+
+
+async def iter_cursor(collection, query: dict, sort: list) -> AsyncIterator[dict]:
+    """Recorrer un cursor de Motor por lotes, ordenado"""
+    cursor = collection.find(query, {"_id": 0}).sort(sort).batch_size(EXPORT_BATCH_SIZE)
+    async for doc in cursor:
+        yield doc
+
+
+async def iter_balance_movements(db, income_query: dict, expense_query: dict) -> AsyncIterator[dict]:
+    """
+    Fusionar por fecha los ingresos cobrados y los gastos pagados (dos cursores ordenados)
+    y calcular el saldo acumulado al vuelo.
+    """
+    incomes = iter_cursor(db.finanzas_incomes, income_query, [("date", 1), ("id", 1)])
+    expenses = iter_cursor(db.finanzas_expenses, expense_query, [("date", 1), ("id", 1)])
+
+    async def next_or_none(iterator):
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    income = await next_or_none(incomes)
+    expense = await next_or_none(expenses)
+    balance = 0.0
+
+    while income is not None or expense is not None:
+        take_income = expense is None or (income is not None and (income.get("date") or "") <= (expense.get("date") or ""))
+
+        if take_income:
+            inflow, outflow = _income_collected(income), 0
+            row = {**income, "kind": "income",
+                   "description": income.get("description") or income.get("source", "Ingreso")}
+            income = await next_or_none(incomes)
+        else:
+            inflow, outflow = 0, expense.get("amount", 0) or 0
+            row = {**expense, "kind": "expense", "description": expense.get("description") or "Gasto"}
+            expense = await next_or_none(expenses)
+
+        balance += inflow - outflow
+        yield {**row, "inflow": inflow, "outflow": outflow, "balance": balance}
+
+
+async def iter_export_rows(columns: List[ExportColumn], docs: AsyncIterator[dict]) -> AsyncIterator[list]:
+    """Encabezado, una fila por documento y una fila final de totales"""
+    yield [header for header, _, _ in columns]
+
+    totals = [0.0] * len(columns)
+    async for doc in docs:
+        row = []
+        for index, (_, getter, summable) in enumerate(columns):
+            value = getter(doc)
+            if summable:
+                totals[index] += value
+            row.append(value)
+        yield row
+
+    total_row = [round(total, 2) if summable else "" for total, (_, _, summable) in zip(totals, columns)]
+    total_row[0] = "TOTAL"
+    yield total_row
+
+
+async def stream_csv(rows: AsyncIterator[list]) -> AsyncIterator[bytes]:
+    """Escribir las filas como CSV, enviando bytes cada pocas filas"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM para que Excel detecte UTF-8
+    # El encabezado se envía de inmediato; luego, por bloques de filas
+    pending = CSV_FLUSH_ROWS - 1
+
+    async for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= CSV_FLUSH_ROWS:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def stream_xlsx(rows: AsyncIterator[list], sheet_title: str) -> AsyncIterator[bytes]:
+    """
+    Escribir las filas en un libro XLSX en modo write_only (memoria constante)
+    y enviarlo por bloques. El formato ZIP exige cerrar el libro antes de enviarlo.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title[:31])
+
+    async for row in rows:
+        sheet.append(row)
+
+    with tempfile.SpooledTemporaryFile(max_size=XLSX_CHUNK_SIZE * 16) as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(XLSX_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_export(kind: str, export_format: str, docs: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Elegir el escritor según el formato pedido"""
+    rows = iter_export_rows(EXPORT_COLUMNS[kind], docs)
+    if export_format == "xlsx":
+        return stream_xlsx(rows, kind)
+    return stream_csv(rows)
+
+
+def export_filename(kind: str, export_format: str, company_name: Optional[str] = None) -> str:
+    """Nombre de archivo sugerido para la descarga"""
+    prefix = "".join(c if c.isalnum() else "_" for c in (company_name or "finanzas")).strip("_") or "finanzas"
+    return f"{prefix}_{kind}.{export_format}"
+
+
+def export_content_disposition(filename: str) -> str:
+    """
+    Cabecera Content-Disposition de la descarga: nombre ASCII de respaldo (sin tildes;
+    otros caracteres como "_") y el nombre completo en UTF-8 según RFC 5987.
+    """
+    ascii_name = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    ascii_name = "".join(c if c.isalnum() or c in "._-" else "_" for c in ascii_name) or "finanzas"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename, safe='')}"
@@ -0,0 +1,353 @@
+"""
+Finanzas Forecast Service - Proyección de caja
+Expande los gastos fijos activos en vencimientos fechados dentro de un horizonte
+y los combina con cuentas por cobrar y por pagar en un saldo diario proyectado.
+Las fechas se calculan de forma vectorizada con NumPy (datetime64).
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional, List
+
+import numpy as np
+
+from cache_service import TTLCache
+
+# Periodicidades con paso fijo en días
+FORECAST_DAY_STEPS = {
+    "semanal": 7,
+    "quincenal": 15
+}
+
+# Periodicidades con paso en meses
+FORECAST_MONTH_STEPS = {
+    "mensual": 1,
+    "trimestral": 3,
+    "anual": 12
+}
+
+DEFAULT_CUSTOM_DAYS = 30
+MAX_FORECAST_DAYS = 730
+
+FORECAST_CACHE_MAX_ENTRIES = 2000
+FORECAST_CACHE_TTL_SECONDS = 3600
+
+# Proyecciones con saldo inicial 0: {(company_id, workspace_id, hoy, horizonte): (resultado, saldos)}
+# El saldo inicial lo envía el cliente y se aplica después de leer el cache
+_forecast_cache = TTLCache(
+    FORECAST_CACHE_MAX_ENTRIES, FORECAST_CACHE_TTL_SECONDS,
+    indexes={"company": lambda key: key[0]}
+)
+
+
+def invalidate_forecast(company_id: Optional[str] = None) -> None:
+    """Descartar las proyecciones de una empresa (o de todas) al cambiar sus datos"""
+    if company_id is None:
+        _forecast_cache.clear()
+    else:
+        _forecast_cache.invalidate("company", company_id)
+
+
+def forecast_today() -> np.datetime64:
+    """Fecha actual (UTC) como datetime64 de días"""
+    return np.datetime64(datetime.now(timezone.utc).strftime("%Y-%m-%d"), "D")
+
+
+def parse_forecast_date(value) -> Optional[np.datetime64]:
+    """Convertir una fecha ISO (YYYY-MM-DD o con hora) a datetime64 de días"""
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return np.datetime64(value[:10], "D")
+    except ValueError:
+        return None
+
+
+def first_fixed_expense_due(fixed_expense: dict, today: np.datetime64) -> Optional[np.datetime64]:
+    """
+    Primer vencimiento pendiente de un gasto fijo: next_due_date, o el día del mes
+    configurado (este mes o el siguiente) si el gasto no tiene fecha.
+    """
+    first = parse_forecast_date(fixed_expense.get("next_due_date"))
+    if first is not None:
+        return first
+
+    day_of_month = fixed_expense.get("day_of_month")
+    if not day_of_month:
+        return None
+
+    month = today.astype("datetime64[M]")
+    candidate = month.astype("datetime64[D]") + (min(day_of_month, 28) - 1)
+    if candidate < today:
+        candidate = (month + 1).astype("datetime64[D]") + (min(day_of_month, 28) - 1)
+    return candidate
+
+
+def expand_fixed_expense(fixed_expense: dict, today: np.datetime64, end: np.datetime64) -> np.ndarray:
+    """
+    Fechas de vencimiento de un gasto fijo desde su primer vencimiento pendiente hasta `end` (exclusivo).
+    Los pasos mensuales se anclan al día original (recortado al fin de mes);
+    en los gastos mensuales day_of_month se recorta a 28.
+    """
+    first = first_fixed_expense_due(fixed_expense, today)
+    if first is None or first >= end:
+        return np.array([], dtype="datetime64[D]")
+
+    periodicity = fixed_expense.get("periodicity", "mensual")
+
+    if periodicity in FORECAST_MONTH_STEPS:
+        step = FORECAST_MONTH_STEPS[periodicity]
+        first_month = first.astype("datetime64[M]")
+        span = int((end.astype("datetime64[M]") - first_month).astype(int))
+        months = first_month + np.arange(0, span // step + 1) * step
+
+        day = int((first - first_month.astype("datetime64[D]")).astype(int)) + 1
+        if periodicity == "mensual" and fixed_expense.get("day_of_month"):
+            day = min(fixed_expense["day_of_month"], 28)
+
+        month_ends = (months + 1).astype("datetime64[D]") - 1
+        dates = np.minimum(months.astype("datetime64[D]") + (day - 1), month_ends)
+        dates[0] = first
+    else:
+        if periodicity == "personalizada":
+            step = fixed_expense.get("custom_days") or DEFAULT_CUSTOM_DAYS
+        else:
+            step = FORECAST_DAY_STEPS.get(periodicity, DEFAULT_CUSTOM_DAYS)
+        count = int((end - first).astype(int)) // step + 1
+        dates = first + np.arange(count) * step
+
+    return dates[dates < end]
+
+
+def fixed_expense_step_days(fixed_expense: dict) -> int:
+    """Cota superior en días de un periodo del gasto fijo (para dimensionar rangos)"""
+    periodicity = fixed_expense.get("periodicity", "mensual")
+    if periodicity in FORECAST_MONTH_STEPS:
+        return FORECAST_MONTH_STEPS[periodicity] * 31
+    if periodicity == "personalizada":
+        return fixed_expense.get("custom_days") or DEFAULT_CUSTOM_DAYS
+    return FORECAST_DAY_STEPS.get(periodicity, DEFAULT_CUSTOM_DAYS)
+
+
+def format_due_date(date: np.datetime64, template: Optional[str]) -> str:
+    """Escribir una fecha conservando la hora/zona del valor original (si la tenía)"""
+    suffix = template[10:] if template and len(template) > 10 else ""
+    return f"{date}{suffix}"
+
+
+def next_fixed_expense_due(fixed_expense: dict) -> Optional[str]:
+    """Vencimiento siguiente a next_due_date (avance de un periodo)"""
+    current = parse_forecast_date(fixed_expense.get("next_due_date"))
+    if current is None:
+        return None
+
+    dates = expand_fixed_expense(fixed_expense, current, current + 2 * fixed_expense_step_days(fixed_expense) + 1)
+    following = dates[dates > current]
+    if following.size == 0:
+        return None
+    return format_due_date(following[0], fixed_expense.get("next_due_date"))
+
+
+def catch_up_fixed_expense(fixed_expense: dict, today: np.datetime64) -> Optional[dict]:
+    """
+    Calcular de una vez los periodos vencidos de un gasto fijo cuyo next_due_date ya pasó.
+    Retorna {"missed_periods": [...], "next_due_date": ...} o None si está al día.
+    """
+    first = parse_forecast_date(fixed_expense.get("next_due_date"))
+    if first is None or first >= today:
+        return None
+
+    dates = expand_fixed_expense(fixed_expense, today, today + 2 * fixed_expense_step_days(fixed_expense) + 1)
+    upcoming = dates[dates >= today]
+    if upcoming.size == 0:
+        return None
+
+    return {
+        "missed_periods": [str(date) for date in dates[dates < today]],
+        "next_due_date": format_due_date(upcoming[0], fixed_expense.get("next_due_date"))
+    }
+
+
+def bucket_by_day(dates: np.ndarray, amounts: np.ndarray, today: np.datetime64, horizon_days: int) -> np.ndarray:
+    """Sumar montos por día del horizonte; lo vencido se acumula en el día de hoy"""
+    if dates.size == 0:
+        return np.zeros(horizon_days)
+
+    offsets = np.clip((dates - today).astype(int), 0, None)
+    inside = offsets < horizon_days
+    return np.bincount(offsets[inside], weights=amounts[inside], minlength=horizon_days)
+
+
+def build_cash_forecast(
+    fixed_expenses: List[dict],
+    receivables: List[dict],
+    payables: List[dict],
+    today: np.datetime64,
+    horizon_days: int,
+    opening_balance: float = 0.0
+) -> dict:
+    """Construir la proyección diaria de caja a partir de los movimientos pendientes"""
+    return apply_opening_balance(
+        *project_cash_flow(fixed_expenses, receivables, payables, today, horizon_days), opening_balance
+    )
+
+
+def project_cash_flow(
+    fixed_expenses: List[dict],
+    receivables: List[dict],
+    payables: List[dict],
+    today: np.datetime64,
+    horizon_days: int
+) -> tuple:
+    """
+    Flujos diarios proyectados sin saldos.
+    Retorna (proyección, neto acumulado por día) para completar con apply_opening_balance.
+    """
+    end = today + horizon_days
+
+    # Vencimientos de gastos fijos
+    occurrences = []
+    fixed_dates, fixed_amounts = [], []
+    for fixed_expense in fixed_expenses:
+        overdue = [parse_forecast_date(d) for d in fixed_expense.get("overdue_periods") or []]
+        dates = np.concatenate([
+            np.array([d for d in overdue if d is not None], dtype="datetime64[D]"),
+            expand_fixed_expense(fixed_expense, today, end)
+        ])
+        if dates.size == 0:
+            continue
+        amount = fixed_expense.get("estimated_amount", 0) or 0
+        fixed_dates.append(dates)
+        fixed_amounts.append(np.full(dates.size, amount, dtype=float))
+        occurrences.extend(
+            {
+                "fixed_expense_id": fixed_expense.get("id"),
+                "name": fixed_expense.get("name"),
+                "date": str(max(date, today)),
+                "amount": amount,
+                "overdue": bool(date < today)
+            }
+            for date in dates
+        )
+
+    fixed_daily = bucket_by_day(
+        np.concatenate(fixed_dates) if fixed_dates else np.array([], dtype="datetime64[D]"),
+        np.concatenate(fixed_amounts) if fixed_amounts else np.array([]),
+        today, horizon_days
+    )
+
+    def movement_daily(movements: List[dict], amount_of) -> np.ndarray:
+        dated = [
+            (parse_forecast_date(m.get("due_date")) or parse_forecast_date(m.get("date")), amount_of(m))
+            for m in movements
+        ]
+        dated = [(d, a) for d, a in dated if d is not None]
+        return bucket_by_day(
+            np.array([d for d, _ in dated], dtype="datetime64[D]"),
+            np.array([a for _, a in dated], dtype=float),
+            today, horizon_days
+        )
+
+    receivables_daily = movement_daily(
+        receivables, lambda m: (m.get("amount", 0) or 0) - (m.get("paid_amount", 0) or 0)
+    )
+    payables_daily = movement_daily(payables, lambda m: m.get("amount", 0) or 0)
+
+    net_daily = receivables_daily - payables_daily - fixed_daily
+    days = np.arange(today, end, dtype="datetime64[D]")
+
+    daily = [
+        {
+            "date": str(days[i]),
+            "receivables": round(float(receivables_daily[i]), 2),
+            "payables": round(float(payables_daily[i]), 2),
+            "fixed_expenses": round(float(fixed_daily[i]), 2),
+            "net": round(float(net_daily[i]), 2)
+        }
+        for i in range(horizon_days)
+    ]
+
+    occurrences.sort(key=lambda o: o["date"])
+
+    forecast = {
+        "start_date": str(today),
+        "end_date": str(end),
+        "horizon_days": horizon_days,
+        "totals": {
+            "receivables": round(float(receivables_daily.sum()), 2),
+            "payables": round(float(payables_daily.sum()), 2),
+            "fixed_expenses": round(float(fixed_daily.sum()), 2),
+            "net": round(float(net_daily.sum()), 2)
+        },
+        "fixed_expense_occurrences": occurrences,
+        "daily": daily
+    }
+    return forecast, np.cumsum(net_daily)
+
+
+def apply_opening_balance(forecast: dict, cumulative: np.ndarray, opening_balance: float) -> dict:
+    """
+    Completar una proyección con los saldos diarios a partir del saldo inicial.
+    `cumulative` es el neto acumulado por día; no modifica `forecast` (puede venir del cache).
+    """
+    balance = opening_balance + cumulative
+    horizon_days = len(forecast["daily"])
+    lowest = int(np.argmin(balance)) if horizon_days else 0
+
+    daily = [
+        {**day, "balance": round(float(balance[i]), 2)}
+        for i, day in enumerate(forecast["daily"])
+    ]
+
+    return {
+        **forecast,
+        "opening_balance": opening_balance,
+        "totals": {
+            **forecast["totals"],
+            "closing_balance": round(float(balance[-1]), 2) if horizon_days else opening_balance
+        },
+        "lowest_balance": {
+            "date": daily[lowest]["date"],
+            "balance": daily[lowest]["balance"]
+        } if horizon_days else None,
+        "daily": daily
+    }
+
+
+async def get_cash_forecast(
+    db,
+    company_id: str,
+    workspace_id: str,
+    horizon_days: int = 90,
+    opening_balance: float = 0.0
+) -> dict:
+    """Proyección de caja de una empresa, cacheada hasta que cambien sus movimientos o gastos fijos"""
+    today = forecast_today()
+    cache_key = (company_id, workspace_id, str(today), horizon_days)
+
+    cached = _forecast_cache.get(cache_key)
+    if cached is not None:
+        return apply_opening_balance(*cached, opening_balance)
+
+    base = {"company_id": company_id, "workspace_id": workspace_id}
+    fixed_expenses, receivables, payables = await asyncio.gather(
+        db.finanzas_fixed_expenses.find(
+            {**base, "status": "activo"},
+            {"_id": 0, "id": 1, "name": 1, "estimated_amount": 1, "periodicity": 1,
+             "custom_days": 1, "next_due_date": 1, "day_of_month": 1, "overdue_periods": 1}
+        ).to_list(None),
+        db.finanzas_incomes.find(
+            {**base, "status": {"$in": ["pending", "partial"]}},
+            {"_id": 0, "amount": 1, "paid_amount": 1, "due_date": 1, "date": 1}
+        ).to_list(None),
+        db.finanzas_expenses.find(
+            {**base, "status": "pending"},
+            {"_id": 0, "amount": 1, "due_date": 1, "date": 1}
+        ).to_list(None)
+    )
+
+    forecast, cumulative = project_cash_flow(fixed_expenses, receivables, payables, today, horizon_days)
+    forecast["company_id"] = company_id
+
+    _forecast_cache.set(cache_key, (forecast, cumulative))
+    return apply_opening_balance(forecast, cumulative, opening_balance)
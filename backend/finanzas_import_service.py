@@ -0,0 +1,304 @@
+"""
+Finanzas Import Service - Importación masiva de ingresos y gastos desde CSV
+Lee el archivo fila por fila, valida por bloques contra IncomeCreate/ExpenseCreate,
+resuelve categorías y contactos en lote y escribe con insert_many.
+"""
+
+import csv
+import io
+import re
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from finanzas_service import (
+    IncomeCreate, ExpenseCreate,
+    DEFAULT_EXPENSE_CATEGORIES, DEFAULT_INCOME_SOURCES,
+    build_income_document, build_expense_document,
+    generate_id, get_current_timestamp
+)
+from finanzas_ledger_service import is_ledger_built, ledger_write, rebuild_company_ledger, record_ledger_changes
+from finanzas_forecast_service import invalidate_forecast
+from finanzas_tax_service import invalidate_tax_period
+from search_service import normalize_search_text
+
+IMPORT_CHUNK_SIZE = 1000
+MAX_IMPORT_ROWS = 50000
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_KINDS = {
+    "incomes": {
+        "model": IncomeCreate,
+        "build": build_income_document,
+        "collection": "finanzas_incomes",
+        "category_field": "source",
+        "category_type": "income",
+        "defaults": DEFAULT_INCOME_SOURCES,
+        "contact_field": ("client_name", "client_id"),
+    },
+    "expenses": {
+        "model": ExpenseCreate,
+        "build": build_expense_document,
+        "collection": "finanzas_expenses",
+        "category_field": "category",
+        "category_type": "expense",
+        "defaults": DEFAULT_EXPENSE_CATEGORIES,
+        "contact_field": ("vendor_name", "vendor_id"),
+    },
+}
+
+# Encabezados aceptados (además de los nombres de campo), incluidos los de la exportación
+HEADER_ALIASES = {
+    "fecha": "date",
+    "descripción": "description",
+    "descripcion": "description",
+    "monto": "amount",
+    "fuente": "source",
+    "cliente": "client_name",
+    "proyecto": "project_name",
+    "estado": "status",
+    "cobrado": "paid_amount",
+    "vencimiento": "due_date",
+    "categoría": "category",
+    "categoria": "category",
+    "proveedor": "vendor_name",
+    "prioridad": "priority",
+    "incluye igv": "includes_igv",
+    "notas": "notes",
+}
+
+# Valores de estado en español (como los muestra la interfaz)
+STATUS_ALIASES = {
+    "cobrado": "collected",
+    "por cobrar": "pending",
+    "parcial": "partial",
+    "pagado": "paid",
+    "por pagar": "pending",
+    "pendiente": "pending",
+}
+
+TRUE_VALUES = {"1", "true", "si", "sí", "yes", "x"}
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+def normalize_header(header: str) -> str:
+    key = (header or "").strip().lower()
+    return HEADER_ALIASES.get(key, key)
+
+
+def clean_row(raw: dict) -> dict:
+    """Normalizar encabezados y valores de una fila del CSV (vacíos se omiten)"""
+    row = {}
+    for header, value in raw.items():
+        if header is None or value is None:
+            continue
+        value = value.strip()
+        if value == "":
+            continue
+        row[normalize_header(header)] = value
+
+    if "status" in row:
+        row["status"] = STATUS_ALIASES.get(row["status"].lower(), row["status"].lower())
+    if "priority" in row:
+        row["priority"] = row["priority"].lower()
+    if "includes_igv" in row:
+        row["includes_igv"] = row["includes_igv"].lower() in TRUE_VALUES
+    for field in ("amount", "paid_amount"):
+        if field in row:
+            row[field] = row[field].replace(",", "")
+    return row
+
+
+def format_validation_error(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(p) for p in e['loc'])}: {e['msg']}" for e in error.errors()]
+
+
+async def load_category_map(db, workspace_id: str, spec: dict) -> Dict[str, str]:
+    """Categorías/fuentes conocidas por id y por nombre (en minúsculas) → id"""
+    categories = list(spec["defaults"])
+    categories += await db.finanzas_categories.find(
+        {"workspace_id": workspace_id, "type": spec["category_type"]},
+        {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+
+    mapping = {}
+    for category in categories:
+        mapping[category["id"].lower()] = category["id"]
+        mapping[(category.get("name") or "").strip().lower()] = category["id"]
+    return mapping
+
+
+async def resolve_chunk_contacts(db, company_id: str, rows: List[dict], name_field: str, id_field: str) -> None:
+    """
+    Resolver los contactos de un bloque con una consulta $in por los ids y nombres presentes.
+    Un id que no pertenece a la empresa se descarta; un nombre completo (sin tildes ni
+    mayúsculas, como search_name) se reemplaza por el id del contacto.
+    """
+    ids = {row[id_field] for row in rows if row.get(id_field)}
+    names = {
+        normalize_search_text(row[name_field])
+        for row in rows if row.get(name_field) and not row.get(id_field)
+    }
+    if not ids and not names:
+        return
+
+    conditions = []
+    if ids:
+        conditions.append({"id": {"$in": list(ids)}})
+    if names:
+        conditions.append({"search_name": {"$in": list(names)}})
+
+    known_ids, by_name = set(), {}
+    cursor = db.contacts.find(
+        {"company_id": company_id, "$or": conditions},
+        {"_id": 0, "id": 1, "search_name": 1}
+    ).sort("created_at", 1)
+    async for contact in cursor:
+        known_ids.add(contact["id"])
+        if contact.get("search_name"):
+            by_name.setdefault(contact["search_name"], contact["id"])
+
+    for row in rows:
+        if row.get(id_field) and row[id_field] not in known_ids:
+            del row[id_field]
+        if row.get(name_field) and id_field not in row:
+            contact_id = by_name.get(normalize_search_text(row[name_field]))
+            if contact_id:
+                row[id_field] = contact_id
+
+
+async def import_movements_csv(
+    db,
+    kind: str,
+    file,
+    company_id: str,
+    workspace_id: str,
+    username: str,
+    dry_run: bool = False
+) -> dict:
+    """
+    Importar ingresos o gastos desde un CSV (archivo binario).
+    Retorna el resumen con las filas importadas y el reporte de errores por fila.
+    """
+    spec = IMPORT_KINDS[kind]
+    model = spec["model"]
+    category_field = spec["category_field"]
+    name_field, id_field = spec["contact_field"]
+
+    category_map = await load_category_map(db, workspace_id, spec)
+    # Categorías desconocidas del archivo; solo se crean las de filas importadas
+    new_categories: Dict[str, dict] = {}
+    created_categories: Dict[str, dict] = {}
+
+    reader = csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+
+    errors: List[dict] = []
+    error_count = 0
+    imported = 0
+    total_amount = 0.0
+    row_count = 0
+    chunk: List[Tuple[int, dict, Optional[str]]] = []
+    now = get_current_timestamp()
+
+    async def flush(pending: List[Tuple[int, dict, Optional[str]]]):
+        nonlocal imported, total_amount, error_count
+        documents = []
+
+        # Contacto (cliente/proveedor) por id o nombre completo, una consulta por bloque
+        await resolve_chunk_contacts(db, company_id, [row for _, row, _ in pending], name_field, id_field)
+
+        for line, row, new_category_key in pending:
+            try:
+                data = model(**{**row, "company_id": company_id})
+            except ValidationError as e:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": line, "errors": format_validation_error(e)})
+                continue
+
+            document = spec["build"](data, workspace_id, username, now)
+            documents.append(document)
+            total_amount += document.get("amount", 0) or 0
+            if new_category_key:
+                created_categories[new_category_key] = new_categories[new_category_key]
+
+        if documents and not dry_run:
+            # El cambio se registra antes de cerrar la escritura: una construcción del libro
+            # en curso vuelve a agregar en lugar de publicar sin este bloque
+            async with ledger_write(db):
+                await db[spec["collection"]].insert_many(documents, ordered=False)
+                await record_ledger_changes(db, company_id)
+        imported += len(documents)
+
+    for line, raw in enumerate(reader, start=2):  # la fila 1 es el encabezado
+        row = clean_row(raw)
+        if not row:
+            continue
+        if row.get("date", "").upper() == "TOTAL":
+            continue  # fila de totales de una exportación
+
+        row_count += 1
+        if row_count > MAX_IMPORT_ROWS:
+            error_count += 1
+            errors.append({"row": line, "errors": [f"Se superó el máximo de {MAX_IMPORT_ROWS} filas por archivo"]})
+            break
+
+        if "date" in row and not DATE_PATTERN.match(row["date"]):
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"row": line, "errors": ["date: formato esperado YYYY-MM-DD"]})
+            continue
+
+        # Categoría / fuente: por id o nombre; las desconocidas se crean como personalizadas
+        category = row.get(category_field)
+        new_category_key = None
+        if category:
+            key = category.lower()
+            if key in new_categories:
+                new_category_key = key
+            elif key not in category_map:
+                new_category = {
+                    "id": generate_id(),
+                    "workspace_id": workspace_id,
+                    "type": spec["category_type"],
+                    "name": category,
+                    "color": "#6B7280",
+                    "is_default": False,
+                    "created_at": now
+                }
+                new_categories[key] = new_category
+                category_map[key] = new_category["id"]
+                new_category_key = key
+            row[category_field] = category_map[key]
+
+        chunk.append((line, row, new_category_key))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+
+    if chunk:
+        await flush(chunk)
+
+    errors.sort(key=lambda e: e["row"])
+
+    if created_categories and not dry_run:
+        await db.finanzas_categories.insert_many(list(created_categories.values()), ordered=False)
+
+    # El libro mensual se reconstruye una sola vez (en lugar de un $inc por fila)
+    if imported and not dry_run:
+        if await is_ledger_built(db, company_id):
+            await rebuild_company_ledger(db, company_id)
+        invalidate_forecast(company_id)
+        invalidate_tax_period(company_id)
+
+    return {
+        "kind": kind,
+        "dry_run": dry_run,
+        "rows": row_count,
+        "imported": imported,
+        "failed": error_count,
+        "total_amount": round(total_amount, 2),
+        "created_categories": [c["name"] for c in created_categories.values()],
+        "errors": errors,
+        "errors_truncated": error_count > len(errors)
+    }
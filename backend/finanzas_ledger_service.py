@@ -0,0 +1,459 @@
+"""
+Finanzas Ledger Service - Libro mensual incremental por empresa
+Mantiene totales acumulados por (empresa, workspace, mes, tipo, proyecto, estado, categoría)
+para que los dashboards lean pocos documentos en lugar de todos los movimientos.
+
+Uso como comando de recuperación:
+    python finanzas_ledger_service.py              # reconstruye todas las empresas
+    python finanzas_ledger_service.py <company_id> # reconstruye una empresa
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Dict, List
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# Colección de origen por tipo de movimiento
+LEDGER_SOURCES = {
+    "income": "finanzas_incomes",
+    "expense": "finanzas_expenses",
+    "investment": "finanzas_investments"
+}
+
+# Campo usado como categoría en el libro según el tipo de movimiento
+LEDGER_CATEGORY_FIELDS = {
+    "income": "source",
+    "expense": "category",
+    "investment": None
+}
+
+# Una construcción en curso más antigua que esto se considera abandonada y puede reclamarse
+LEDGER_BUILD_TIMEOUT_MINUTES = 10
+
+# Intentos de construcción cuando llegan cambios mientras se agregan los movimientos
+LEDGER_BUILD_ATTEMPTS = 3
+
+# Una escritura de movimientos abierta por más tiempo se considera abandonada
+LEDGER_WRITE_TIMEOUT_SECONDS = 60
+LEDGER_WRITE_POLL_SECONDS = 0.05
+
+
+def _plain(value):
+    """Normalizar enums a su valor string"""
+    return getattr(value, "value", value)
+
+
+def ledger_entry(kind: str, doc: Optional[dict]) -> Optional[tuple]:
+    """
+    Calcular la clave del libro y los incrementos que aporta un movimiento.
+    Retorna (key, deltas, project_name) o None si el movimiento no aplica.
+    """
+    if not doc or not doc.get("company_id") or not doc.get("date"):
+        return None
+    
+    category_field = LEDGER_CATEGORY_FIELDS[kind]
+    
+    key = {
+        "company_id": doc["company_id"],
+        "workspace_id": doc.get("workspace_id"),
+        "kind": kind,
+        "month": doc["date"][:7],
+        "project_id": doc.get("project_id"),
+        "status": _plain(doc.get("status")),
+        "category": doc.get(category_field) if category_field else None
+    }
+    
+    deltas = {
+        "amount": doc.get("amount", 0) or 0,
+        "paid_amount": (doc.get("paid_amount", 0) or 0) if kind == "income" else 0,
+        "count": 1
+    }
+    
+    return key, deltas, doc.get("project_name")
+
+
+async def get_ledger_version(db, company_id: str) -> Optional[int]:
+    """
+    Versión activa del libro de una empresa (None si aún no fue construido).
+    Las entradas del libro llevan la versión de la construcción que las generó;
+    solo se leen las de la versión activa.
+    """
+    state = await db.finanzas_ledger_state.find_one({"company_id": company_id}, {"_id": 0, "version": 1})
+    return state.get("version") if state else None
+
+
+async def is_ledger_built(db, company_id: str) -> bool:
+    """Verificar si el libro de una empresa ya fue construido"""
+    return await get_ledger_version(db, company_id) is not None
+
+
+@asynccontextmanager
+async def ledger_write(db):
+    """
+    Envolver la escritura de un movimiento y su apply_ledger_change.
+    Mientras el bloque está abierto queda registrado en finanzas_ledger_writes: una
+    construcción no publica su versión hasta que terminan las escrituras abiertas
+    durante su agregación, de modo que un movimiento ya agregado no vuelve a sumarse
+    con un apply_ledger_change que llega después de publicar.
+    """
+    token = uuid.uuid4().hex
+    await db.finanzas_ledger_writes.insert_one({
+        "id": token,
+        "started_at": datetime.now(timezone.utc).isoformat()
+    })
+    try:
+        yield
+    finally:
+        await db.finanzas_ledger_writes.delete_one({"id": token})
+
+
+async def wait_for_ledger_writes(db) -> None:
+    """Esperar a que terminen las escrituras abiertas ahora (las abandonadas se descartan)"""
+    now = datetime.now(timezone.utc)
+    deadline = now + timedelta(seconds=LEDGER_WRITE_TIMEOUT_SECONDS)
+    stale = (now - timedelta(seconds=LEDGER_WRITE_TIMEOUT_SECONDS)).isoformat()
+    await db.finanzas_ledger_writes.delete_many({"started_at": {"$lte": stale}})
+    
+    open_writes = [w["id"] async for w in db.finanzas_ledger_writes.find({}, {"_id": 0, "id": 1})]
+    while open_writes and datetime.now(timezone.utc) < deadline:
+        await asyncio.sleep(LEDGER_WRITE_POLL_SECONDS)
+        open_writes = [
+            w["id"] async for w in db.finanzas_ledger_writes.find({"id": {"$in": open_writes}}, {"_id": 0, "id": 1})
+        ]
+
+
+async def apply_ledger_change(db, kind: str, before: Optional[dict], after: Optional[dict]) -> None:
+    """
+    Aplicar al libro el cambio de un movimiento (alta, edición o baja).
+    Resta el aporte anterior y suma el nuevo con $inc atómicos sobre la versión activa.
+    Cada cambio incrementa `changes` en el estado del libro: una construcción en curso
+    lo detecta al terminar y vuelve a agregar en lugar de publicar totales sin el cambio.
+    Si el libro de la empresa aún no existe, solo se registra el cambio.
+    Debe llamarse dentro del bloque ledger_write que envuelve la escritura del movimiento.
+    """
+    old = ledger_entry(kind, before)
+    new = ledger_entry(kind, after)
+    
+    entry = new or old
+    if not entry:
+        return
+    company_id = entry[0]["company_id"]
+    
+    state = await db.finanzas_ledger_state.find_one_and_update(
+        {"company_id": company_id},
+        {"$inc": {"changes": 1}},
+        projection={"_id": 0, "version": 1}
+    )
+    version = state.get("version") if state else None
+    if version is None:
+        return
+    
+    now = datetime.now(timezone.utc).isoformat()
+    increments: Dict[tuple, dict] = {}
+    names: Dict[tuple, Optional[str]] = {}
+    keys: Dict[tuple, dict] = {}
+    
+    for entry, sign in ((old, -1), (new, 1)):
+        if not entry:
+            continue
+        key, deltas, project_name = entry
+        hashable = tuple(sorted(key.items()))
+        keys[hashable] = {**key, "version": version}
+        current = increments.setdefault(hashable, {"amount": 0, "paid_amount": 0, "count": 0})
+        for field, value in deltas.items():
+            current[field] += sign * value
+        if sign > 0 and project_name:
+            names[hashable] = project_name
+    
+    operations = []
+    for hashable, inc in increments.items():
+        if not any(inc.values()):
+            continue
+        update = {"$inc": inc, "$set": {"updated_at": now}}
+        if names.get(hashable):
+            update["$set"]["project_name"] = names[hashable]
+        operations.append(UpdateOne(keys[hashable], update, upsert=True))
+    
+    if operations:
+        await db.finanzas_ledger_monthly.bulk_write(operations, ordered=False)
+
+
+async def aggregate_ledger_entries(db, company_id: str) -> List[dict]:
+    """Calcular las entradas del libro de una empresa directamente desde los movimientos"""
+    now = datetime.now(timezone.utc).isoformat()
+    entries: List[dict] = []
+    
+    for kind, collection_name in LEDGER_SOURCES.items():
+        category_field = LEDGER_CATEGORY_FIELDS[kind]
+        pipeline = [
+            {"$match": {"company_id": company_id, "date": {"$type": "string"}}},
+            {"$group": {
+                "_id": {
+                    "workspace_id": "$workspace_id",
+                    "month": {"$substrCP": ["$date", 0, 7]},
+                    "project_id": "$project_id",
+                    "status": "$status",
+                    "category": f"${category_field}" if category_field else None
+                },
+                "project_name": {"$last": "$project_name"},
+                "amount": {"$sum": {"$ifNull": ["$amount", 0]}},
+                "paid_amount": {"$sum": {"$ifNull": ["$paid_amount", 0]}} if kind == "income" else {"$sum": 0},
+                "count": {"$sum": 1}
+            }}
+        ]
+        
+        async for group in db[collection_name].aggregate(pipeline):
+            entries.append({
+                "company_id": company_id,
+                "workspace_id": group["_id"].get("workspace_id"),
+                "kind": kind,
+                "month": group["_id"]["month"],
+                "project_id": group["_id"].get("project_id"),
+                "project_name": group.get("project_name"),
+                "status": group["_id"].get("status"),
+                "category": group["_id"].get("category"),
+                "amount": group["amount"],
+                "paid_amount": group["paid_amount"],
+                "count": group["count"],
+                "updated_at": now
+            })
+    
+    return entries
+
+
+async def _claim_ledger_build(db, company_id: str, owner: str) -> Optional[dict]:
+    """
+    Reclamar atómicamente la construcción del libro (status "building" + owner).
+    Retorna el estado reclamado o None si otra construcción vigente está en curso.
+    """
+    now = datetime.now(timezone.utc)
+    stale = (now - timedelta(minutes=LEDGER_BUILD_TIMEOUT_MINUTES)).isoformat()
+    try:
+        return await db.finanzas_ledger_state.find_one_and_update(
+            {
+                "company_id": company_id,
+                "$or": [{"status": {"$ne": "building"}}, {"build_started_at": {"$lte": stale}}]
+            },
+            {
+                "$set": {"status": "building", "build_owner": owner, "build_started_at": now.isoformat()},
+                "$inc": {"next_version": 1}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # El estado existe y está en construcción: el upsert choca con el índice único
+        return None
+
+
+async def _build_company_ledger(db, company_id: str) -> Optional[tuple]:
+    """
+    Construir una nueva versión del libro y activarla al final.
+    Las entradas se insertan con la versión reclamada (los lectores siguen viendo la
+    versión anterior). Antes de publicar se espera a que terminen las escrituras
+    (ledger_write) abiertas durante la agregación, y el cambio de versión solo se publica
+    si nadie registró cambios desde el reclamo; si los hubo, se descarta la versión y se
+    vuelve a agregar. Así cada movimiento queda en la agregación o en un $inc posterior
+    a la publicación, nunca en ambos.
+    Retorna (versión, entradas) o None si la construcción está en manos de otro proceso.
+    """
+    owner = uuid.uuid4().hex
+    state = await _claim_ledger_build(db, company_id, owner)
+    if state is None:
+        # Forzar a la construcción en curso a volver a agregar (p. ej. tras una importación)
+        await record_ledger_changes(db, company_id)
+        return None
+    
+    version = state["next_version"]
+    changes = state.get("changes")
+    
+    for _ in range(LEDGER_BUILD_ATTEMPTS):
+        entries = await aggregate_ledger_entries(db, company_id)
+        if entries:
+            await db.finanzas_ledger_monthly.insert_many([{**entry, "version": version} for entry in entries])
+        
+        # Un movimiento escrito antes de la agregación registra su cambio antes de cerrar el bloque
+        await wait_for_ledger_writes(db)
+        
+        published = await db.finanzas_ledger_state.update_one(
+            {"company_id": company_id, "build_owner": owner, "changes": changes},
+            {
+                "$set": {"status": "built", "version": version, "built_at": datetime.now(timezone.utc).isoformat()},
+                "$unset": {"build_owner": "", "build_started_at": ""}
+            }
+        )
+        if published.modified_count:
+            # Versiones anteriores (y entradas previas al versionado)
+            await db.finanzas_ledger_monthly.delete_many({"company_id": company_id, "version": {"$ne": version}})
+            return version, len(entries)
+        
+        await db.finanzas_ledger_monthly.delete_many({"company_id": company_id, "version": version})
+        state = await db.finanzas_ledger_state.find_one({"company_id": company_id, "build_owner": owner})
+        if not state:
+            # Reclamada por otro proceso o libro eliminado
+            return None
+        changes = state.get("changes")
+    
+    # Demasiados cambios concurrentes: liberar el reclamo y mantener la versión activa
+    await db.finanzas_ledger_state.update_one(
+        {"company_id": company_id, "build_owner": owner},
+        {
+            "$set": {"status": "built" if state.get("version") is not None else "pending"},
+            "$unset": {"build_owner": "", "build_started_at": ""}
+        }
+    )
+    return None
+
+
+async def record_ledger_changes(db, company_id: str) -> None:
+    """Registrar cambios hechos fuera de apply_ledger_change para que una construcción en curso vuelva a agregar"""
+    await db.finanzas_ledger_state.update_one({"company_id": company_id}, {"$inc": {"changes": 1}})
+
+
+async def rebuild_company_ledger(db, company_id: str) -> Optional[int]:
+    """
+    Reconstruir desde cero el libro mensual de una empresa.
+    Retorna la cantidad de documentos del libro generados, o None si otro proceso
+    lo está construyendo (esa construcción incorporará los movimientos actuales).
+    """
+    built = await _build_company_ledger(db, company_id)
+    return built[1] if built else None
+
+
+async def ensure_company_ledger(db, company_id: str) -> Optional[int]:
+    """
+    Construir el libro de la empresa si aún no existe.
+    Retorna la versión activa, o None si el libro todavía no está disponible.
+    """
+    version = await get_ledger_version(db, company_id)
+    if version is not None:
+        return version
+    
+    built = await _build_company_ledger(db, company_id)
+    return built[0] if built else None
+
+
+async def drop_company_ledger(db, company_id: str) -> None:
+    """Eliminar el libro de una empresa (al borrar la empresa o para forzar reconstrucción)"""
+    await db.finanzas_ledger_state.delete_one({"company_id": company_id})
+    await db.finanzas_ledger_monthly.delete_many({"company_id": company_id})
+
+
+def _matches_filters(entry: dict, filters: dict) -> bool:
+    """Evaluar en memoria los filtros de get_ledger_entries (igualdad, $in y $ne)"""
+    for field, condition in filters.items():
+        value = entry.get(field)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$ne" in condition and value == condition["$ne"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+async def get_ledger_entries(db, company_id: str, workspace_id: str, **filters) -> List[dict]:
+    """
+    Leer las entradas del libro de una empresa (construyéndolo si hace falta).
+    Mientras otro proceso construye el primer libro se agrega directamente desde los movimientos.
+    """
+    version = await ensure_company_ledger(db, company_id)
+    query = {"workspace_id": workspace_id, **filters}
+    
+    if version is None:
+        entries = await aggregate_ledger_entries(db, company_id)
+        return [entry for entry in entries if _matches_filters(entry, query)]
+    
+    query.update({"company_id": company_id, "version": version})
+    return await db.finanzas_ledger_monthly.find(query, {"_id": 0, "version": 0}).to_list(None)
+
+
+def sum_ledger(entries: List[dict], kind: str, statuses: Optional[List[str]] = None) -> dict:
+    """Sumar amount, paid_amount y count de las entradas de un tipo (y estados)"""
+    totals = {"amount": 0, "paid_amount": 0, "count": 0}
+    for entry in entries:
+        if entry["kind"] != kind:
+            continue
+        if statuses is not None and entry.get("status") not in statuses:
+            continue
+        for field in totals:
+            totals[field] += entry.get(field, 0) or 0
+    
+    totals["amount"] = round(totals["amount"], 2)
+    totals["paid_amount"] = round(totals["paid_amount"], 2)
+    return totals
+
+
+async def get_open_balances(db, company_id: str, workspace_id: str) -> dict:
+    """
+    Totales exactos de cuentas por cobrar (ingresos pending/partial)
+    y por pagar (gastos pending) a partir del libro.
+    """
+    entries = await get_ledger_entries(
+        db, company_id, workspace_id,
+        kind={"$in": ["income", "expense"]},
+        status={"$in": ["pending", "partial"]}
+    )
+    
+    receivables = sum_ledger(entries, "income", ["pending", "partial"])
+    payables = sum_ledger(entries, "expense", ["pending"])
+    
+    return {
+        "receivables": {
+            "total_facturado": receivables["amount"],
+            "total_abonado": receivables["paid_amount"],
+            "total_pendiente": round(receivables["amount"] - receivables["paid_amount"], 2),
+            "count": receivables["count"]
+        },
+        "payables": {
+            "total": payables["amount"],
+            "count": payables["count"]
+        }
+    }
+
+
+async def ensure_ledger_indexes(db) -> None:
+    """Crear los índices del libro mensual"""
+    await db.finanzas_ledger_monthly.create_index(
+        [("company_id", 1), ("version", 1), ("workspace_id", 1), ("kind", 1), ("month", 1),
+         ("project_id", 1), ("status", 1), ("category", 1)]
+    )
+    await db.finanzas_ledger_state.create_index("company_id", unique=True)
+    await db.finanzas_ledger_writes.create_index("id", unique=True)
+    await db.finanzas_ledger_writes.create_index("started_at")
+
+
+async def _rebuild_from_command_line(company_id: Optional[str] = None):
+    """Reconstruir el libro de una empresa o de todas desde la línea de comandos"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    
+    mongo_url = os.environ.get('MONGO_URL')
+    db_name = os.environ.get('DB_NAME', 'mindmap_db')
+    
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[db_name]
+    
+    if company_id:
+        company_ids = [company_id]
+    else:
+        company_ids = [c["id"] async for c in db.finanzas_companies.find({}, {"_id": 0, "id": 1})]
+    
+    print(f"Reconstruyendo libro mensual de {len(company_ids)} empresa(s)...")
+    for cid in company_ids:
+        count = await rebuild_company_ledger(db, cid)
+        if count is None:
+            print(f"  - {cid}: no publicado (otra construcción en curso o cambios concurrentes)")
+        else:
+            print(f"  - {cid}: {count} entradas")
+    
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_rebuild_from_command_line(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -9,6 +9,10 @@ from datetime import datetime, timezone
 from enum import Enum
 import uuid
 
+from pymongo import UpdateOne
+
+from search_service import normalize_search_text, build_search_tokens
+
 # ==========================================
 # ENUMS Y CONSTANTES
 # ==========================================
@@ -46,6 +50,7 @@ class ProductStatus(str, Enum):
 
 class ProductCreate(BaseModel):
     name: str = Field(..., min_length=1, max_length=200, description="Nombre del producto/servicio")
+    code: Optional[str] = Field(None, max_length=50, description="Código / SKU")
     type: ProductType = Field(..., description="Tipo: producto o servicio")
     base_price: float = Field(..., gt=0, description="Precio base sin formato")
     includes_igv: bool = Field(default=True, description="¿El precio incluye IGV?")
@@ -55,6 +60,7 @@ class ProductCreate(BaseModel):
 
 class ProductUpdate(BaseModel):
     name: Optional[str] = Field(None, min_length=1, max_length=200)
+    code: Optional[str] = Field(None, max_length=50)
     type: Optional[ProductType] = None
     base_price: Optional[float] = Field(None, gt=0)
     includes_igv: Optional[bool] = None
@@ -68,6 +74,7 @@ class ProductResponse(BaseModel):
     workspace_id: str
     username: str
     name: str
+    code: Optional[str] = None
     type: str
     base_price: float
     includes_igv: bool
@@ -152,6 +159,7 @@ class FixedExpenseResponse(BaseModel):
     reminder_days_before: int
     next_due_date: Optional[str]
     day_of_month: Optional[int]
+    overdue_periods: List[str] = []
     created_at: str
     updated_at: str
 
@@ -363,6 +371,7 @@ class PartialPaymentCreate(BaseModel):
     date: str = Field(..., description="Fecha del pago (ISO format)")
     payment_method: Optional[str] = Field(None, description="Método de pago: efectivo, transferencia, tarjeta, etc.")
     note: Optional[str] = Field(None, description="Nota o referencia del pago")
+    company_id: Optional[str] = Field(None, description="Empresa del ingreso (evita una lectura previa)")
 
 class PartialPaymentResponse(BaseModel):
     id: str
@@ -472,6 +481,18 @@ class ProjectFinancialSummary(BaseModel):
     net_result: float
     roi: Optional[float]  # Return on Investment
 
+# ==========================================
+# CONTEXTO DE EMPRESA (POR REQUEST)
+# ==========================================
+
+class FinanceContext(BaseModel):
+    """Empresa, rol y workspace resueltos una sola vez por request"""
+    username: str
+    company_id: str
+    company: dict
+    role: str
+    workspace_id: str
+
 # ==========================================
 # HELPER FUNCTIONS
 # ==========================================
@@ -484,6 +505,95 @@ def get_current_timestamp() -> str:
     """Retorna timestamp actual en ISO format"""
     return datetime.now(timezone.utc).isoformat()
 
+IGV_RATE = 0.18
+
+def build_income_document(income_data: IncomeCreate, workspace_id: str, username: str, now: str) -> dict:
+    """Construir el documento de un ingreso nuevo (pagos parciales y estado final)"""
+    # Calcular paid_amount y pending_balance
+    amount = income_data.amount
+    paid_amount = income_data.paid_amount or 0
+    
+    # Si el estado es "collected", el pago es completo
+    if income_data.status == IncomeStatus.COLLECTED:
+        paid_amount = amount
+    
+    # Calcular saldo pendiente
+    pending_balance = max(0, amount - paid_amount)
+    
+    # Si el saldo es 0 y hay monto, marcar como cobrado
+    final_status = income_data.status
+    if pending_balance == 0 and amount > 0 and income_data.status == IncomeStatus.PENDING:
+        final_status = IncomeStatus.COLLECTED
+    
+    return {
+        "id": generate_id(),
+        "workspace_id": workspace_id,
+        "username": username,
+        **income_data.model_dump(),
+        "paid_amount": paid_amount,
+        "pending_balance": pending_balance,
+        "status": final_status,
+        "created_at": now,
+        "updated_at": now
+    }
+
+def build_expense_document(expense_data: ExpenseCreate, workspace_id: str, username: str, now: str) -> dict:
+    """Construir el documento de un gasto nuevo con su base imponible e IGV"""
+    # El monto ingresado es el total (con IGV incluido)
+    amount = expense_data.amount
+    
+    if expense_data.includes_igv:
+        # El monto incluye IGV, calcular base e IGV
+        base_imponible = amount / (1 + IGV_RATE)
+        igv_gasto = amount - base_imponible
+    else:
+        # El gasto no tiene IGV (ej: compras informales, servicios exentos)
+        base_imponible = amount
+        igv_gasto = 0.0
+    
+    return {
+        "id": generate_id(),
+        "workspace_id": workspace_id,
+        "username": username,
+        **expense_data.model_dump(),
+        "base_imponible": round(base_imponible, 2),
+        "igv_gasto": round(igv_gasto, 2),
+        "created_at": now,
+        "updated_at": now
+    }
+
+# Campos de búsqueda internos: no se devuelven en las respuestas
+PRODUCT_PROJECTION = {"_id": 0, "search_name": 0, "search_tokens": 0}
+
+def build_product_search_fields(product: dict) -> dict:
+    """Nombre normalizado (orden) y prefijos de nombre y código (autocompletado)"""
+    return {
+        "search_name": normalize_search_text(product.get("name")),
+        "search_tokens": build_search_tokens([product.get("name"), product.get("code")])
+    }
+
+async def backfill_product_search_fields(db, batch_size: int = 500) -> int:
+    """Completar los campos de búsqueda de productos creados antes de existir"""
+    updated = 0
+    cursor = db.finanzas_products.find(
+        {"search_tokens": {"$exists": False}},
+        {"_id": 1, "name": 1, "code": 1}
+    )
+    
+    operations = []
+    async for product in cursor:
+        operations.append(UpdateOne({"_id": product["_id"]}, {"$set": build_product_search_fields(product)}))
+        if len(operations) >= batch_size:
+            await db.finanzas_products.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    
+    if operations:
+        await db.finanzas_products.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    
+    return updated
+
 def calculate_health_status(income: float, expenses: float, pending_expenses: float) -> str:
     """
     Calcula el estado de salud financiera
@@ -508,3 +618,20 @@ def calculate_health_status(income: float, expenses: float, pending_expenses: fl
         return "warning"
     else:
         return "critical"
+
+async def ensure_finanzas_indexes(db) -> None:
+    """Crear los índices usados por los resúmenes y listados de finanzas"""
+    for collection in (db.finanzas_incomes, db.finanzas_expenses, db.finanzas_investments):
+        await collection.create_index([("company_id", 1), ("workspace_id", 1), ("date", 1)])
+        await collection.create_index([("company_id", 1), ("workspace_id", 1), ("status", 1)])
+    
+    # Barrido de periodos perdidos de gastos fijos
+    await db.finanzas_fixed_expenses.create_index([("status", 1), ("next_due_date", 1)])
+    
+    # Catálogo de productos: búsqueda por prefijo y paginación por nombre
+    await db.finanzas_products.create_index(
+        [("company_id", 1), ("workspace_id", 1), ("search_tokens", 1), ("search_name", 1), ("id", 1)]
+    )
+    await db.finanzas_products.create_index(
+        [("company_id", 1), ("workspace_id", 1), ("search_name", 1), ("id", 1)]
+    )
@@ -0,0 +1,219 @@
+"""
+Finanzas Tax Service - Determinación mensual del IGV
+Agrega por mes el IGV de ventas (débito fiscal, sobre lo efectivamente cobrado)
+y el IGV de compras (crédito fiscal, gastos con IGV), con la misma regla que
+muestra el Balance General. Los periodos cerrados se cachean por empresa.
+"""
+
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional
+
+from cache_service import TTLCache
+from finanzas_service import IGV_RATE
+
+MAX_TAX_PERIODS = 36
+
+TAX_CSV_HEADERS = [
+    "Periodo", "Ventas (base)", "IGV ventas", "Compras (base)",
+    "IGV compras", "IGV neto", "IGV a pagar", "Saldo a favor"
+]
+
+TAX_PERIOD_CACHE_MAX_ENTRIES = 20000
+TAX_PERIOD_CACHE_TTL_SECONDS = 3600
+
+# Periodos cerrados ya calculados: {(company_id, workspace_id, "YYYY-MM"): periodo}
+_tax_period_cache = TTLCache(
+    TAX_PERIOD_CACHE_MAX_ENTRIES, TAX_PERIOD_CACHE_TTL_SECONDS,
+    indexes={"company": lambda key: key[0], "period": lambda key: (key[0], key[2])}
+)
+
+
+def invalidate_tax_period(company_id: str, date: Optional[str] = None) -> None:
+    """Descartar el periodo de una fecha (o todos los de la empresa) al cambiar un movimiento"""
+    if date is None:
+        _tax_period_cache.invalidate("company", company_id)
+    else:
+        _tax_period_cache.invalidate("period", (company_id, date[:7]))
+
+
+def current_tax_period() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+def parse_tax_period(value: str) -> tuple:
+    """Leer un periodo YYYY-MM; lanza ValueError si es inválido"""
+    try:
+        parsed = datetime.strptime(value, "%Y-%m")
+    except (TypeError, ValueError):
+        raise ValueError("El periodo debe tener el formato YYYY-MM")
+    return parsed.year, parsed.month
+
+
+def shift_tax_period(period: str, months: int) -> str:
+    """Periodo desplazado `months` meses (negativo hacia atrás)"""
+    year, month = parse_tax_period(period)
+    index = year * 12 + month - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def build_tax_periods(start_period: str, end_period: str) -> List[str]:
+    """Meses entre start_period y end_period (ambos incluidos)"""
+    year, month = parse_tax_period(start_period)
+    end_year, end_month = parse_tax_period(end_period)
+
+    periods = []
+    while (year, month) <= (end_year, end_month):
+        periods.append(f"{year:04d}-{month:02d}")
+        if len(periods) > MAX_TAX_PERIODS:
+            raise ValueError(f"El rango no puede superar {MAX_TAX_PERIODS} meses")
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+
+    if not periods:
+        raise ValueError("start_period debe ser anterior o igual a end_period")
+    return periods
+
+
+def empty_tax_period(period: str) -> dict:
+    return {
+        "period": period,
+        "sales_base": 0.0,
+        "igv_sales": 0.0,
+        "purchases_base": 0.0,
+        "igv_purchases": 0.0,
+        "incomes_count": 0,
+        "expenses_count": 0
+    }
+
+
+def finish_tax_period(period: dict, closed: bool) -> dict:
+    """Redondear y derivar IGV neto, a pagar o saldo a favor"""
+    for field in ("sales_base", "igv_sales", "purchases_base", "igv_purchases"):
+        period[field] = round(period[field], 2)
+
+    net = round(period["igv_sales"] - period["igv_purchases"], 2)
+    period["igv_net"] = net
+    period["igv_payable"] = max(net, 0.0)
+    period["igv_credit"] = max(-net, 0.0)
+    period["closed"] = closed
+    return period
+
+
+async def aggregate_tax_periods(db, company_id: str, workspace_id: str, periods: List[str]) -> Dict[str, dict]:
+    """Sumar bases e IGV por mes de ingresos y gastos en una sola agregación"""
+    results = {period: empty_tax_period(period) for period in periods}
+    if not periods:
+        return results
+
+    date_range = {"$gte": periods[0], "$lt": f"{periods[-1]}-99"}
+    base = {"company_id": company_id, "workspace_id": workspace_id, "date": date_range}
+    month = {"$substrCP": ["$date", 0, 7]}
+
+    # Ventas: solo lo cobrado (total si está cobrado, abonos si está parcial), con IGV incluido
+    collected = {"$cond": [
+        {"$eq": ["$status", "collected"]},
+        {"$ifNull": ["$amount", 0]},
+        {"$ifNull": ["$paid_amount", 0]}
+    ]}
+
+    pipeline = [
+        {"$match": base},
+        {"$group": {
+            "_id": {"month": month, "kind": "income"},
+            "gross": {"$sum": collected},
+            "igv": {"$sum": 0},
+            "count": {"$sum": 1}
+        }},
+        {"$unionWith": {
+            "coll": "finanzas_expenses",
+            "pipeline": [
+                {"$match": {**base, "includes_igv": True}},
+                {"$group": {
+                    "_id": {"month": month, "kind": "expense"},
+                    "gross": {"$sum": {"$ifNull": ["$base_imponible", {"$divide": ["$amount", 1 + IGV_RATE]}]}},
+                    "igv": {"$sum": {"$ifNull": [
+                        "$igv_gasto",
+                        {"$subtract": ["$amount", {"$divide": ["$amount", 1 + IGV_RATE]}]}
+                    ]}},
+                    "count": {"$sum": 1}
+                }}
+            ]
+        }}
+    ]
+
+    async for group in db.finanzas_incomes.aggregate(pipeline):
+        period = results.get(group["_id"]["month"])
+        if period is None:
+            continue
+        if group["_id"]["kind"] == "income":
+            period["sales_base"] += group["gross"] / (1 + IGV_RATE)
+            period["igv_sales"] += group["gross"] - group["gross"] / (1 + IGV_RATE)
+            period["incomes_count"] += group["count"]
+        else:
+            period["purchases_base"] += group["gross"]
+            period["igv_purchases"] += group["igv"]
+            period["expenses_count"] += group["count"]
+
+    return results
+
+
+async def get_tax_report(
+    db,
+    company_id: str,
+    workspace_id: str,
+    start_period: str,
+    end_period: str
+) -> dict:
+    """
+    Determinación del IGV por mes. Los meses cerrados se leen del cache
+    y solo se agregan los que faltan y el mes en curso.
+    """
+    periods = build_tax_periods(start_period, end_period)
+    current = current_tax_period()
+    cached = {}
+    for period in periods:
+        row = _tax_period_cache.get((company_id, workspace_id, period)) if period < current else None
+        if row is not None:
+            cached[period] = row
+
+    missing = [p for p in periods if p not in cached]
+    computed = {}
+    if missing:
+        computed = await aggregate_tax_periods(db, company_id, workspace_id, missing)
+
+    rows = []
+    for period in periods:
+        if period in computed:
+            row = finish_tax_period(computed[period], closed=period < current)
+            if row["closed"]:
+                _tax_period_cache.set((company_id, workspace_id, period), row)
+        else:
+            row = cached[period]
+        rows.append(row)
+
+    totals = finish_tax_period({
+        "period": "TOTAL",
+        **{field: sum(r[field] for r in rows) for field in (
+            "sales_base", "igv_sales", "purchases_base", "igv_purchases", "incomes_count", "expenses_count"
+        )}
+    }, closed=all(r["closed"] for r in rows))
+
+    return {
+        "company_id": company_id,
+        "start_period": periods[0],
+        "end_period": periods[-1],
+        "igv_rate": IGV_RATE,
+        "periods": rows,
+        "totals": totals
+    }
+
+
+async def iter_tax_rows(report: dict) -> AsyncIterator[list]:
+    """Filas CSV del reporte (encabezado, un mes por fila y totales)"""
+    yield TAX_CSV_HEADERS
+    for row in report["periods"] + [report["totals"]]:
+        yield [
+            row["period"], row["sales_base"], row["igv_sales"], row["purchases_base"],
+            row["igv_purchases"], row["igv_net"], row["igv_payable"], row["igv_credit"]
+        ]
@@ -0,0 +1,70 @@
+"""
+Search Service - Normalización y tokens de búsqueda por prefijo
+Los documentos buscables guardan un arreglo `search_tokens` con los prefijos
+(edge n-grams) de sus palabras normalizadas: minúsculas y sin tildes.
+Un índice multikey sobre ese arreglo resuelve el autocompletado sin $regex.
+"""
+
+import base64
+import json
+import re
+import unicodedata
+from typing import Iterable, List, Optional
+
+MIN_TOKEN_LENGTH = 1
+MAX_TOKEN_LENGTH = 20
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_search_text(value: Optional[str]) -> str:
+    """Minúsculas y sin tildes/diacríticos ("Ñandú Pérez" → "nandu perez")"""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", str(value))
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(folded.lower().split())
+
+
+def search_words(value: Optional[str]) -> List[str]:
+    """Palabras normalizadas de un texto"""
+    return WORD_PATTERN.findall(normalize_search_text(value))
+
+
+def edge_ngrams(word: str) -> List[str]:
+    """Prefijos de una palabra: "casa" → ["c", "ca", "cas", "casa"]"""
+    word = word[:MAX_TOKEN_LENGTH]
+    return [word[:length] for length in range(MIN_TOKEN_LENGTH, len(word) + 1)]
+
+
+def build_search_tokens(values: Iterable[Optional[str]], extra_words: Iterable[str] = ()) -> List[str]:
+    """Tokens de búsqueda (prefijos sin repetir) de varios campos de texto"""
+    tokens = set()
+    for value in values:
+        for word in search_words(value):
+            tokens.update(edge_ngrams(word))
+    for word in extra_words:
+        if word:
+            tokens.update(edge_ngrams(word))
+    return sorted(tokens)
+
+
+def query_tokens(query: Optional[str]) -> List[str]:
+    """Tokens de una consulta: cada palabra debe ser prefijo de alguna palabra del documento"""
+    return [word[:MAX_TOKEN_LENGTH] for word in search_words(query)]
+
+
+def encode_search_cursor(values: list) -> str:
+    """Cursor opaco con los valores de orden del último resultado"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("utf-8")
+
+
+def decode_search_cursor(cursor: str, size: int) -> list:
+    """Leer un cursor; lanza ValueError si es inválido"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Cursor inválido")
+    return values
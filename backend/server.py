@@ -1,19 +1,21 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks, Form, Request, UploadFile, File, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import Response
+from fastapi.responses import Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, InsertOne, DeleteMany
 import os
 import logging
 import asyncio
 import httpx
 import secrets
 import json
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Literal, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
@@ -44,7 +46,13 @@ from board_service import (
 import contacts_service
 from contacts_service import (
     CreateContactRequest, UpdateContactRequest,
-    CreateCustomFieldRequest, UpdateCustomFieldRequest
+    CreateCustomFieldRequest, UpdateCustomFieldRequest,
+    CONTACT_PROJECTION, build_contact_search_fields, contact_query_tokens, contact_name_prefix_query, rank_contact,
+    contact_full_name, backfill_contact_search_fields, ensure_contact_indexes,
+    CONTACT_PAGE_MAX, CONTACT_COUNT_CAP, build_contact_projection, build_custom_field_filters,
+    apply_contact_cursor, contact_scope,
+    FIELD_CONFIG_COLLECTION, LABEL_CONFIG_COLLECTION, get_contact_config, get_custom_field_validator,
+    invalidate_contact_config, config_version_update
 )
 import workspace_service
 from workspace_service import (
@@ -54,14 +62,16 @@ from workspace_service import (
     revoke_resource_permission, create_invite, accept_invite, get_pending_invites_for_email,
     create_share_link, get_share_link, toggle_share_link, get_resource_share_link,
     get_resource_collaborators, update_collaborator_role, remove_collaborator,
-    get_resource_permissions, migrate_user_resources_to_workspace
+    get_resource_permissions, migrate_user_resources_to_workspace,
+    invalidate_permission_cache, check_resource_permissions_bulk, get_users_by_username
 )
 import activity_service
 from activity_service import (
     log_activity, get_activity_feed, get_resource_activity,
     mark_activities_as_read, get_unread_count,
     get_notification_preferences, update_notification_preferences,
-    should_send_email, process_activity_notification,
+    should_send_email, process_activity_notification, flush_notification_digests,
+    ensure_notification_digest_indexes,
     generate_activity_message, DEFAULT_NOTIFICATION_PREFERENCES,
     EMAIL_WORTHY_ACTIONS
 )
@@ -76,10 +86,13 @@ from finanzas_service import (
     ProductCreate, ProductUpdate, ProductResponse, ProductType, ProductStatus,
     FixedExpenseCreate, FixedExpenseUpdate, FixedExpenseResponse, FixedExpensePeriodicity, FixedExpenseStatus,
     FixedExpensePaymentCreate, FixedExpensePaymentResponse,
-    FinancialSummary, ProjectFinancialSummary,
-    DEFAULT_EXPENSE_CATEGORIES, DEFAULT_INCOME_SOURCES,
-    generate_id, get_current_timestamp, calculate_health_status
+    FinancialSummary, ProjectFinancialSummary, FinanceContext,
+    DEFAULT_EXPENSE_CATEGORIES, DEFAULT_INCOME_SOURCES, IGV_RATE,
+    generate_id, get_current_timestamp, calculate_health_status,
+    build_income_document, build_expense_document, ensure_finanzas_indexes,
+    PRODUCT_PROJECTION, build_product_search_fields, backfill_product_search_fields
 )
+from search_service import query_tokens, encode_search_cursor, decode_search_cursor
 import collaborator_service
 from collaborator_service import (
     CompanyRole, InvitationStatus, ROLE_PERMISSIONS,
@@ -89,6 +102,41 @@ from collaborator_service import (
     get_invitation_email_html, get_invitation_accepted_email_html, get_invitation_rejected_email_html,
     get_role_changed_email_html, get_access_revoked_email_html
 )
+from cache_service import TTLCache
+import finanzas_ledger_service
+from finanzas_ledger_service import (
+    apply_ledger_change, drop_company_ledger, ensure_company_ledger, get_ledger_entries, ledger_write,
+    get_open_balances, sum_ledger, ensure_ledger_indexes
+)
+from finanzas_export_service import (
+    EXPORT_COLUMNS, EXPORT_FORMATS, iter_cursor, iter_balance_movements, stream_export, stream_csv,
+    export_filename, export_content_disposition
+)
+from finanzas_import_service import IMPORT_KINDS, import_movements_csv
+from contacts_import_service import IMPORT_FORMATS, COUNTRY_DIAL_CODES, import_contacts
+from whatsapp_conversation_service import (
+    CONVERSATIONS_PAGE_MAX, get_conversations, mark_conversation_read, backfill_whatsapp_conversations,
+    ensure_whatsapp_conversation_indexes
+)
+from contacts_dedupe_service import (
+    DEDUPE_MIN_SCORE, MAX_MERGE_DUPLICATES, create_dedupe_job, get_dedupe_job, merge_contacts,
+    resume_dedupe_jobs, ensure_dedupe_job_indexes
+)
+from finanzas_tax_service import (
+    get_tax_report, invalidate_tax_period, current_tax_period, shift_tax_period, iter_tax_rows
+)
+from finanzas_aging_service import (
+    AGING_KINDS, AGING_BUCKETS, AGING_PAGE_MAX, get_aging_report, get_aging_items,
+    ensure_aging_indexes
+)
+from finanzas_forecast_service import (
+    get_cash_forecast, invalidate_forecast, MAX_FORECAST_DAYS,
+    forecast_today, next_fixed_expense_due, catch_up_fixed_expense
+)
+from deletion_job_service import (
+    deletion_step, create_deletion_job, get_deletion_job, format_deletion_job,
+    resume_deletion_jobs, ensure_deletion_job_indexes
+)
 import activity_company_service
 from activity_company_service import (
     ActivityCreate, ACTIVITY_TYPES, MODULE_LABELS,
@@ -2031,6 +2079,14 @@ async def start_scheduler():
     # Scheduler de recordatorios de gastos fijos (Email + WhatsApp)
     asyncio.create_task(check_and_send_fixed_expense_reminders())
     logger.info("✅ Scheduler de recordatorios de gastos fijos iniciado")
+    
+    # Scheduler de digests de notificaciones de actividad
+    asyncio.create_task(send_notification_digests())
+    logger.info("✅ Scheduler de digests de notificaciones iniciado")
+    
+    # Barrido nocturno de periodos perdidos de gastos fijos
+    asyncio.create_task(sweep_missed_fixed_expense_periods())
+    logger.info("✅ Barrido nocturno de gastos fijos iniciado")
 
 
 # ==========================================
@@ -2038,6 +2094,48 @@ async def start_scheduler():
 # ==========================================
 
 fixed_expense_reminder_scheduler_running = False
+fixed_expense_sweep_running = False
+
+# Hora (UTC) del barrido diario de periodos perdidos
+FIXED_EXPENSE_SWEEP_HOUR_UTC = 6
+FIXED_EXPENSE_SWEEP_BATCH_SIZE = 500
+
+async def sweep_missed_fixed_expense_periods():
+    """
+    Barrido diario (y al iniciar el servidor) de gastos fijos activos con next_due_date vencido
+    en todas las empresas: reconcilia sus periodos perdidos por lotes.
+    """
+    global fixed_expense_sweep_running
+    fixed_expense_sweep_running = True
+    
+    while fixed_expense_sweep_running:
+        try:
+            today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+            cursor = db.finanzas_fixed_expenses.find(
+                {"status": "activo", "next_due_date": {"$lt": today}},
+                {"_id": 0}
+            )
+            
+            reconciled = 0
+            batch = []
+            async for fixed_expense in cursor:
+                batch.append(fixed_expense)
+                if len(batch) >= FIXED_EXPENSE_SWEEP_BATCH_SIZE:
+                    reconciled += await reconcile_fixed_expense_periods(batch)
+                    batch = []
+            if batch:
+                reconciled += await reconcile_fixed_expense_periods(batch)
+            
+            if reconciled:
+                logger.info(f"🔁 [Fixed Expense Sweep] {reconciled} gasto(s) fijo(s) con periodos perdidos reconciliados")
+        except Exception as e:
+            logger.error(f"❌ [Fixed Expense Sweep] Error general: {str(e)}")
+        
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=FIXED_EXPENSE_SWEEP_HOUR_UTC, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        await asyncio.sleep((next_run - now).total_seconds())
 
 async def check_and_send_fixed_expense_reminders():
     """Verificar y enviar recordatorios de gastos fijos (OBLIGATORIO: Email + WhatsApp)"""
@@ -2294,6 +2392,27 @@ async def send_fixed_expense_reminder_email(
         return {"success": False, "error": str(e)}
 
 
+# Flag para scheduler de digests de notificaciones
+notification_digest_scheduler_running = False
+
+async def send_notification_digests():
+    """Enviar cada minuto los digests de notificaciones cuya ventana venció"""
+    global notification_digest_scheduler_running
+    notification_digest_scheduler_running = True
+    
+    logger.info("🚀 [Notification Digest] Iniciando scheduler de digests...")
+    
+    while notification_digest_scheduler_running:
+        try:
+            sent = await flush_notification_digests(db, send_activity_notification_email)
+            if sent:
+                logger.info(f"📬 [Notification Digest] {sent} digests enviados")
+        except Exception as e:
+            logger.error(f"❌ [Notification Digest] Error en scheduler: {str(e)}")
+        
+        await asyncio.sleep(60)
+
+
 # Flag para scheduler de expiración de planes
 plan_expiration_scheduler_running = False
 
@@ -3498,29 +3617,45 @@ async def empty_trash(
     """Vaciar la papelera - eliminar todos los proyectos permanentemente"""
     username = current_user["username"]
     
-    # Obtener todos los proyectos en papelera del usuario
-    trash_projects = await db.projects.find({
-        "username": username,
-        "isDeleted": True
-    }).to_list(1000)
-    
-    if not trash_projects:
+    trash_query = {"username": username, "isDeleted": True}
+    if not await db.projects.count_documents(trash_query, limit=1):
         return {"message": "La papelera ya está vacía", "deleted_count": 0}
     
-    # Eliminar todos los proyectos de la papelera
-    result = await db.projects.delete_many({
-        "username": username,
-        "isDeleted": True
-    })
+    # Los proyectos se eliminan por bloques en segundo plano
+    job = await create_deletion_job(
+        db, "trash", username,
+        [deletion_step("projects", trash_query, "projects")],
+        target={"username": username}
+    )
     
-    logger.info(f"Papelera vaciada: {result.deleted_count} proyectos eliminados permanentemente por {username}")
+    logger.info(f"Vaciado de papelera iniciado por {username} (trabajo {job['id']})")
     
     return {
-        "message": f"Se eliminaron {result.deleted_count} proyecto(s) permanentemente",
-        "deleted_count": result.deleted_count
+        "message": f"La papelera se está vaciando en segundo plano; consulta el avance en /api/deletion-jobs/{job['id']}",
+        "job_id": job["id"],
+        "status": job["status"]
     }
 
 
+@api_router.get("/deletion-jobs/{job_id}")
+async def get_deletion_job_status(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Consultar el progreso de una eliminación en segundo plano (empresa, usuarios o papelera)"""
+    job = await get_deletion_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo de eliminación no encontrado")
+    
+    # Solo quien lo solicitó o un administrador
+    if job["requested_by"] != current_user["username"]:
+        user = await db.users.find_one({"username": current_user["username"]}, {"_id": 0, "role": 1})
+        if not user or user.get("role") != "admin":
+            raise HTTPException(status_code=404, detail="Trabajo de eliminación no encontrado")
+    
+    return format_deletion_job(job)
+
+
 # ==========================================
 # PROJECT MANAGEMENT ENDPOINTS
 # ==========================================
@@ -4337,6 +4472,7 @@ async def bulk_delete_users(
     deleted = []
     skipped = []
     errors = []
+    user_ids = []
     
     for user in users_to_delete:
         username = user.get("username")
@@ -4351,21 +4487,35 @@ async def bulk_delete_users(
             skipped.append({"username": username, "reason": "No puedes eliminar a otro administrador"})
             continue
         
+        deleted.append(username)
+        if user.get("user_id"):
+            user_ids.append(user["user_id"])
+    
+    # La eliminación se ejecuta por bloques en segundo plano
+    job_id = None
+    if deleted:
+        by_username = {"username": {"$in": deleted}}
+        steps = [
+            deletion_step("users", by_username, "users"),
+            deletion_step("user_profiles", by_username, "user_profiles"),
+            deletion_step("user_sessions", {"user_id": {"$in": user_ids}}, "user_sessions"),
+            # Los proyectos se envían a la papelera (no se eliminan)
+            deletion_step(
+                "projects",
+                {**by_username, "isDeleted": {"$ne": True}},
+                "projects",
+                update={"$set": {"isDeleted": True, "deleted_at": datetime.now(timezone.utc).isoformat()}}
+            ),
+        ]
         try:
-            # Eliminar usuario
-            await db.users.delete_one({"username": username})
-            await db.user_profiles.delete_one({"username": username})
-            await db.user_sessions.delete_many({"user_id": user.get("user_id")})
-            
-            # Marcar proyectos como eliminados
-            await db.projects.update_many(
-                {"username": username},
-                {"$set": {"isDeleted": True, "deleted_at": datetime.now(timezone.utc).isoformat()}}
+            job = await create_deletion_job(
+                db, "users", admin_username, steps,
+                target={"usernames": deleted}
             )
-            
-            deleted.append(username)
+            job_id = job["id"]
         except Exception as e:
-            errors.append({"username": username, "error": str(e)})
+            errors.extend({"username": username, "error": str(e)} for username in deleted)
+            deleted = []
     
     # Registrar auditoría
     audit_record = {
@@ -4376,17 +4526,27 @@ async def bulk_delete_users(
         "skipped_users": skipped,
         "total_requested": len(usernames),
         "total_deleted": len(deleted),
+        "deletion_job_id": job_id,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
     await db.admin_audit_log.insert_one(audit_record)
     
-    logger.info(f"Admin {admin_username} eliminó masivamente {len(deleted)} usuarios")
+    logger.info(f"Admin {admin_username} inició la eliminación masiva de {len(deleted)} usuarios")
+    
+    if job_id:
+        message = (
+            f"Eliminando {len(deleted)} de {len(usernames)} usuarios en segundo plano; "
+            f"consulta el avance en /api/deletion-jobs/{job_id}"
+        )
+    else:
+        message = f"No se eliminó ninguno de los {len(usernames)} usuarios"
     
     return {
-        "message": f"Se eliminaron {len(deleted)} de {len(usernames)} usuarios",
+        "message": message,
         "deleted": deleted,
         "skipped": skipped,
-        "errors": errors
+        "errors": errors,
+        "job_id": job_id
     }
 
 @api_router.post("/admin/users/{username}/impersonate")
@@ -6450,6 +6610,13 @@ async def get_contacts(
     contact_type: Optional[str] = None, 
     workspace_id: Optional[str] = None,
     company_id: Optional[str] = None,
+    label: Optional[str] = None,                            # IDs de etiqueta separados por coma
+    label_mode: Literal["all", "any"] = "all",              # todas las etiquetas o alguna
+    custom_field: Optional[List[str]] = Query(None),        # "field_id:valor" (repetible)
+    q: Optional[str] = None,                                # búsqueda por prefijo (como /contacts/search)
+    fields: Optional[str] = None,                           # "nombre,apellidos,custom_fields.field_x"
+    cursor: Optional[str] = None,
+    limit: int = Query(CONTACT_PAGE_MAX, ge=1, le=CONTACT_PAGE_MAX),
     current_user: dict = Depends(get_current_user)
 ):
     """
@@ -6457,6 +6624,10 @@ async def get_contacts(
     - Con company_id: Retorna contactos de esa empresa
     - Sin company_id + workspace_id: Retorna contactos del workspace
     - Sin company_id ni workspace_id: Retorna contactos personales
+    
+    Paginado del más reciente al más antiguo: `next_cursor` continúa el listado.
+    `total` (solo en la primera página) cuenta los contactos del filtro hasta CONTACT_COUNT_CAP.
+    `q` filtra por prefijos de nombre, apellidos, empresa, email o teléfono.
     """
     username = current_user["username"]
     
@@ -6499,22 +6670,58 @@ async def get_contacts(
     
     if contact_type:
         query["contact_type"] = contact_type
+    if label:
+        label_ids = [l for l in label.split(",") if l]
+        query["labels"] = {"$all" if label_mode == "all" else "$in": label_ids}
+    tokens = contact_query_tokens(q)
+    if tokens:
+        query["search_tokens"] = {"$all": tokens}
     
-    contacts = await db.contacts.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return {"contacts": contacts}
+    try:
+        query.update(build_custom_field_filters(custom_field))
+        projection = build_contact_projection(fields)
+        page_query = apply_contact_cursor(query, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    page = db.contacts.find(page_query, projection).sort([("created_at", -1), ("id", -1)]).limit(limit + 1)
+    
+    # El total solo se calcula en la primera página
+    if cursor:
+        contacts, total = await page.to_list(limit + 1), None
+    else:
+        contacts, total = await asyncio.gather(
+            page.to_list(limit + 1),
+            db.contacts.count_documents(query, limit=CONTACT_COUNT_CAP)
+        )
+    
+    has_more = len(contacts) > limit
+    contacts = contacts[:limit]
+    
+    return {
+        "contacts": contacts,
+        "has_more": has_more,
+        "next_cursor": encode_search_cursor([contacts[-1].get("created_at"), contacts[-1]["id"]]) if has_more else None,
+        "total": total,
+        "total_is_estimate": total is not None and total >= CONTACT_COUNT_CAP
+    }
+
 
+CONTACT_SEARCH_CANDIDATE_FACTOR = 5
 
 @api_router.get("/contacts/search")
 async def search_contacts(
     q: str = "",
-    limit: int = 10,
+    limit: int = Query(10, ge=1, le=50),
     workspace_id: Optional[str] = None,
     company_id: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """
     Búsqueda de contactos para autocomplete.
-    Busca por nombre, apellidos, email o teléfono.
+    Busca por prefijo de nombre, apellidos, empresa, parte local del email o teléfono (sin tildes
+    ni mayúsculas; el teléfono por los dígitos del número local). Primero los nombres completos
+    que empiezan con la búsqueda y luego el resto, ordenado por relevancia.
     Si se especifica company_id, busca solo en esa empresa.
     """
     username = current_user["username"]
@@ -6547,43 +6754,42 @@ async def search_contacts(
             ]
         }
     
-    # Si hay texto de búsqueda, agregar filtro
-    if q and q.strip():
-        search_regex = {"$regex": q.strip(), "$options": "i"}
-        search_conditions = [
-            {"nombre": search_regex},
-            {"apellidos": search_regex},
-            {"name": search_regex},  # Por compatibilidad
-            {"email": search_regex},
-            {"phone": search_regex},
-            {"whatsapp": search_regex},
-            {"company": search_regex}
-        ]
-        # Combinar con la query base
-        final_query = {
-            "$and": [
-                base_query,
-                {"$or": search_conditions}
-            ]
-        }
-    else:
-        final_query = base_query
+    projection = {"_id": 0, "id": 1, "nombre": 1, "apellidos": 1, "name": 1, "email": 1,
+                  "phone": 1, "whatsapp": 1, "company": 1, "contact_type": 1, "search_name": 1}
     
-    contacts_cursor = await db.contacts.find(
-        final_query, 
-        {"_id": 0}
-    ).sort("nombre", 1).limit(limit).to_list(limit)
+    tokens = contact_query_tokens(q)
+    if not tokens:
+        contacts_cursor = await db.contacts.find(base_query, projection).sort("search_name", 1).limit(limit).to_list(limit)
+    else:
+        # 1) Nombres completos que empiezan con la búsqueda (prefijo anclado sobre el índice de search_name)
+        contacts_cursor = []
+        name_query = contact_name_prefix_query(q)
+        if name_query:
+            contacts_cursor = await db.contacts.find(
+                {"$and": [base_query, name_query]},
+                projection
+            ).sort("search_name", 1).limit(limit).to_list(limit)
+        
+        # 2) El resto de lugares, con los prefijos de palabras (índice multikey sobre search_tokens)
+        remaining = limit - len(contacts_cursor)
+        if remaining:
+            token_query = {"search_tokens": {"$all": tokens}}
+            if contacts_cursor:
+                token_query["id"] = {"$nin": [c["id"] for c in contacts_cursor]}
+            # Se leen algunos candidatos más para ordenarlos por relevancia
+            candidates = remaining * CONTACT_SEARCH_CANDIDATE_FACTOR
+            others = await db.contacts.find(
+                {"$and": [base_query, token_query]}, projection
+            ).sort("search_name", 1).limit(candidates).to_list(candidates)
+            others.sort(key=lambda c: rank_contact(c, q))
+            contacts_cursor.extend(others[:remaining])
     
     # Formatear respuesta con nombre completo
     contacts = []
-    for c in contacts_cursor:
-        nombre = c.get("nombre", "") or c.get("name", "")
-        apellidos = c.get("apellidos", "")
-        full_name = f"{nombre} {apellidos}".strip() if apellidos else nombre
-        
+    for c in contacts_cursor[:limit]:
         contacts.append({
             "id": c.get("id"),
-            "name": full_name,
+            "name": contact_full_name(c),
             "email": c.get("email"),
             "phone": c.get("phone") or c.get("whatsapp"),
             "company": c.get("company"),
@@ -6626,6 +6832,12 @@ async def create_contact(request: CreateContactRequest, current_user: dict = Dep
         if membership.get("role") == "viewer":
             raise HTTPException(status_code=403, detail="No tienes permisos para crear contactos en este workspace")
     
+    # Validar campos personalizados con el validador compilado de la configuración (cacheada)
+    validate_custom_fields = await get_custom_field_validator(db, username, request.contact_type)
+    errors = validate_custom_fields(request.custom_fields)
+    if errors:
+        raise HTTPException(status_code=400, detail="; ".join(errors))
+    
     contact = {
         "id": f"contact_{uuid.uuid4().hex[:12]}",
         "contact_type": request.contact_type,
@@ -6642,21 +6854,82 @@ async def create_contact(request: CreateContactRequest, current_user: dict = Dep
         "updated_at": now
     }
     
-    await db.contacts.insert_one(contact)
-    
-    # Retornar sin _id
-    if "_id" in contact:
-        del contact["_id"]
+    await db.contacts.insert_one({**contact, **build_contact_search_fields(contact)})
     return {"contact": contact, "message": "Contacto creado"}
 
 
+async def verify_contact_scope_access(username: str, company_id: Optional[str], workspace_id: Optional[str]):
+    """Mismas verificaciones que al crear un contacto: dueño de la empresa y miembro (no viewer) del workspace"""
+    if company_id:
+        company = await db.finanzas_companies.find_one({
+            "id": company_id,
+            "owner_username": username
+        })
+        if not company:
+            raise HTTPException(status_code=403, detail="No tienes acceso a esta empresa")
+    
+    if workspace_id:
+        membership = await db.workspace_members.find_one({
+            "workspace_id": workspace_id,
+            "username": username
+        })
+        if not membership:
+            raise HTTPException(status_code=403, detail="No tienes acceso a este workspace")
+        if membership.get("role") == "viewer":
+            raise HTTPException(status_code=403, detail="No tienes permisos para crear contactos en este workspace")
+
+
+@api_router.post("/contacts/import")
+async def import_contacts_file(
+    contact_type: str,
+    file: UploadFile = File(...),
+    company_id: Optional[str] = None,
+    workspace_id: Optional[str] = None,
+    format: Optional[str] = None,
+    default_country: str = "PE",
+    dry_run: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Importar contactos desde un CSV o vCard (hasta 100k por archivo).
+    Mapea columnas a los campos del contacto y a los campos personalizados, normaliza
+    teléfonos, omite duplicados (teléfono/email ya existentes o repetidos en el archivo)
+    e inserta por bloques con insert_many. Con dry_run=true solo devuelve el reporte.
+    """
+    username = current_user["username"]
+    
+    file_format = (format or "").lower()
+    if not file_format:
+        filename = (file.filename or "").lower()
+        file_format = "vcf" if filename.endswith((".vcf", ".vcard")) else "csv"
+    if file_format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="El formato debe ser 'csv' o 'vcf'")
+    if default_country.upper() not in COUNTRY_DIAL_CODES:
+        raise HTTPException(status_code=400, detail="País por defecto no soportado")
+    
+    await verify_contact_scope_access(username, company_id, workspace_id)
+    
+    try:
+        report = await import_contacts(
+            db, file.file, file_format, contact_type, username,
+            company_id=company_id, workspace_id=workspace_id,
+            country=default_country, dry_run=dry_run
+        )
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El archivo debe estar codificado en UTF-8")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return report
+
+
 @api_router.get("/contacts/{contact_id}")
 async def get_contact(contact_id: str, current_user: dict = Depends(get_current_user)):
     """Obtener un contacto específico (personal o de workspace con acceso)"""
     username = current_user["username"]
     
     # Buscar el contacto primero
-    contact = await db.contacts.find_one({"id": contact_id}, {"_id": 0})
+    contact = await db.contacts.find_one({"id": contact_id}, CONTACT_PROJECTION)
     
     if not contact:
         raise HTTPException(status_code=404, detail="Contacto no encontrado")
@@ -6724,33 +6997,35 @@ async def update_contact(contact_id: str, request: UpdateContactRequest, current
     if request.email is not None:
         update_data["email"] = request.email
     if request.custom_fields is not None:
+        validate_custom_fields = await get_custom_field_validator(db, username, contact["contact_type"])
+        # Solo se validan los valores que cambian: uno guardado con una opción ya eliminada
+        # (o de antes de cambiar el tipo del campo) no impide editar el resto del contacto
+        stored_fields = contact.get("custom_fields") or {}
+        errors = validate_custom_fields({
+            field_id: value for field_id, value in request.custom_fields.items()
+            if stored_fields.get(field_id) != value
+        })
+        if errors:
+            raise HTTPException(status_code=400, detail="; ".join(errors))
         update_data["custom_fields"] = request.custom_fields
     if request.labels is not None:
         update_data["labels"] = request.labels
     
+    # Mantener los tokens de búsqueda al cambiar nombre, email o teléfono
+    if {"nombre", "apellidos", "whatsapp", "email"} & update_data.keys():
+        update_data.update(build_contact_search_fields({**contact, **update_data}))
+    
     await db.contacts.update_one({"id": contact_id}, {"$set": update_data})
     
-    updated_contact = await db.contacts.find_one({"id": contact_id}, {"_id": 0})
+    updated_contact = await db.contacts.find_one({"id": contact_id}, CONTACT_PROJECTION)
     return {"contact": updated_contact, "message": "Contacto actualizado"}
 
 
-@api_router.delete("/contacts/{contact_id}")
-async def delete_contact(contact_id: str, current_user: dict = Depends(get_current_user)):
-    """Eliminar un contacto (personal o de workspace con permisos)"""
-    username = current_user["username"]
-    
-    # Buscar el contacto
-    contact = await db.contacts.find_one({"id": contact_id})
-    
-    if not contact:
-        raise HTTPException(status_code=404, detail="Contacto no encontrado")
-    
-    # Verificar permisos de eliminación
-    can_delete = False
-    
+async def can_delete_contact(contact: dict, username: str) -> bool:
+    """Permiso de eliminación: contacto personal propio u owner/admin del workspace"""
     # Si es contacto personal del usuario
     if contact.get("owner_username") == username and not contact.get("workspace_id"):
-        can_delete = True
+        return True
     
     # Si es contacto de workspace, verificar rol (solo owner y admin pueden eliminar)
     if contact.get("workspace_id"):
@@ -6759,15 +7034,110 @@ async def delete_contact(contact_id: str, current_user: dict = Depends(get_curre
             "username": username
         })
         if membership and membership.get("role") in ["owner", "admin"]:
-            can_delete = True
+            return True
+    
+    return False
+
+
+@api_router.delete("/contacts/{contact_id}")
+async def delete_contact(contact_id: str, current_user: dict = Depends(get_current_user)):
+    """Eliminar un contacto (personal o de workspace con permisos)"""
+    username = current_user["username"]
+    
+    # Buscar el contacto
+    contact = await db.contacts.find_one({"id": contact_id})
+    
+    if not contact:
+        raise HTTPException(status_code=404, detail="Contacto no encontrado")
     
-    if not can_delete:
+    if not await can_delete_contact(contact, username):
         raise HTTPException(status_code=403, detail="No tienes permisos para eliminar este contacto")
     
     await db.contacts.delete_one({"id": contact_id})
     return {"message": "Contacto eliminado"}
 
 
+# ==========================================
+# DUPLICADOS Y FUSIÓN DE CONTACTOS
+# ==========================================
+
+class MergeContactsRequest(BaseModel):
+    primary_id: str
+    duplicate_ids: List[str]
+
+
+@api_router.post("/contacts/dedupe/jobs")
+async def start_contact_dedupe(
+    company_id: Optional[str] = None,
+    workspace_id: Optional[str] = None,
+    contact_type: Optional[str] = None,
+    min_score: float = Query(DEDUPE_MIN_SCORE, ge=0, le=1),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Buscar contactos duplicados en segundo plano.
+    Retorna el trabajo; las sugerencias se consultan en GET /contacts/dedupe/jobs/{job_id}.
+    """
+    username = current_user["username"]
+    await verify_contact_scope_access(username, company_id, workspace_id)
+    
+    job = await create_dedupe_job(
+        db, username, contact_scope(company_id, workspace_id, username), contact_type, min_score
+    )
+    return {"job_id": job["id"], "status": job["status"]}
+
+
+@api_router.get("/contacts/dedupe/jobs/{job_id}")
+async def get_contact_dedupe_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Estado y sugerencias de fusión de una búsqueda de duplicados"""
+    job = await get_dedupe_job(db, job_id)
+    if not job or job["requested_by"] != current_user["username"]:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@api_router.post("/contacts/merge")
+async def merge_duplicate_contacts(request: MergeContactsRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Fusionar contactos duplicados en el principal.
+    Reasigna ingresos, gastos, gastos fijos y mensajes de WhatsApp y elimina los duplicados.
+    """
+    username = current_user["username"]
+    full_name = current_user.get("full_name", current_user.get("nombre", username))
+    
+    duplicate_ids = [d for d in dict.fromkeys(request.duplicate_ids) if d != request.primary_id]
+    if not duplicate_ids:
+        raise HTTPException(status_code=400, detail="Indica al menos un contacto duplicado")
+    if len(duplicate_ids) > MAX_MERGE_DUPLICATES:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_MERGE_DUPLICATES} duplicados por fusión")
+    
+    contacts = await db.contacts.find(
+        {"id": {"$in": [request.primary_id] + duplicate_ids}}, CONTACT_PROJECTION
+    ).to_list(len(duplicate_ids) + 1)
+    by_id = {c["id"]: c for c in contacts}
+    if len(by_id) != len(duplicate_ids) + 1:
+        raise HTTPException(status_code=404, detail="Contacto no encontrado")
+    
+    primary = by_id[request.primary_id]
+    duplicates = [by_id[d] for d in duplicate_ids]
+    
+    # Todos en el mismo ámbito y con permiso de eliminación sobre los duplicados
+    def scope_of(contact):
+        return contact_scope(contact.get("company_id"), contact.get("workspace_id"), contact.get("owner_username"))
+    if any(scope_of(d) != scope_of(primary) for d in duplicates):
+        raise HTTPException(status_code=400, detail="Los contactos deben pertenecer al mismo ámbito")
+    if not await can_delete_contact(primary, username):
+        raise HTTPException(status_code=403, detail="No tienes permisos para fusionar estos contactos")
+    
+    whatsapp_workspace_ids = [await get_or_create_workspace(username, full_name)]
+    if primary.get("workspace_id"):
+        whatsapp_workspace_ids.append(primary["workspace_id"])
+    
+    result = await merge_contacts(db, primary, duplicates, whatsapp_workspace_ids)
+    contact = await db.contacts.find_one({"id": request.primary_id}, CONTACT_PROJECTION)
+    return {**result, "contact": contact, "message": f"{len(duplicate_ids)} contacto(s) fusionado(s)"}
+
+
 # ==========================================
 # CUSTOM FIELDS ENDPOINTS
 # ==========================================
@@ -6775,10 +7145,7 @@ async def delete_contact(contact_id: str, current_user: dict = Depends(get_curre
 @api_router.get("/contacts/config/fields/{contact_type}")
 async def get_custom_fields(contact_type: str, current_user: dict = Depends(get_current_user)):
     """Obtener configuración de campos personalizados para un tipo de contacto"""
-    config = await db.contact_field_configs.find_one(
-        {"contact_type": contact_type, "owner_username": current_user["username"]},
-        {"_id": 0}
-    )
+    config = await get_contact_config(db, FIELD_CONFIG_COLLECTION, current_user["username"], contact_type)
     
     if not config:
         # Retornar configuración vacía si no existe
@@ -6811,10 +7178,10 @@ async def create_custom_field(contact_type: str, request: CreateCustomFieldReque
         # Agregar campo a configuración existente
         await db.contact_field_configs.update_one(
             {"contact_type": contact_type, "owner_username": current_user["username"]},
-            {
+            config_version_update({
                 "$push": {"fields": new_field},
                 "$set": {"updated_at": now}
-            }
+            })
         )
     else:
         # Crear nueva configuración
@@ -6822,11 +7189,13 @@ async def create_custom_field(contact_type: str, request: CreateCustomFieldReque
             "contact_type": contact_type,
             "owner_username": current_user["username"],
             "fields": [new_field],
+            "version": 1,
             "created_at": now,
             "updated_at": now
         }
         await db.contact_field_configs.insert_one(config)
     
+    invalidate_contact_config(current_user["username"], contact_type)
     return {"field": new_field, "message": "Campo creado"}
 
 
@@ -6865,9 +7234,10 @@ async def update_custom_field(contact_type: str, field_id: str, request: UpdateC
     
     await db.contact_field_configs.update_one(
         {"contact_type": contact_type, "owner_username": current_user["username"]},
-        {"$set": {"fields": fields, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        config_version_update({"$set": {"fields": fields, "updated_at": datetime.now(timezone.utc).isoformat()}})
     )
     
+    invalidate_contact_config(current_user["username"], contact_type)
     return {"message": "Campo actualizado"}
 
 
@@ -6887,9 +7257,10 @@ async def delete_custom_field(contact_type: str, field_id: str, current_user: di
     
     await db.contact_field_configs.update_one(
         {"contact_type": contact_type, "owner_username": current_user["username"]},
-        {"$set": {"fields": fields, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        config_version_update({"$set": {"fields": fields, "updated_at": datetime.now(timezone.utc).isoformat()}})
     )
     
+    invalidate_contact_config(current_user["username"], contact_type)
     return {"message": "Campo eliminado"}
 
 
@@ -6900,10 +7271,7 @@ async def delete_custom_field(contact_type: str, field_id: str, current_user: di
 @api_router.get("/contacts/labels/{contact_type}")
 async def get_contact_labels(contact_type: str, current_user: dict = Depends(get_current_user)):
     """Obtener todas las etiquetas de un tipo de contacto"""
-    config = await db.contact_label_configs.find_one({
-        "contact_type": contact_type,
-        "owner_username": current_user["username"]
-    })
+    config = await get_contact_config(db, LABEL_CONFIG_COLLECTION, current_user["username"], contact_type)
     
     if not config:
         return {"labels": []}
@@ -6946,16 +7314,18 @@ async def create_contact_label(contact_type: str, label_data: dict, current_user
     if config:
         await db.contact_label_configs.update_one(
             {"contact_type": contact_type, "owner_username": current_user["username"]},
-            {"$set": {"labels": labels, "updated_at": datetime.now(timezone.utc).isoformat()}}
+            config_version_update({"$set": {"labels": labels, "updated_at": datetime.now(timezone.utc).isoformat()}})
         )
     else:
         await db.contact_label_configs.insert_one({
             "contact_type": contact_type,
             "owner_username": current_user["username"],
             "labels": labels,
+            "version": 1,
             "created_at": datetime.now(timezone.utc).isoformat()
         })
     
+    invalidate_contact_config(current_user["username"], contact_type)
     return {"label": new_label, "message": "Etiqueta creada"}
 
 
@@ -6990,9 +7360,10 @@ async def update_contact_label(contact_type: str, label_id: str, label_data: dic
     
     await db.contact_label_configs.update_one(
         {"contact_type": contact_type, "owner_username": current_user["username"]},
-        {"$set": {"labels": labels, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        config_version_update({"$set": {"labels": labels, "updated_at": datetime.now(timezone.utc).isoformat()}})
     )
     
+    invalidate_contact_config(current_user["username"], contact_type)
     return {"label": labels[label_idx], "message": "Etiqueta actualizada"}
 
 
@@ -7011,8 +7382,9 @@ async def delete_contact_label(contact_type: str, label_id: str, current_user: d
     
     await db.contact_label_configs.update_one(
         {"contact_type": contact_type, "owner_username": current_user["username"]},
-        {"$set": {"labels": labels, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        config_version_update({"$set": {"labels": labels, "updated_at": datetime.now(timezone.utc).isoformat()}})
     )
+    invalidate_contact_config(current_user["username"], contact_type)
     
     # Quitar la etiqueta de todos los contactos que la tengan
     await db.contacts.update_many(
@@ -7050,6 +7422,13 @@ class CreateShareLinkRequest(BaseModel):
 class ToggleShareLinkRequest(BaseModel):
     is_active: bool
 
+class ResourceRef(BaseModel):
+    resource_type: str
+    resource_id: str
+
+class BulkPermissionCheckRequest(BaseModel):
+    resources: List[ResourceRef] = Field(..., max_length=500)
+
 
 # --- Workspace Endpoints ---
 
@@ -7092,13 +7471,12 @@ async def get_workspace_members_endpoint(workspace_id: str, current_user: dict =
     
     members = await get_workspace_members(db, workspace_id)
     
-    # Enriquecer con datos de usuario
+    # Enriquecer con datos de usuario (una sola consulta)
+    users = await get_users_by_username(db, [m["username"] for m in members])
+    
     enriched_members = []
     for member in members:
-        user = await db.users.find_one(
-            {"username": member["username"]},
-            {"_id": 0, "username": 1, "email": 1, "full_name": 1, "picture": 1}
-        )
+        user = users.get(member["username"])
         if user:
             enriched_members.append({
                 **member,
@@ -7169,6 +7547,7 @@ async def create_team_workspace(
         "invited_by": None
     }
     await db.workspace_members.insert_one(member)
+    invalidate_permission_cache(username=username)
     
     workspace["user_role"] = "owner"
     return {"workspace": workspace, "message": "Workspace de equipo creado"}
@@ -7280,6 +7659,7 @@ async def update_workspace_member_role(
         {"workspace_id": workspace_id, "username": member_username},
         {"$set": {"role": request.role, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
+    invalidate_permission_cache(username=member_username)
     
     return {"message": f"Rol actualizado a {request.role}"}
 
@@ -7318,6 +7698,7 @@ async def remove_workspace_member(
         "workspace_id": workspace_id,
         "username": member_username
     })
+    invalidate_permission_cache(username=member_username)
     
     return {"message": "Miembro removido del workspace"}
 
@@ -7510,7 +7891,7 @@ async def accept_invitation_get(token: str, current_user: dict = Depends(get_cur
     )
     
     # Procesar notificación al invitador
-    await process_activity_notification(db, activity, send_activity_notification_email)
+    await process_activity_notification(db, activity)
     
     return {
         "success": True,
@@ -7877,6 +8258,27 @@ async def access_shared_resource(token: str):
     }
 
 
+# --- Bulk Permission Check ---
+
+@api_router.post("/permissions/bulk-check")
+async def bulk_check_permissions(
+    request: BulkPermissionCheckRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Obtener el rol del usuario actual sobre varios recursos en una sola llamada"""
+    for ref in request.resources:
+        if ref.resource_type not in RESOURCE_TYPES:
+            raise HTTPException(status_code=400, detail=f"Tipo de recurso inválido: {ref.resource_type}")
+    
+    results = await check_resource_permissions_bulk(
+        db,
+        current_user["username"],
+        [(ref.resource_type, ref.resource_id) for ref in request.resources]
+    )
+    
+    return {"results": results}
+
+
 # --- Resources Shared With Me ---
 
 @api_router.get("/shared-with-me")
@@ -7887,7 +8289,7 @@ async def get_shared_with_me(current_user: dict = Depends(get_current_user)):
     # Buscar permisos directos
     permissions = await db.resource_permissions.find(
         {"principal_type": "user", "principal_id": username},
-        {"_id": 0}
+        {"_id": 0, "resource_type": 1, "resource_id": 1, "role": 1, "created_at": 1}
     ).to_list(100)
     
     shared_resources = {
@@ -7897,26 +8299,46 @@ async def get_shared_with_me(current_user: dict = Depends(get_current_user)):
         "reminders": []
     }
     
+    mindmap_ids = [p["resource_id"] for p in permissions if p["resource_type"] == "mindmap"]
+    board_ids = [p["resource_id"] for p in permissions if p["resource_type"] == "board"]
+    
+    # Cargar recursos en lote, solo con los campos que se muestran
+    mindmaps = {}
+    if mindmap_ids:
+        projects = await db.projects.find(
+            {
+                "$or": [{"id": {"$in": mindmap_ids}}, {"project_id": {"$in": mindmap_ids}}],
+                "isDeleted": {"$ne": True}
+            },
+            {"_id": 0, "id": 1, "project_id": 1, "name": 1, "username": 1}
+        ).to_list(len(mindmap_ids) * 2)
+        for project in projects:
+            for key in ("project_id", "id"):
+                if project.get(key):
+                    mindmaps[project[key]] = project
+    
+    boards = {}
+    if board_ids:
+        board_docs = await db.boards.find(
+            {"id": {"$in": board_ids}, "is_deleted": {"$ne": True}},
+            {"_id": 0, "id": 1, "title": 1, "owner_username": 1}
+        ).to_list(len(board_ids))
+        boards = {b["id"]: b for b in board_docs}
+    
+    owners = await get_users_by_username(
+        db,
+        [p.get("username") for p in mindmaps.values()] + [b.get("owner_username") for b in boards.values()],
+        fields=("full_name", "picture")
+    )
+    
     for perm in permissions:
         resource_type = perm["resource_type"]
         resource_id = perm["resource_id"]
         
         if resource_type == "mindmap":
-            resource = await db.projects.find_one(
-                {"id": resource_id, "isDeleted": {"$ne": True}},
-                {"_id": 0}
-            )
-            if not resource:
-                resource = await db.projects.find_one(
-                    {"project_id": resource_id, "isDeleted": {"$ne": True}},
-                    {"_id": 0}
-                )
+            resource = mindmaps.get(resource_id)
             if resource:
-                # Obtener info del owner
-                owner = await db.users.find_one(
-                    {"username": resource.get("username")},
-                    {"_id": 0, "full_name": 1, "picture": 1}
-                )
+                owner = owners.get(resource.get("username"))
                 shared_resources["mindmaps"].append({
                     "id": resource.get("id") or resource.get("project_id"),
                     "name": resource.get("name"),
@@ -7930,15 +8352,9 @@ async def get_shared_with_me(current_user: dict = Depends(get_current_user)):
                 })
         
         elif resource_type == "board":
-            resource = await db.boards.find_one(
-                {"id": resource_id, "is_deleted": {"$ne": True}},
-                {"_id": 0}
-            )
+            resource = boards.get(resource_id)
             if resource:
-                owner = await db.users.find_one(
-                    {"username": resource.get("owner_username")},
-                    {"_id": 0, "full_name": 1, "picture": 1}
-                )
+                owner = owners.get(resource.get("owner_username"))
                 shared_resources["boards"].append({
                     "id": resource.get("id"),
                     "name": resource.get("title"),
@@ -8268,6 +8684,19 @@ async def send_activity_notification_email(
         """
     }
     
+    if template == "activity_digest":
+        items = "".join(
+            f'<li style="margin-bottom: 8px;">{event.get("subject")}</li>'
+            for event in context.get("events", [])
+        )
+        hidden = context.get("event_count", 0) - len(context.get("events", []))
+        more = f"<p>Y {hidden} novedades más.</p>" if hidden > 0 else ""
+        templates["activity_digest"] = f"""
+            <p>Esto es lo que pasó en tus recursos compartidos:</p>
+            <ul style="padding-left: 20px;">{items}</ul>
+            {more}
+        """
+    
     body_content = templates.get(template, f"<p>Nueva actividad en {context.get('resource_name')}</p>")
     
     html_content = f"""
@@ -8386,6 +8815,7 @@ async def get_or_create_workspace(username: str, user_full_name: str = None) ->
         "joined_at": now
     }
     await db.workspace_members.insert_one(member)
+    invalidate_permission_cache(username=username)
     
     return workspace_id
 
@@ -8508,61 +8938,69 @@ async def whatsapp_get_messages(
 
 
 @api_router.get("/whatsapp/conversations")
-async def whatsapp_get_conversations(current_user: dict = Depends(get_current_user)):
-    """Get list of WhatsApp conversations with last message"""
+async def whatsapp_get_conversations(
+    limit: int = Query(100, ge=1, le=CONVERSATIONS_PAGE_MAX),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get list of WhatsApp conversations with last message (one summary document per conversation)"""
     username = current_user["username"]
     full_name = current_user.get("full_name", current_user.get("nombre", username))
     
     # Get or create workspace
     workspace_id = await get_or_create_workspace(username, full_name)
     
-    # Aggregate to get unique contacts with their last message
-    pipeline = [
-        {"$match": {"workspace_id": workspace_id, "channel": "whatsapp"}},
-        {"$sort": {"timestamp": -1}},
-        {"$group": {
-            "_id": "$contact_phone",
-            "last_message": {"$first": "$content.text"},
-            "last_timestamp": {"$first": "$timestamp"},
-            "direction": {"$first": "$direction"},
-            "unread_count": {
-                "$sum": {
-                    "$cond": [
-                        {"$and": [
-                            {"$eq": ["$direction", "inbound"]},
-                            {"$ne": ["$status", "read"]}
-                        ]},
-                        1, 0
-                    ]
-                }
-            },
-            "push_name": {"$first": "$meta.push_name"}
-        }},
-        {"$sort": {"last_timestamp": -1}},
-        {"$project": {
-            "_id": 0,
-            "phone": "$_id",
-            "name": {"$ifNull": ["$push_name", "$_id"]},
-            "last_message": 1,
-            "last_timestamp": 1,
-            "unread_count": 1
-        }}
-    ]
-    
-    conversations = await db.whatsapp_messages.aggregate(pipeline).to_list(100)
+    conversations = await get_conversations(db, workspace_id, limit)
     
     return {"conversations": conversations}
 
 
+@api_router.post("/whatsapp/conversations/{phone}/read")
+async def whatsapp_mark_conversation_read(phone: str, current_user: dict = Depends(get_current_user)):
+    """Mark inbound messages of a conversation as read"""
+    username = current_user["username"]
+    full_name = current_user.get("full_name", current_user.get("nombre", username))
+    
+    workspace_id = await get_or_create_workspace(username, full_name)
+    
+    marked = await mark_conversation_read(db, workspace_id, phone.replace("+", "").replace(" ", ""))
+    return {"marked": marked}
+
+
 # ==========================================
 # MÓDULO FINANZAS - APIs
 # ==========================================
 
+# Memo de corta duración (acotado) para workspace y contexto de empresa por usuario
+FINANCE_CONTEXT_TTL_SECONDS = 30
+FINANCE_CONTEXT_MAX_ENTRIES = 10000
+_workspace_id_memo = TTLCache(FINANCE_CONTEXT_MAX_ENTRIES, FINANCE_CONTEXT_TTL_SECONDS)
+_finance_context_memo = TTLCache(
+    FINANCE_CONTEXT_MAX_ENTRIES,
+    FINANCE_CONTEXT_TTL_SECONDS,
+    indexes={"user": lambda key: key[0], "company": lambda key: key[1]}
+)
+
+def invalidate_finance_context(company_id: Optional[str] = None, username: Optional[str] = None):
+    """Invalidar contextos de empresa memorizados (por empresa, usuario o ambos)"""
+    if company_id is not None and username is not None:
+        _finance_context_memo.pop((username, company_id))
+    elif company_id is not None:
+        _finance_context_memo.invalidate("company", company_id)
+    elif username is not None:
+        _finance_context_memo.invalidate("user", username)
+    else:
+        _finance_context_memo.clear()
+
 # Helper para obtener o crear workspace del usuario
 async def get_user_workspace_id(username: str) -> str:
     """Obtiene el workspace_id del usuario, creándolo si no existe"""
-    workspace = await db.workspaces.find_one({"owner_username": username}, {"_id": 0})
+    memo = _workspace_id_memo.get(username)
+    if memo is not None:
+        return memo
+    
+    workspace = await db.workspaces.find_one({"owner_username": username}, {"_id": 0, "id": 1})
     if workspace:
+        _workspace_id_memo.set(username, workspace.get("id"))
         return workspace.get("id")
     
     # Crear workspace personal si no existe
@@ -8575,8 +9013,20 @@ async def get_user_workspace_id(username: str) -> str:
         "type": "personal"
     }
     await db.workspaces.insert_one(new_workspace)
+    _workspace_id_memo.set(username, workspace_id)
     return workspace_id
 
+async def record_finance_movement(kind: str, before: Optional[dict], after: Optional[dict]):
+    """Propagar el alta/edición/baja de un movimiento al libro mensual, la proyección de caja y el IGV"""
+    await apply_ledger_change(db, kind, before, after)
+    
+    movement = after or before
+    if movement and movement.get("company_id"):
+        invalidate_forecast(movement["company_id"])
+        for doc in (before, after):
+            if doc and doc.get("date"):
+                invalidate_tax_period(doc["company_id"], doc["date"])
+
 # ==========================================
 # EMPRESAS (Companies)
 # ==========================================
@@ -8650,6 +9100,7 @@ async def update_company(
         {"id": company_id},
         {"$set": update_data}
     )
+    invalidate_finance_context(company_id)
     
     updated = await db.finanzas_companies.find_one({"id": company_id}, {"_id": 0})
     return updated
@@ -8669,6 +9120,9 @@ async def delete_company(
     - Todos los tableros de la empresa
     - Todos los recordatorios operativos de la empresa
     
+    La empresa queda marcada como "en eliminación" y deja de estar accesible al instante;
+    los datos se eliminan en segundo plano (progreso en GET /deletion-jobs/{job_id}).
+    
     Requiere confirmación: escribir el nombre exacto de la empresa o "ELIMINAR"
     """
     username = current_user["username"]
@@ -8688,37 +9142,58 @@ async def delete_company(
             detail=f"Confirmación incorrecta. Debes escribir el nombre exacto de la empresa ('{company_name}') o 'ELIMINAR'"
         )
     
-    # Contar datos que serán eliminados (para el resumen)
-    stats = {
-        "incomes": await db.finanzas_incomes.count_documents({"company_id": company_id}),
-        "expenses": await db.finanzas_expenses.count_documents({"company_id": company_id}),
-        "investments": await db.finanzas_investments.count_documents({"company_id": company_id}),
-        "contacts": await db.contacts.count_documents({"company_id": company_id}),
-        "boards": await db.boards.count_documents({"company_id": company_id}),
-        "reminders": await db.reminders.count_documents({"company_id": company_id}) if await db.list_collection_names() else 0
-    }
-    
-    # Eliminar TODOS los datos operativos de la empresa
-    # 1. Finanzas
-    await db.finanzas_incomes.delete_many({"company_id": company_id})
-    await db.finanzas_expenses.delete_many({"company_id": company_id})
-    await db.finanzas_investments.delete_many({"company_id": company_id})
-    
-    # 2. Contactos
-    await db.contacts.delete_many({"company_id": company_id})
-    
-    # 3. Tableros (y sus tarjetas están dentro del documento)
-    await db.boards.delete_many({"company_id": company_id})
+    if company.get("deletion_job_id"):
+        job = await get_deletion_job(db, company["deletion_job_id"])
+        if job and job["status"] in ("queued", "running"):
+            raise HTTPException(status_code=409, detail="La empresa ya se está eliminando")
     
-    # 4. Recordatorios operativos (solo los que tienen company_id)
-    await db.reminders.delete_many({"company_id": company_id})
+    # Marcar la empresa como "en eliminación": deja de estar accesible de inmediato
+    await db.finanzas_companies.update_one(
+        {"id": company_id},
+        {"$set": {"deleting": True, "deleting_since": get_current_timestamp()}}
+    )
+    invalidate_finance_context(company_id)
+    invalidate_forecast(company_id)
+    invalidate_tax_period(company_id)
+    await drop_company_ledger(db, company_id)
+    
+    # Los datos operativos se eliminan por bloques en segundo plano; la empresa va al final
+    by_company = {"company_id": company_id}
+    steps = [
+        deletion_step("finanzas_incomes", by_company, "incomes"),
+        deletion_step("finanzas_expenses", by_company, "expenses"),
+        deletion_step("finanzas_investments", by_company, "investments"),
+        deletion_step("finanzas_partial_payments", by_company, "partial_payments"),
+        deletion_step("finanzas_fixed_expenses", by_company, "fixed_expenses"),
+        deletion_step("finanzas_fixed_expense_payments", by_company, "fixed_expense_payments"),
+        deletion_step("finanzas_fixed_expense_reminders", by_company, "fixed_expense_reminders"),
+        deletion_step("finanzas_products", by_company, "products"),
+        deletion_step("contacts", by_company, "contacts"),
+        deletion_step("boards", by_company, "boards"),
+        deletion_step("reminders", by_company, "reminders"),
+        deletion_step("company_collaborators", by_company, "collaborators"),
+        deletion_step("company_invitations", by_company, "invitations"),
+        deletion_step("company_activities", by_company, "activities"),
+        deletion_step("finanzas_companies", {"id": company_id}, "company"),
+    ]
     
-    # 5. Finalmente, eliminar la empresa
-    await db.finanzas_companies.delete_one({"id": company_id})
+    job = await create_deletion_job(
+        db, "company", username, steps,
+        target={"company_id": company_id, "company_name": company_name}
+    )
+    await db.finanzas_companies.update_one(
+        {"id": company_id},
+        {"$set": {"deletion_job_id": job["id"]}}
+    )
     
+    # Los conteos por paso se calculan dentro del trabajo y se consultan con su job_id
     return {
-        "message": f"Empresa '{company_name}' eliminada permanentemente",
-        "deleted_data": stats
+        "message": (
+            f"La empresa '{company_name}' se está eliminando en segundo plano; "
+            f"consulta el avance en /api/deletion-jobs/{job['id']}"
+        ),
+        "job_id": job["id"],
+        "status": job["status"]
     }
 
 # Helper para verificar acceso a empresa
@@ -8730,7 +9205,7 @@ async def verify_company_access(company_id: str, username: str) -> dict:
         {"_id": 0}
     )
     
-    if not company:
+    if not company or company.get("deleting"):
         raise HTTPException(status_code=404, detail="Empresa no encontrada")
     
     # Verificar si es propietario
@@ -8750,10 +9225,44 @@ async def verify_company_access(company_id: str, username: str) -> dict:
     
     raise HTTPException(status_code=403, detail="No tienes acceso a esta empresa")
 
-# ==========================================
-# INGRESOS (Incomes)
-# ==========================================
-
+async def resolve_finance_context(username: str, company_id: str) -> FinanceContext:
+    """
+    Resolver empresa, rol y workspace del usuario para una empresa.
+    El resultado se memoriza unos segundos por (usuario, empresa).
+    """
+    key = (username, company_id)
+    
+    memo = _finance_context_memo.get(key)
+    if memo is not None:
+        return memo
+    
+    company, workspace_id = await asyncio.gather(
+        verify_company_access(company_id, username),
+        get_user_workspace_id(username)
+    )
+    
+    context = FinanceContext(
+        username=username,
+        company_id=company_id,
+        company=company,
+        role=company["user_role"],
+        workspace_id=workspace_id
+    )
+    
+    _finance_context_memo.set(key, context)
+    return context
+
+async def get_finance_context(
+    company_id: str,
+    current_user: dict = Depends(get_current_user)
+) -> FinanceContext:
+    """Dependencia FastAPI: contexto de empresa para endpoints /finanzas con ?company_id="""
+    return await resolve_finance_context(current_user["username"], company_id)
+
+# ==========================================
+# INGRESOS (Incomes)
+# ==========================================
+
 @api_router.get("/finanzas/incomes", response_model=List[IncomeResponse])
 async def get_incomes(
     company_id: str,
@@ -8761,12 +9270,10 @@ async def get_incomes(
     project_id: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Obtener lista de ingresos con filtros opcionales"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     query = {"company_id": company_id, "workspace_id": workspace_id}
     
@@ -8792,40 +9299,14 @@ async def create_income(
 ):
     """Crear un nuevo ingreso con soporte para pagos parciales"""
     username = current_user["username"]
-    await verify_company_access(income_data.company_id, username)
-    workspace_id = await get_user_workspace_id(username)
-    now = get_current_timestamp()
-    
-    # Calcular paid_amount y pending_balance
-    amount = income_data.amount
-    paid_amount = income_data.paid_amount or 0
-    
-    # Si el estado es "collected", el pago es completo
-    if income_data.status == IncomeStatus.COLLECTED:
-        paid_amount = amount
-    
-    # Calcular saldo pendiente
-    pending_balance = max(0, amount - paid_amount)
+    ctx = await resolve_finance_context(username, income_data.company_id)
     
-    # Si el saldo es 0 y hay monto, marcar como cobrado
-    final_status = income_data.status
-    if pending_balance == 0 and amount > 0 and income_data.status == IncomeStatus.PENDING:
-        final_status = IncomeStatus.COLLECTED
+    income = build_income_document(income_data, ctx.workspace_id, username, get_current_timestamp())
     
-    income = {
-        "id": generate_id(),
-        "workspace_id": workspace_id,
-        "username": username,
-        **income_data.model_dump(),
-        "paid_amount": paid_amount,
-        "pending_balance": pending_balance,
-        "status": final_status,
-        "created_at": now,
-        "updated_at": now
-    }
-    
-    await db.finanzas_incomes.insert_one(income)
-    income.pop("_id", None)
+    async with ledger_write(db):
+        await db.finanzas_incomes.insert_one(income)
+        income.pop("_id", None)
+        await record_finance_movement("income", None, income)
     
     # Registrar actividad
     await log_company_activity(
@@ -8869,16 +9350,19 @@ async def update_income(
     update_dict = {k: v for k, v in income_data.model_dump().items() if v is not None}
     update_dict["updated_at"] = get_current_timestamp()
     
-    result = await db.finanzas_incomes.find_one_and_update(
-        {"id": income_id, "workspace_id": workspace_id},
-        {"$set": update_dict},
-        return_document=True
-    )
+    async with ledger_write(db):
+        previous = await db.finanzas_incomes.find_one_and_update(
+            {"id": income_id, "workspace_id": workspace_id},
+            {"$set": update_dict},
+            projection={"_id": 0}
+        )
     
-    if not result:
-        raise HTTPException(status_code=404, detail="Ingreso no encontrado")
+        if not previous:
+            raise HTTPException(status_code=404, detail="Ingreso no encontrado")
+    
+        result = {**previous, **update_dict}
+        await record_finance_movement("income", previous, result)
     
-    result.pop("_id", None)
     return result
 
 @api_router.delete("/finanzas/incomes/{income_id}")
@@ -8889,15 +9373,62 @@ async def delete_income(
     """Eliminar un ingreso"""
     workspace_id = await get_user_workspace_id(current_user["username"])
     
-    result = await db.finanzas_incomes.delete_one(
-        {"id": income_id, "workspace_id": workspace_id}
-    )
+    async with ledger_write(db):
+        deleted = await db.finanzas_incomes.find_one_and_delete(
+            {"id": income_id, "workspace_id": workspace_id},
+            projection={"_id": 0}
+        )
     
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Ingreso no encontrado")
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Ingreso no encontrado")
+    
+        await record_finance_movement("income", deleted, None)
     
     return {"message": "Ingreso eliminado correctamente"}
 
+# ==========================================
+# IMPORTACIÓN MASIVA (CSV)
+# ==========================================
+
+@api_router.post("/finanzas/import/{kind}")
+async def import_finance_movements(
+    kind: str,
+    company_id: str,
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Importar ingresos o gastos desde un CSV.
+    Valida por bloques, resuelve categorías y contactos en lote e inserta con insert_many.
+    Con dry_run=true solo valida y devuelve el reporte de errores.
+    """
+    if kind not in IMPORT_KINDS:
+        raise HTTPException(status_code=400, detail="Solo se pueden importar 'incomes' o 'expenses'")
+    
+    filename = (file.filename or "").lower()
+    if filename and not filename.endswith(".csv"):
+        raise HTTPException(status_code=400, detail="El archivo debe ser CSV")
+    
+    try:
+        report = await import_movements_csv(
+            db, kind, file.file, company_id, ctx.workspace_id, ctx.username, dry_run
+        )
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="El archivo debe estar codificado en UTF-8")
+    
+    if report["imported"] and not dry_run:
+        await log_company_activity(
+            company_id=company_id,
+            activity_type=f"{kind}_imported",
+            actor_username=ctx.username,
+            target_name=file.filename,
+            details={"imported": report["imported"], "failed": report["failed"]},
+            amount=report["total_amount"]
+        )
+    
+    return report
+
 # ==========================================
 # GASTOS (Expenses)
 # ==========================================
@@ -8912,12 +9443,10 @@ async def get_expenses(
     is_recurring: Optional[bool] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Obtener lista de gastos con filtros opcionales"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     query = {"company_id": company_id, "workspace_id": workspace_id}
     
@@ -8959,38 +9488,15 @@ async def create_expense(
 ):
     """Crear un nuevo gasto"""
     username = current_user["username"]
-    await verify_company_access(expense_data.company_id, username)
-    workspace_id = await get_user_workspace_id(username)
-    now = get_current_timestamp()
+    ctx = await resolve_finance_context(username, expense_data.company_id)
     
     # Calcular IGV si el gasto lo incluye
-    # El monto ingresado es el total (con IGV incluido)
-    IGV_RATE = 0.18
-    includes_igv = expense_data.includes_igv
-    amount = expense_data.amount
-    
-    if includes_igv:
-        # El monto incluye IGV, calcular base e IGV
-        base_imponible = amount / (1 + IGV_RATE)
-        igv_gasto = amount - base_imponible
-    else:
-        # El gasto no tiene IGV (ej: compras informales, servicios exentos)
-        base_imponible = amount
-        igv_gasto = 0.0
-    
-    expense = {
-        "id": generate_id(),
-        "workspace_id": workspace_id,
-        "username": username,
-        **expense_data.model_dump(),
-        "base_imponible": round(base_imponible, 2),
-        "igv_gasto": round(igv_gasto, 2),
-        "created_at": now,
-        "updated_at": now
-    }
+    expense = build_expense_document(expense_data, ctx.workspace_id, username, get_current_timestamp())
     
-    await db.finanzas_expenses.insert_one(expense)
-    expense.pop("_id", None)
+    async with ledger_write(db):
+        await db.finanzas_expenses.insert_one(expense)
+        expense.pop("_id", None)
+        await record_finance_movement("expense", None, expense)
     
     # Registrar actividad
     await log_company_activity(
@@ -9051,7 +9557,6 @@ async def update_expense(
     update_dict["updated_at"] = get_current_timestamp()
     
     # Recalcular IGV si cambia el monto o el flag includes_igv
-    IGV_RATE = 0.18
     amount = update_dict.get("amount", existing.get("amount", 0))
     includes_igv = update_dict.get("includes_igv", existing.get("includes_igv", False))
     
@@ -9066,16 +9571,19 @@ async def update_expense(
         update_dict["base_imponible"] = round(base_imponible, 2)
         update_dict["igv_gasto"] = round(igv_gasto, 2)
     
-    result = await db.finanzas_expenses.find_one_and_update(
-        {"id": expense_id, "workspace_id": workspace_id},
-        {"$set": update_dict},
-        return_document=True
-    )
+    async with ledger_write(db):
+        previous = await db.finanzas_expenses.find_one_and_update(
+            {"id": expense_id, "workspace_id": workspace_id},
+            {"$set": update_dict},
+            projection={"_id": 0}
+        )
     
-    if not result:
-        raise HTTPException(status_code=404, detail="Gasto no encontrado")
+        if not previous:
+            raise HTTPException(status_code=404, detail="Gasto no encontrado")
+    
+        result = {**previous, **update_dict}
+        await record_finance_movement("expense", previous, result)
     
-    result.pop("_id", None)
     return result
 
 @api_router.delete("/finanzas/expenses/{expense_id}")
@@ -9086,12 +9594,16 @@ async def delete_expense(
     """Eliminar un gasto"""
     workspace_id = await get_user_workspace_id(current_user["username"])
     
-    result = await db.finanzas_expenses.delete_one(
-        {"id": expense_id, "workspace_id": workspace_id}
-    )
+    async with ledger_write(db):
+        deleted = await db.finanzas_expenses.find_one_and_delete(
+            {"id": expense_id, "workspace_id": workspace_id},
+            projection={"_id": 0}
+        )
     
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Gasto no encontrado")
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Gasto no encontrado")
+    
+        await record_finance_movement("expense", deleted, None)
     
     return {"message": "Gasto eliminado correctamente"}
 
@@ -9121,8 +9633,10 @@ async def duplicate_expense(
         "updated_at": now
     }
     
-    await db.finanzas_expenses.insert_one(new_expense)
-    new_expense.pop("_id", None)
+    async with ledger_write(db):
+        await db.finanzas_expenses.insert_one(new_expense)
+        new_expense.pop("_id", None)
+        await record_finance_movement("expense", None, new_expense)
     return new_expense
 
 # ==========================================
@@ -9136,12 +9650,10 @@ async def get_investments(
     project_id: Optional[str] = None,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Obtener lista de inversiones con filtros opcionales"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     query = {"company_id": company_id, "workspace_id": workspace_id}
     
@@ -9167,8 +9679,8 @@ async def create_investment(
 ):
     """Crear una nueva inversión"""
     username = current_user["username"]
-    await verify_company_access(investment_data.company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    ctx = await resolve_finance_context(username, investment_data.company_id)
+    workspace_id = ctx.workspace_id
     now = get_current_timestamp()
     
     investment = {
@@ -9180,8 +9692,10 @@ async def create_investment(
         "updated_at": now
     }
     
-    await db.finanzas_investments.insert_one(investment)
-    investment.pop("_id", None)
+    async with ledger_write(db):
+        await db.finanzas_investments.insert_one(investment)
+        investment.pop("_id", None)
+        await record_finance_movement("investment", None, investment)
     return investment
 
 @api_router.get("/finanzas/investments/{investment_id}", response_model=InvestmentResponse)
@@ -9214,16 +9728,19 @@ async def update_investment(
     update_dict = {k: v for k, v in investment_data.model_dump().items() if v is not None}
     update_dict["updated_at"] = get_current_timestamp()
     
-    result = await db.finanzas_investments.find_one_and_update(
-        {"id": investment_id, "workspace_id": workspace_id},
-        {"$set": update_dict},
-        return_document=True
-    )
+    async with ledger_write(db):
+        previous = await db.finanzas_investments.find_one_and_update(
+            {"id": investment_id, "workspace_id": workspace_id},
+            {"$set": update_dict},
+            projection={"_id": 0}
+        )
     
-    if not result:
-        raise HTTPException(status_code=404, detail="Inversión no encontrada")
+        if not previous:
+            raise HTTPException(status_code=404, detail="Inversión no encontrada")
+    
+        result = {**previous, **update_dict}
+        await record_finance_movement("investment", previous, result)
     
-    result.pop("_id", None)
     return result
 
 @api_router.delete("/finanzas/investments/{investment_id}")
@@ -9234,12 +9751,16 @@ async def delete_investment(
     """Eliminar una inversión"""
     workspace_id = await get_user_workspace_id(current_user["username"])
     
-    result = await db.finanzas_investments.delete_one(
-        {"id": investment_id, "workspace_id": workspace_id}
-    )
+    async with ledger_write(db):
+        deleted = await db.finanzas_investments.find_one_and_delete(
+            {"id": investment_id, "workspace_id": workspace_id},
+            projection={"_id": 0}
+        )
     
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Inversión no encontrada")
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Inversión no encontrada")
+    
+        await record_finance_movement("investment", deleted, None)
     
     return {"message": "Inversión eliminada correctamente"}
 
@@ -9247,6 +9768,20 @@ async def delete_investment(
 # CATEGORÍAS
 # ==========================================
 
+async def list_finance_categories(workspace_id: str, category_type: str) -> List[dict]:
+    """Categorías de gasto ('expense') o fuentes de ingreso ('income'): predefinidas + personalizadas"""
+    defaults = DEFAULT_EXPENSE_CATEGORIES if category_type == "expense" else DEFAULT_INCOME_SOURCES
+    
+    custom = await db.finanzas_categories.find(
+        {"workspace_id": workspace_id, "type": category_type},
+        {"_id": 0}
+    ).to_list(100)
+    
+    return (
+        [{**cat, "is_default": True, "type": category_type} for cat in defaults] +
+        [{**cat, "is_default": False} for cat in custom]
+    )
+
 @api_router.get("/finanzas/categories")
 async def get_expense_categories(
     current_user: dict = Depends(get_current_user)
@@ -9254,23 +9789,7 @@ async def get_expense_categories(
     """Obtener categorías de gastos (predefinidas + personalizadas)"""
     workspace_id = await get_user_workspace_id(current_user["username"])
     
-    # Buscar categorías personalizadas del usuario
-    custom_categories = await db.finanzas_categories.find(
-        {"workspace_id": workspace_id, "type": "expense"},
-        {"_id": 0}
-    ).to_list(100)
-    
-    # Combinar con categorías predefinidas
-    default_cats = [
-        {**cat, "is_default": True, "type": "expense"} 
-        for cat in DEFAULT_EXPENSE_CATEGORIES
-    ]
-    custom_cats = [
-        {**cat, "is_default": False} 
-        for cat in custom_categories
-    ]
-    
-    return {"categories": default_cats + custom_cats}
+    return {"categories": await list_finance_categories(workspace_id, "expense")}
 
 @api_router.post("/finanzas/categories")
 async def create_category(
@@ -9361,22 +9880,7 @@ async def get_income_sources(
     """Obtener fuentes de ingreso"""
     workspace_id = await get_user_workspace_id(current_user["username"])
     
-    # Buscar fuentes personalizadas
-    custom_sources = await db.finanzas_categories.find(
-        {"workspace_id": workspace_id, "type": "income"},
-        {"_id": 0}
-    ).to_list(100)
-    
-    default_sources = [
-        {**src, "is_default": True, "type": "income"} 
-        for src in DEFAULT_INCOME_SOURCES
-    ]
-    custom_src = [
-        {**src, "is_default": False} 
-        for src in custom_sources
-    ]
-    
-    return {"sources": default_sources + custom_src}
+    return {"sources": await list_finance_categories(workspace_id, "income")}
 
 # ==========================================
 # RESUMEN FINANCIERO
@@ -9386,58 +9890,34 @@ async def get_income_sources(
 async def get_financial_summary(
     company_id: str,
     period: Optional[str] = None,  # "2026-01" formato año-mes
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """
     Obtener resumen financiero del mes para una empresa.
     Si no se especifica periodo, usa el mes actual.
     """
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     # Determinar periodo
     if not period:
         now = datetime.now(timezone.utc)
         period = now.strftime("%Y-%m")
     
-    # Construir rango de fechas
-    start_date = f"{period}-01"
-    year, month = int(period[:4]), int(period[5:])
-    if month == 12:
-        end_date = f"{year + 1}-01-01"
-    else:
-        end_date = f"{year}-{month + 1:02d}-01"
-    
-    date_filter = {"$gte": start_date, "$lt": end_date}
-    
-    # Obtener ingresos del periodo
-    incomes = await db.finanzas_incomes.find(
-        {"company_id": company_id, "workspace_id": workspace_id, "date": date_filter},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    total_income = sum(i["amount"] for i in incomes)
-    income_collected = sum(i["amount"] for i in incomes if i.get("status") == "collected")
-    income_pending = sum(i["amount"] for i in incomes if i.get("status") == "pending")
+    # Totales del mes desde el libro mensual (pocos documentos, exactos para cualquier volumen)
+    entries = await get_ledger_entries(db, company_id, workspace_id, month=period)
     
-    # Obtener gastos del periodo
-    expenses = await db.finanzas_expenses.find(
-        {"company_id": company_id, "workspace_id": workspace_id, "date": date_filter},
-        {"_id": 0}
-    ).to_list(1000)
+    incomes = sum_ledger(entries, "income")
+    income_collected = sum_ledger(entries, "income", ["collected"])["amount"]
+    income_pending = sum_ledger(entries, "income", ["pending"])["amount"]
+    total_income = incomes["amount"]
     
-    total_expenses = sum(e["amount"] for e in expenses)
-    expenses_paid = sum(e["amount"] for e in expenses if e.get("status") == "paid")
-    expenses_pending = sum(e["amount"] for e in expenses if e.get("status") == "pending")
+    expenses = sum_ledger(entries, "expense")
+    expenses_paid = sum_ledger(entries, "expense", ["paid"])["amount"]
+    expenses_pending = sum_ledger(entries, "expense", ["pending"])["amount"]
+    total_expenses = expenses["amount"]
     
-    # Obtener inversiones del periodo
-    investments = await db.finanzas_investments.find(
-        {"company_id": company_id, "workspace_id": workspace_id, "date": date_filter},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    total_investments = sum(inv["amount"] for inv in investments)
+    investments = sum_ledger(entries, "investment")
+    total_investments = investments["amount"]
     
     # Calcular resultado neto y caja estimada
     net_result = income_collected - expenses_paid
@@ -9459,16 +9939,43 @@ async def get_financial_summary(
         "net_result": net_result,
         "estimated_cash": estimated_cash,
         "health_status": health_status,
-        "income_count": len(incomes),
-        "expense_count": len(expenses),
-        "investment_count": len(investments)
+        "income_count": incomes["count"],
+        "expense_count": expenses["count"],
+        "investment_count": investments["count"]
     }
 
 @api_router.get("/finanzas/summary/by-project")
 async def get_project_financial_summaries(
+    company_id: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Obtener resumen financiero agrupado por proyecto"""
+    """
+    Obtener resumen financiero agrupado por proyecto.
+    Con company_id se lee del libro mensual de la empresa; sin él se agrega
+    sobre todos los movimientos del workspace.
+    """
+    if company_id:
+        ctx = await resolve_finance_context(current_user["username"], company_id)
+        entries = await get_ledger_entries(db, company_id, ctx.workspace_id, project_id={"$ne": None})
+        
+        income_by_project, expense_by_project, investment_by_project = {}, {}, {}
+        for entry in entries:
+            pid = entry["project_id"]
+            amount = entry.get("amount", 0) or 0
+            if entry["kind"] == "income":
+                project = income_by_project.setdefault(pid, {"project_name": "Desconocido", "total_income": 0})
+                project["total_income"] += amount
+                if entry.get("project_name"):
+                    project["project_name"] = entry["project_name"]
+            elif entry["kind"] == "expense":
+                project = expense_by_project.setdefault(pid, {"total_expenses": 0})
+                project["total_expenses"] += amount
+            else:
+                project = investment_by_project.setdefault(pid, {"total_investments": 0})
+                project["total_investments"] += amount
+        
+        return {"projects": build_project_summaries(income_by_project, expense_by_project, investment_by_project)}
+    
     workspace_id = await get_user_workspace_id(current_user["username"])
     
     # Agregación de ingresos por proyecto
@@ -9513,6 +10020,10 @@ async def get_project_financial_summaries(
         for doc in await db.finanzas_investments.aggregate(investment_pipeline).to_list(100)
     }
     
+    return {"projects": build_project_summaries(income_by_project, expense_by_project, investment_by_project)}
+
+def build_project_summaries(income_by_project: dict, expense_by_project: dict, investment_by_project: dict) -> List[dict]:
+    """Combinar totales por proyecto en resúmenes con resultado neto y ROI"""
     # Combinar resultados
     all_project_ids = set(income_by_project.keys()) | set(expense_by_project.keys()) | set(investment_by_project.keys())
     
@@ -9545,32 +10056,204 @@ async def get_project_financial_summaries(
     # Ordenar por resultado neto descendente
     summaries.sort(key=lambda x: x["net_result"], reverse=True)
     
-    return {"projects": summaries}
+    return summaries
 
 # ==========================================
-# BALANCE GENERAL (CAJA REAL)
+# TENDENCIAS FINANCIERAS (MULTI-PERIODO)
 # ==========================================
 
-@api_router.get("/finanzas/balance-general")
-async def get_balance_general(
+# Máximo de periodos por consulta (10 años por mes, 5 por semana)
+TRENDS_MAX_PERIODS = 260
+
+def build_trend_periods(start_date: str, end_date: str, granularity: str, limit: Optional[int] = None) -> List[str]:
+    """
+    Listar las etiquetas de periodo (YYYY-MM o YYYY-Www) entre dos fechas.
+    Con `limit` se deja de construir al alcanzar esa cantidad de periodos.
+    """
+    current = datetime.strptime(start_date[:10], "%Y-%m-%d").date()
+    end = datetime.strptime(end_date[:10], "%Y-%m-%d").date()
+    periods = []
+    
+    while current < end and (limit is None or len(periods) < limit):
+        if granularity == "week":
+            iso_year, iso_week, _ = current.isocalendar()
+            label = f"{iso_year}-W{iso_week:02d}"
+            current += timedelta(days=7 - current.weekday())
+        else:
+            label = current.strftime("%Y-%m")
+            current = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        
+        if not periods or periods[-1] != label:
+            periods.append(label)
+    
+    return periods
+
+@api_router.get("/finanzas/trends")
+async def get_financial_trends(
     company_id: str,
-    start_date: Optional[str] = None,  # YYYY-MM-DD
-    end_date: Optional[str] = None,    # YYYY-MM-DD
-    project_id: Optional[str] = None,
-    filter_type: Optional[str] = None,  # 'today' | 'month' | 'last30days'
-    current_user: dict = Depends(get_current_user)
+    start_date: Optional[str] = None,  # YYYY-MM-DD (inclusive)
+    end_date: Optional[str] = None,    # YYYY-MM-DD (exclusivo)
+    granularity: str = "month",        # 'month' | 'week'
+    group_by: Optional[str] = None,    # 'project' | 'category'
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """
-    Obtener Balance General basado en Caja Real.
-    Solo considera ingresos y gastos efectivamente PAGADOS.
+    Series de ingresos, gastos, inversiones y resultado neto por periodo.
+    Se calculan con una sola agregación (las tres colecciones unidas con $unionWith).
+    Por defecto: últimos 12 meses.
     """
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    if granularity not in ("month", "week"):
+        raise HTTPException(status_code=400, detail="granularity debe ser 'month' o 'week'")
+    if group_by not in (None, "project", "category"):
+        raise HTTPException(status_code=400, detail="group_by debe ser 'project' o 'category'")
     
     now = datetime.now(timezone.utc)
+    if not end_date:
+        end_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
+    if not start_date:
+        year, month = now.year, now.month - 11
+        if month <= 0:
+            year, month = year - 1, month + 12
+        start_date = f"{year}-{month:02d}-01"
+    
+    try:
+        periods = build_trend_periods(start_date, end_date, granularity, limit=TRENDS_MAX_PERIODS + 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date y end_date deben tener el formato YYYY-MM-DD")
+    if len(periods) > TRENDS_MAX_PERIODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El rango supera el máximo de {TRENDS_MAX_PERIODS} periodos; acorta las fechas o usa una granularidad mayor"
+        )
+    
+    match = {
+        "company_id": company_id,
+        "workspace_id": ctx.workspace_id,
+        "date": {"$gte": start_date, "$lt": end_date}
+    }
+    
+    def movement_projection(kind: str, category_field: Optional[str]) -> dict:
+        return {"$project": {
+            "_id": 0,
+            "kind": {"$literal": kind},
+            "date": 1,
+            "amount": {"$ifNull": ["$amount", 0]},
+            "project_id": 1,
+            "project_name": 1,
+            "category": f"${category_field}" if category_field else None
+        }}
+    
+    if granularity == "week":
+        bucket = {"$dateToString": {
+            "format": "%G-W%V",
+            "date": {"$dateFromString": {"dateString": {"$substrCP": ["$date", 0, 10]}}}
+        }}
+    else:
+        bucket = {"$substrCP": ["$date", 0, 7]}
+    
+    group_key = {"project": "$project_id", "category": "$category"}.get(group_by)
+    
+    pipeline = [
+        {"$match": match},
+        movement_projection("income", "source"),
+        {"$unionWith": {"coll": "finanzas_expenses", "pipeline": [
+            {"$match": match}, movement_projection("expense", "category")
+        ]}},
+        {"$unionWith": {"coll": "finanzas_investments", "pipeline": [
+            {"$match": match}, movement_projection("investment", None)
+        ]}},
+        {"$group": {
+            "_id": {"period": bucket, "kind": "$kind", "group": group_key},
+            "amount": {"$sum": "$amount"},
+            "label": {"$last": "$project_name"}
+        }}
+    ]
+    
+    buckets = await db.finanzas_incomes.aggregate(pipeline).to_list(None)
+    
+    period_index = {p: i for i, p in enumerate(periods)}
+    
+    series = {}
+    for doc in buckets:
+        key = doc["_id"]
+        index = period_index.get(key["period"])
+        if index is None:
+            continue
+        
+        group = key.get("group")
+        entry = series.setdefault(group, {
+            "key": group,
+            "label": group,
+            "income": [0] * len(periods),
+            "expense": [0] * len(periods),
+            "investment": [0] * len(periods)
+        })
+        entry[key["kind"]][index] += doc["amount"]
+        if group_by == "project" and doc.get("label"):
+            entry["label"] = doc["label"]
+    
+    result = []
+    for entry in series.values():
+        for kind in ("income", "expense", "investment"):
+            entry[kind] = [round(v, 2) for v in entry[kind]]
+        entry["net"] = [round(i - e, 2) for i, e in zip(entry["income"], entry["expense"])]
+        result.append(entry)
+    
+    result.sort(key=lambda e: sum(e["income"]) + sum(e["expense"]), reverse=True)
+    
+    return {
+        "company_id": company_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "granularity": granularity,
+        "group_by": group_by,
+        "periods": periods,
+        "series": result
+    }
+
+# ==========================================
+# PROYECCIÓN DE CAJA
+# ==========================================
+
+@api_router.get("/finanzas/forecast")
+async def get_financial_forecast(
+    company_id: str,
+    horizon_days: int = Query(90, ge=1, le=MAX_FORECAST_DAYS),
+    opening_balance: float = 0.0,
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Proyección diaria de caja: vencimientos de gastos fijos activos,
+    cuentas por cobrar y cuentas por pagar pendientes dentro del horizonte.
+    Lo vencido se considera en el día de hoy.
+    """
+    return await get_cash_forecast(
+        db, company_id, ctx.workspace_id, horizon_days, opening_balance
+    )
+
+# ==========================================
+# BALANCE GENERAL (CAJA REAL)
+# ==========================================
+
+# Monto efectivamente cobrado de un ingreso: total si está cobrado, abonado si es parcial
+BALANCE_INCOME_PAID_EXPR = {
+    "$cond": [
+        {"$eq": ["$status", "collected"]},
+        {"$ifNull": ["$amount", 0]},
+        {"$ifNull": ["$paid_amount", 0]}
+    ]
+}
+
+BALANCE_PAGE_MAX = 200
+
+def resolve_balance_period(
+    start_date: Optional[str],
+    end_date: Optional[str],
+    filter_type: Optional[str]
+) -> tuple:
+    """Determinar el rango de fechas (start, end exclusivo) según filter_type"""
+    now = datetime.now(timezone.utc)
     
-    # Determinar rango de fechas según filter_type
     if filter_type == 'today':
         start_date = now.strftime("%Y-%m-%d")
         end_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
@@ -9585,157 +10268,151 @@ async def get_balance_general(
         start_date = (now - timedelta(days=30)).strftime("%Y-%m-%d")
         end_date = (now + timedelta(days=1)).strftime("%Y-%m-%d")
     
-    # Construir filtro base
-    base_filter = {
-        "company_id": company_id,
-        "workspace_id": workspace_id,
-        "date": {"$gte": start_date, "$lt": end_date}
-    }
+    return start_date, end_date
+
+def build_balance_filter(
+    company_id: str,
+    workspace_id: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    project_id: Optional[str]
+) -> dict:
+    """Filtro base de movimientos del Balance General"""
+    date_filter = {}
+    if start_date:
+        date_filter["$gte"] = start_date
+    if end_date:
+        date_filter["$lt"] = end_date
     
+    base_filter = {"company_id": company_id, "workspace_id": workspace_id}
+    if date_filter:
+        base_filter["date"] = date_filter
     if project_id:
         base_filter["project_id"] = project_id
     
-    # ==========================================
-    # INGRESOS REALES (solo cobrados/pagados)
-    # ==========================================
-    income_filter = {**base_filter, "status": {"$in": ["collected", "partial"]}}
-    incomes = await db.finanzas_incomes.find(
-        income_filter, {"_id": 0}
-    ).sort("date", -1).to_list(1000)
-    
-    # Calcular ingresos reales considerando pagos parciales
-    income_details = []
-    total_income_real = 0
+    return base_filter
+
+def encode_balance_cursor(doc: dict) -> str:
+    """Cursor opaco (fecha + id) del último movimiento de una página"""
+    raw = json.dumps([doc.get("date"), doc.get("id")])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("utf-8")
+
+def apply_balance_cursor(query: dict, cursor: Optional[str]) -> dict:
+    """Agregar al filtro la condición para continuar después del cursor (orden fecha/id descendente)"""
+    if not cursor:
+        return query
     
-    for income in incomes:
-        if income.get("status") == "collected":
-            amount_paid = income.get("amount", 0)
-            payment_type = "total"
-        else:  # partial
-            amount_paid = income.get("paid_amount", 0) or 0
-            payment_type = "parcial"
-        
-        total_income_real += amount_paid
-        
-        income_details.append({
-            "id": income.get("id"),
-            "date": income.get("date"),
-            "description": income.get("description") or income.get("source", "Ingreso"),
-            "project_id": income.get("project_id"),
-            "project_name": income.get("project_name"),
-            "client_name": income.get("client_name"),
-            "amount_paid": amount_paid,
-            "total_amount": income.get("amount", 0),
-            "payment_type": payment_type,
-            "source": income.get("source")
-        })
+    try:
+        date, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
     
-    # ==========================================
-    # GASTOS REALES (solo pagados)
-    # ==========================================
-    expense_filter = {**base_filter, "status": "paid"}
-    expenses = await db.finanzas_expenses.find(
-        expense_filter, {"_id": 0}
-    ).sort("date", -1).to_list(1000)
+    return {
+        "$and": [
+            query,
+            {"$or": [
+                {"date": {"$lt": date}},
+                {"date": date, "id": {"$lt": doc_id}}
+            ]}
+        ]
+    }
+
+async def aggregate_balance_by_project(collection, match: dict, amount_expr) -> dict:
+    """Sumar montos pagados por proyecto; retorna total, cantidad y desglose"""
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": "$project_id",
+            "project_name": {"$last": "$project_name"},
+            "total": {"$sum": amount_expr},
+            "count": {"$sum": 1}
+        }}
+    ]
+    groups = await collection.aggregate(pipeline).to_list(None)
     
-    expense_details = []
-    total_expense_real = 0
+    return {
+        "total": sum(g["total"] for g in groups),
+        "count": sum(g["count"] for g in groups),
+        "projects": {g["_id"]: g for g in groups if g["_id"]}
+    }
+
+async def aggregate_committed_fixed_expenses(company_id: str, workspace_id: str) -> dict:
+    """Total estimado y cantidad de gastos fijos activos"""
+    result = await db.finanzas_fixed_expenses.aggregate([
+        {"$match": {"company_id": company_id, "workspace_id": workspace_id, "status": "activo"}},
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": {"$ifNull": ["$estimated_amount", 0]}},
+            "count": {"$sum": 1}
+        }}
+    ]).to_list(1)
     
-    for expense in expenses:
-        amount_paid = expense.get("amount", 0)
-        total_expense_real += amount_paid
-        
-        expense_details.append({
-            "id": expense.get("id"),
-            "date": expense.get("date"),
-            "description": expense.get("description") or "Gasto",
-            "category": expense.get("category"),
-            "project_id": expense.get("project_id"),
-            "project_name": expense.get("project_name"),
-            "vendor_name": expense.get("vendor_name"),
-            "amount_paid": amount_paid,
-            "payment_type": "total",
-            "is_fixed_expense": expense.get("fixed_expense_id") is not None
-        })
+    return result[0] if result else {"total": 0, "count": 0}
+
+@api_router.get("/finanzas/balance-general")
+async def get_balance_general(
+    company_id: str,
+    start_date: Optional[str] = None,  # YYYY-MM-DD
+    end_date: Optional[str] = None,    # YYYY-MM-DD
+    project_id: Optional[str] = None,
+    filter_type: Optional[str] = None,  # 'today' | 'month' | 'last30days'
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Obtener Balance General basado en Caja Real.
+    Solo considera ingresos y gastos efectivamente PAGADOS.
+    Los KPIs y el balance por proyecto se calculan con agregaciones;
+    el detalle de movimientos se obtiene paginado en
+    /finanzas/balance-general/incomes y /finanzas/balance-general/expenses.
+    """
+    workspace_id = ctx.workspace_id
+    
+    start_date, end_date = resolve_balance_period(start_date, end_date, filter_type)
+    base_filter = build_balance_filter(company_id, workspace_id, start_date, end_date, project_id)
+    
+    # Consultas independientes en paralelo:
+    # ingresos reales (cobrados/parciales), gastos reales (pagados),
+    # cuentas por cobrar/pagar (libro mensual) y gastos fijos comprometidos
+    income_totals, expense_totals, open_balances, fixed_totals = await asyncio.gather(
+        aggregate_balance_by_project(
+            db.finanzas_incomes,
+            {**base_filter, "status": {"$in": ["collected", "partial"]}},
+            BALANCE_INCOME_PAID_EXPR
+        ),
+        aggregate_balance_by_project(
+            db.finanzas_expenses,
+            {**base_filter, "status": "paid"},
+            {"$ifNull": ["$amount", 0]}
+        ),
+        get_open_balances(db, company_id, workspace_id),
+        aggregate_committed_fixed_expenses(company_id, workspace_id)
+    )
     
     # ==========================================
     # RESULTADO OPERATIVO
     # ==========================================
+    total_income_real = income_totals["total"]
+    total_expense_real = expense_totals["total"]
     resultado_neto = total_income_real - total_expense_real
     
-    # ==========================================
-    # CONTEXTO FINANCIERO (informativo, NO afecta resultado)
-    # ==========================================
-    
-    # Cuentas por cobrar (pendientes)
-    receivables_filter = {
-        "company_id": company_id,
-        "workspace_id": workspace_id,
-        "status": {"$in": ["pending", "partial"]}
-    }
-    receivables = await db.finanzas_incomes.find(
-        receivables_filter, {"_id": 0}
-    ).to_list(500)
-    
-    total_por_cobrar = sum(
-        (inc.get("amount", 0) - (inc.get("paid_amount", 0) or 0)) 
-        for inc in receivables
-    )
-    
-    # Cuentas por pagar (pendientes)
-    payables_filter = {
-        "company_id": company_id,
-        "workspace_id": workspace_id,
-        "status": "pending"
-    }
-    payables = await db.finanzas_expenses.find(
-        payables_filter, {"_id": 0}
-    ).to_list(500)
-    
-    total_por_pagar = sum(exp.get("amount", 0) for exp in payables)
-    
-    # Gastos fijos comprometidos (no pagados aún)
-    fixed_expenses = await db.finanzas_fixed_expenses.find(
-        {"company_id": company_id, "workspace_id": workspace_id, "status": "activo"},
-        {"_id": 0}
-    ).to_list(100)
-    
-    total_gastos_fijos_comprometidos = sum(fe.get("estimated_amount", 0) for fe in fixed_expenses)
-    
     # ==========================================
     # BALANCE POR PROYECTO
     # ==========================================
     projects_balance = {}
     
-    for income in income_details:
-        proj_id = income.get("project_id")
-        if proj_id:
-            if proj_id not in projects_balance:
-                projects_balance[proj_id] = {
-                    "project_id": proj_id,
-                    "project_name": income.get("project_name") or "Sin nombre",
-                    "total_income": 0,
-                    "total_expense": 0,
-                    "result": 0
-                }
-            projects_balance[proj_id]["total_income"] += income.get("amount_paid", 0)
-    
-    for expense in expense_details:
-        proj_id = expense.get("project_id")
-        if proj_id:
+    for field, totals in (("total_income", income_totals), ("total_expense", expense_totals)):
+        for proj_id, group in totals["projects"].items():
             if proj_id not in projects_balance:
                 projects_balance[proj_id] = {
                     "project_id": proj_id,
-                    "project_name": expense.get("project_name") or "Sin nombre",
+                    "project_name": group.get("project_name") or "Sin nombre",
                     "total_income": 0,
                     "total_expense": 0,
                     "result": 0
                 }
-            projects_balance[proj_id]["total_expense"] += expense.get("amount_paid", 0)
+            projects_balance[proj_id][field] += group["total"]
     
-    # Calcular resultado por proyecto
-    for proj_id in projects_balance:
-        proj = projects_balance[proj_id]
+    for proj in projects_balance.values():
         proj["result"] = proj["total_income"] - proj["total_expense"]
     
     # Ordenar por resultado descendente
@@ -9755,35 +10432,195 @@ async def get_balance_general(
         "resultado_neto": resultado_neto,
         "is_profit": resultado_neto >= 0,
         
-        # Detalles de movimientos
-        "incomes": income_details,
-        "expenses": expense_details,
-        "income_count": len(income_details),
-        "expense_count": len(expense_details),
+        # Cantidad de movimientos (el detalle se pagina aparte)
+        "income_count": income_totals["count"],
+        "expense_count": expense_totals["count"],
         
-        # Contexto financiero (informativo)
+        # Contexto financiero (informativo, NO afecta resultado)
         "context": {
-            "total_por_cobrar": total_por_cobrar,
-            "total_por_pagar": total_por_pagar,
-            "total_gastos_fijos_comprometidos": total_gastos_fijos_comprometidos,
-            "receivables_count": len(receivables),
-            "payables_count": len(payables),
-            "fixed_expenses_count": len(fixed_expenses)
+            "total_por_cobrar": open_balances["receivables"]["total_pendiente"],
+            "total_por_pagar": open_balances["payables"]["total"],
+            "total_gastos_fijos_comprometidos": fixed_totals["total"],
+            "receivables_count": open_balances["receivables"]["count"],
+            "payables_count": open_balances["payables"]["count"],
+            "fixed_expenses_count": fixed_totals["count"]
         },
         
         # Balance por proyecto
         "projects_balance": projects_list
     }
 
+@api_router.get("/finanzas/balance-general/incomes")
+async def get_balance_general_incomes(
+    company_id: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    project_id: Optional[str] = None,
+    filter_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=BALANCE_PAGE_MAX),
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """Detalle paginado de ingresos reales (cobrados o con abonos) del Balance General"""
+    start_date, end_date = resolve_balance_period(start_date, end_date, filter_type)
+    query = build_balance_filter(company_id, ctx.workspace_id, start_date, end_date, project_id)
+    query["status"] = {"$in": ["collected", "partial"]}
+    
+    incomes = await db.finanzas_incomes.find(
+        apply_balance_cursor(query, cursor),
+        {"_id": 0, "id": 1, "date": 1, "description": 1, "source": 1, "status": 1,
+         "project_id": 1, "project_name": 1, "client_name": 1, "amount": 1, "paid_amount": 1}
+    ).sort([("date", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    
+    has_more = len(incomes) > limit
+    incomes = incomes[:limit]
+    
+    items = []
+    for income in incomes:
+        if income.get("status") == "collected":
+            amount_paid = income.get("amount", 0)
+            payment_type = "total"
+        else:  # partial
+            amount_paid = income.get("paid_amount", 0) or 0
+            payment_type = "parcial"
+        
+        items.append({
+            "id": income.get("id"),
+            "date": income.get("date"),
+            "description": income.get("description") or income.get("source", "Ingreso"),
+            "project_id": income.get("project_id"),
+            "project_name": income.get("project_name"),
+            "client_name": income.get("client_name"),
+            "amount_paid": amount_paid,
+            "total_amount": income.get("amount", 0),
+            "payment_type": payment_type,
+            "source": income.get("source")
+        })
+    
+    return {
+        "items": items,
+        "has_more": has_more,
+        "next_cursor": encode_balance_cursor(incomes[-1]) if has_more else None
+    }
+
+@api_router.get("/finanzas/balance-general/expenses")
+async def get_balance_general_expenses(
+    company_id: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    project_id: Optional[str] = None,
+    filter_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=BALANCE_PAGE_MAX),
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """Detalle paginado de gastos reales (pagados) del Balance General"""
+    start_date, end_date = resolve_balance_period(start_date, end_date, filter_type)
+    query = build_balance_filter(company_id, ctx.workspace_id, start_date, end_date, project_id)
+    query["status"] = "paid"
+    
+    expenses = await db.finanzas_expenses.find(
+        apply_balance_cursor(query, cursor),
+        {"_id": 0, "id": 1, "date": 1, "description": 1, "category": 1, "project_id": 1,
+         "project_name": 1, "vendor_name": 1, "amount": 1, "fixed_expense_id": 1}
+    ).sort([("date", -1), ("id", -1)]).limit(limit + 1).to_list(limit + 1)
+    
+    has_more = len(expenses) > limit
+    expenses = expenses[:limit]
+    
+    items = [
+        {
+            "id": expense.get("id"),
+            "date": expense.get("date"),
+            "description": expense.get("description") or "Gasto",
+            "category": expense.get("category"),
+            "project_id": expense.get("project_id"),
+            "project_name": expense.get("project_name"),
+            "vendor_name": expense.get("vendor_name"),
+            "amount_paid": expense.get("amount", 0),
+            "payment_type": "total",
+            "is_fixed_expense": expense.get("fixed_expense_id") is not None
+        }
+        for expense in expenses
+    ]
+    
+    return {
+        "items": items,
+        "has_more": has_more,
+        "next_cursor": encode_balance_cursor(expenses[-1]) if has_more else None
+    }
+
+# ==========================================
+# EXPORTACIÓN (CSV / XLSX)
+# ==========================================
+
+EXPORT_COLLECTIONS = {
+    "incomes": "finanzas_incomes",
+    "expenses": "finanzas_expenses",
+    "investments": "finanzas_investments"
+}
+
+@api_router.get("/finanzas/export/{kind}")
+async def export_finance_movements(
+    kind: str,
+    company_id: str,
+    format: str = "csv",               # 'csv' | 'xlsx'
+    status: Optional[str] = None,
+    project_id: Optional[str] = None,
+    start_date: Optional[str] = None,  # YYYY-MM-DD
+    end_date: Optional[str] = None,    # YYYY-MM-DD
+    filter_type: Optional[str] = None,  # solo balance: 'today' | 'month' | 'last30days'
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Exportar ingresos, gastos, inversiones o el Balance General en CSV o XLSX.
+    Las filas se leen del cursor y se envían a medida que se escriben,
+    con IGV y totales calculados al vuelo.
+    """
+    if kind not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=400, detail="Tipo de exportación no válido")
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format debe ser 'csv' o 'xlsx'")
+    
+    workspace_id = ctx.workspace_id
+    
+    if kind == "balance":
+        start_date, end_date = resolve_balance_period(start_date, end_date, filter_type)
+        base_filter = build_balance_filter(company_id, workspace_id, start_date, end_date, project_id)
+        docs = iter_balance_movements(
+            db,
+            {**base_filter, "status": {"$in": ["collected", "partial"]}},
+            {**base_filter, "status": "paid"}
+        )
+    else:
+        # Mismos filtros que los listados (fecha final inclusiva)
+        query = {"company_id": company_id, "workspace_id": workspace_id}
+        if status:
+            query["status"] = status
+        if project_id:
+            query["project_id"] = project_id
+        if start_date or end_date:
+            query["date"] = {}
+            if start_date:
+                query["date"]["$gte"] = start_date
+            if end_date:
+                query["date"]["$lte"] = end_date
+        docs = iter_cursor(db[EXPORT_COLLECTIONS[kind]], query, [("date", 1), ("id", 1)])
+    
+    filename = export_filename(kind, format, ctx.company.get("name"))
+    return StreamingResponse(
+        stream_export(kind, format, docs),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": export_content_disposition(filename)}
+    )
+
 @api_router.get("/finanzas/receivables")
 async def get_receivables(
     company_id: str,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Obtener ingresos por cobrar ordenados por fecha de vencimiento"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     # Obtener ingresos con estado pending o partial
     receivables = await db.finanzas_incomes.find(
@@ -9795,110 +10632,143 @@ async def get_receivables(
         {"_id": 0}
     ).sort("due_date", 1).to_list(500)
     
-    # Calcular totales correctamente basado en saldo pendiente
-    total_facturado = sum(r.get("amount", 0) for r in receivables)
-    total_abonado = sum(r.get("paid_amount", 0) for r in receivables)
-    total_pendiente = sum(r.get("amount", 0) - r.get("paid_amount", 0) for r in receivables)
+    # Totales exactos (no limitados al listado) desde el libro mensual
+    totals = (await get_open_balances(db, company_id, workspace_id))["receivables"]
     
     return {
         "receivables": receivables,
-        "total": total_pendiente,  # Solo saldo pendiente
-        "total_facturado": total_facturado,
-        "total_abonado": total_abonado,
-        "count": len(receivables)
+        "total": totals["total_pendiente"],  # Solo saldo pendiente
+        "total_facturado": totals["total_facturado"],
+        "total_abonado": totals["total_abonado"],
+        "count": totals["count"]
     }
 
 # ==========================================
 # PAGOS PARCIALES - CUENTAS POR COBRAR
 # ==========================================
 
+# Tolerancia de redondeo al comparar pagos contra el monto del ingreso (medio céntimo)
+PAYMENT_TOLERANCE = 0.005
+
+def build_income_payment_update(delta: float, now: str) -> list:
+    """
+    Update con pipeline que aplica un pago (delta > 0) o su reversión (delta < 0)
+    y deriva saldo pendiente y estado en la misma operación atómica.
+    """
+    return [
+        {"$set": {
+            "paid_amount": {"$max": [0, {"$round": [{"$add": [{"$ifNull": ["$paid_amount", 0]}, delta]}, 2]}]},
+            "updated_at": now
+        }},
+        {"$set": {
+            "pending_balance": {"$max": [0, {"$round": [{"$subtract": ["$amount", "$paid_amount"]}, 2]}]}
+        }},
+        {"$set": {
+            "status": {"$switch": {
+                "branches": [
+                    {"case": {"$lte": ["$pending_balance", 0]}, "then": "collected"},
+                    {"case": {"$gt": ["$paid_amount", 0]}, "then": "partial"}
+                ],
+                "default": "pending"
+            }}
+        }}
+    ]
+
+def apply_income_payment_state(income: dict, delta: float) -> dict:
+    """Estado resultante de un ingreso tras aplicar el pago (mismo cálculo que el pipeline)"""
+    paid_amount = max(0, round((income.get("paid_amount", 0) or 0) + delta, 2))
+    pending_balance = max(0, round(income.get("amount", 0) - paid_amount, 2))
+    
+    if pending_balance <= 0:
+        status = "collected"
+    elif paid_amount > 0:
+        status = "partial"
+    else:
+        status = "pending"
+    
+    return {**income, "paid_amount": paid_amount, "pending_balance": pending_balance, "status": status}
+
 @api_router.post("/finanzas/partial-payments")
 async def create_partial_payment(
     payment: PartialPaymentCreate,
     current_user: dict = Depends(get_current_user)
 ):
-    """Registrar un pago parcial para un ingreso pendiente"""
+    """
+    Registrar un pago parcial para un ingreso pendiente.
+    El pago se aplica con un único update condicional: solo si el ingreso no está cobrado
+    y el nuevo total no excede el monto, por lo que pagos concurrentes no se pisan.
+    """
     username = current_user["username"]
     workspace_id = await get_user_workspace_id(username)
     
-    # Obtener el ingreso
-    income = await db.finanzas_incomes.find_one(
-        {"id": payment.income_id, "workspace_id": workspace_id}
-    )
-    
-    if not income:
-        raise HTTPException(status_code=404, detail="Ingreso no encontrado")
-    
-    # Verificar acceso a la empresa
-    await verify_company_access(income["company_id"], username)
-    
-    # Verificar que el ingreso no está completamente cobrado
-    if income.get("status") == "collected":
-        raise HTTPException(status_code=400, detail="Este ingreso ya está completamente cobrado")
+    income_filter = {"id": payment.income_id, "workspace_id": workspace_id}
     
-    # Calcular saldo pendiente actual
-    current_paid = income.get("paid_amount", 0) or 0
-    total_amount = income.get("amount", 0)
-    current_pending = total_amount - current_paid
-    
-    # Verificar que el pago no exceda el saldo pendiente
-    if payment.amount > current_pending:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"El monto del pago (S/ {payment.amount:.2f}) excede el saldo pendiente (S/ {current_pending:.2f})"
-        )
+    # Verificar acceso a la empresa (memorizado; si el cliente no envía company_id se lee del ingreso)
+    company_id = payment.company_id
+    if not company_id:
+        income_ref = await db.finanzas_incomes.find_one(income_filter, {"_id": 0, "company_id": 1})
+        if not income_ref:
+            raise HTTPException(status_code=404, detail="Ingreso no encontrado")
+        company_id = income_ref["company_id"]
+    await resolve_finance_context(username, company_id)
+    income_filter["company_id"] = company_id
     
-    # Crear el registro del pago parcial
-    payment_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
     
-    payment_record = {
-        "id": payment_id,
-        "income_id": payment.income_id,
-        "company_id": income["company_id"],
-        "workspace_id": workspace_id,
-        "username": username,
-        "amount": payment.amount,
-        "date": payment.date,
-        "payment_method": payment.payment_method,
-        "note": payment.note,
-        "created_at": now
-    }
-    
-    await db.finanzas_partial_payments.insert_one(payment_record)
+    async with ledger_write(db):
+        income = await db.finanzas_incomes.find_one_and_update(
+            {
+                **income_filter,
+                "status": {"$ne": "collected"},
+                "$expr": {"$lte": [
+                    {"$add": [{"$ifNull": ["$paid_amount", 0]}, payment.amount]},
+                    {"$add": ["$amount", PAYMENT_TOLERANCE]}
+                ]}
+            },
+            build_income_payment_update(payment.amount, now),
+            projection={"_id": 0}
+        )
     
-    # Actualizar el ingreso
-    new_paid_amount = current_paid + payment.amount
-    new_pending_balance = total_amount - new_paid_amount
+        if not income:
+            # Ruta de error: leer el ingreso solo para explicar el rechazo
+            current = await db.finanzas_incomes.find_one(income_filter, {"_id": 0})
+            if not current:
+                raise HTTPException(status_code=404, detail="Ingreso no encontrado")
+            if current.get("status") == "collected":
+                raise HTTPException(status_code=400, detail="Este ingreso ya está completamente cobrado")
+            current_pending = current.get("amount", 0) - (current.get("paid_amount", 0) or 0)
+            raise HTTPException(
+                status_code=400, 
+                detail=f"El monto del pago (S/ {payment.amount:.2f}) excede el saldo pendiente (S/ {current_pending:.2f})"
+            )
     
-    # Determinar nuevo estado
-    if new_pending_balance <= 0:
-        new_status = "collected"
-    elif new_paid_amount > 0:
-        new_status = "partial"
-    else:
-        new_status = "pending"
+        updated = apply_income_payment_state(income, payment.amount)
     
-    await db.finanzas_incomes.update_one(
-        {"id": payment.income_id},
-        {
-            "$set": {
-                "paid_amount": new_paid_amount,
-                "pending_balance": new_pending_balance,
-                "status": new_status,
-                "updated_at": now
-            }
+        # Registrar el pago parcial
+        payment_record = {
+            "id": str(uuid.uuid4()),
+            "income_id": payment.income_id,
+            "company_id": income["company_id"],
+            "workspace_id": workspace_id,
+            "username": username,
+            "amount": payment.amount,
+            "date": payment.date,
+            "payment_method": payment.payment_method,
+            "note": payment.note,
+            "created_at": now
         }
-    )
+    
+        await db.finanzas_partial_payments.insert_one(payment_record)
+        await record_finance_movement("income", income, updated)
     
     # Devolver el pago creado junto con el estado actualizado del ingreso
     return {
         "payment": {**payment_record, "_id": None},
         "income_updated": {
             "id": payment.income_id,
-            "paid_amount": new_paid_amount,
-            "pending_balance": new_pending_balance,
-            "status": new_status
+            "paid_amount": updated["paid_amount"],
+            "pending_balance": updated["pending_balance"],
+            "status": updated["status"]
         }
     }
 
@@ -9936,64 +10806,53 @@ async def delete_partial_payment(
     payment_id: str,
     current_user: dict = Depends(get_current_user)
 ):
-    """Eliminar un pago parcial (requiere confirmación del frontend)"""
+    """
+    Eliminar un pago parcial (requiere confirmación del frontend).
+    Primero se verifican el pago, su ingreso y el acceso a la empresa; después se
+    elimina el pago y el monto se descuenta del ingreso con un update atómico.
+    """
     username = current_user["username"]
     workspace_id = await get_user_workspace_id(username)
     
-    # Obtener el pago
-    payment = await db.finanzas_partial_payments.find_one(
-        {"id": payment_id, "workspace_id": workspace_id}
-    )
-    
+    payment_filter = {"id": payment_id, "workspace_id": workspace_id}
+    payment = await db.finanzas_partial_payments.find_one(payment_filter, {"_id": 0})
     if not payment:
         raise HTTPException(status_code=404, detail="Pago no encontrado")
     
-    # Obtener el ingreso asociado
-    income = await db.finanzas_incomes.find_one({"id": payment["income_id"]})
-    
-    if not income:
+    income_filter = {"id": payment["income_id"], "workspace_id": workspace_id}
+    income_ref = await db.finanzas_incomes.find_one(income_filter, {"_id": 0, "company_id": 1})
+    if not income_ref:
         raise HTTPException(status_code=404, detail="Ingreso asociado no encontrado")
+    await resolve_finance_context(username, income_ref["company_id"])
     
-    # Eliminar el pago
-    await db.finanzas_partial_payments.delete_one({"id": payment_id})
-    
-    # Recalcular el monto pagado del ingreso
-    remaining_payments = await db.finanzas_partial_payments.find(
-        {"income_id": payment["income_id"]}
-    ).to_list(100)
+    # Eliminar el pago (solo una petición concurrente lo obtiene)
+    payment = await db.finanzas_partial_payments.find_one_and_delete(payment_filter, projection={"_id": 0})
+    if not payment:
+        raise HTTPException(status_code=404, detail="Pago no encontrado")
     
-    new_paid_amount = sum(p.get("amount", 0) for p in remaining_payments)
-    new_pending_balance = income.get("amount", 0) - new_paid_amount
+    now = datetime.now(timezone.utc).isoformat()
     
-    # Determinar nuevo estado
-    if new_pending_balance <= 0:
-        new_status = "collected"
-    elif new_paid_amount > 0:
-        new_status = "partial"
-    else:
-        new_status = "pending"
+    # Revertir el pago sobre el ingreso asociado
+    async with ledger_write(db):
+        income = await db.finanzas_incomes.find_one_and_update(
+            income_filter,
+            build_income_payment_update(-payment["amount"], now),
+            projection={"_id": 0}
+        )
     
-    now = datetime.now(timezone.utc).isoformat()
+        if not income:
+            raise HTTPException(status_code=404, detail="Ingreso asociado no encontrado")
     
-    await db.finanzas_incomes.update_one(
-        {"id": payment["income_id"]},
-        {
-            "$set": {
-                "paid_amount": new_paid_amount,
-                "pending_balance": new_pending_balance,
-                "status": new_status,
-                "updated_at": now
-            }
-        }
-    )
+        updated = apply_income_payment_state(income, -payment["amount"])
+        await record_finance_movement("income", income, updated)
     
     return {
         "message": "Pago eliminado correctamente",
         "income_updated": {
             "id": payment["income_id"],
-            "paid_amount": new_paid_amount,
-            "pending_balance": new_pending_balance,
-            "status": new_status
+            "paid_amount": updated["paid_amount"],
+            "pending_balance": updated["pending_balance"],
+            "status": updated["status"]
         }
     }
 
@@ -10006,12 +10865,10 @@ async def get_products(
     company_id: str,
     status: Optional[str] = None,
     type: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Obtener lista de productos/servicios de una empresa"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     # Construir filtro
     filter_query = {"company_id": company_id, "workspace_id": workspace_id}
@@ -10022,21 +10879,71 @@ async def get_products(
     
     products = await db.finanzas_products.find(
         filter_query,
-        {"_id": 0}
+        PRODUCT_PROJECTION
     ).sort("name", 1).to_list(500)
     
     return products
 
+PRODUCT_SEARCH_MAX = 100
+
+@api_router.get("/finanzas/products/search")
+async def search_products(
+    company_id: str,
+    q: Optional[str] = None,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=PRODUCT_SEARCH_MAX),
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Buscar en el catálogo por prefijo de nombre o código (sin tildes ni mayúsculas),
+    ordenado por nombre y paginado con cursor. Retorna solo los campos de los selectores.
+    """
+    query = {"company_id": company_id, "workspace_id": ctx.workspace_id}
+    
+    tokens = query_tokens(q)
+    if tokens:
+        query["search_tokens"] = {"$all": tokens}
+    if type:
+        query["type"] = type
+    if status:
+        query["status"] = status
+    
+    if cursor:
+        try:
+            search_name, product_id = decode_search_cursor(cursor, 2)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query["$or"] = [
+            {"search_name": {"$gt": search_name}},
+            {"search_name": search_name, "id": {"$gt": product_id}}
+        ]
+    
+    products = await db.finanzas_products.find(
+        query,
+        {"_id": 0, "id": 1, "name": 1, "code": 1, "type": 1, "base_price": 1,
+         "includes_igv": 1, "category": 1, "status": 1, "search_name": 1}
+    ).sort([("search_name", 1), ("id", 1)]).limit(limit + 1).to_list(limit + 1)
+    
+    has_more = len(products) > limit
+    products = products[:limit]
+    next_cursor = encode_search_cursor([products[-1]["search_name"], products[-1]["id"]]) if has_more else None
+    
+    for product in products:
+        product.pop("search_name", None)
+    
+    return {"items": products, "has_more": has_more, "next_cursor": next_cursor}
+
 @api_router.post("/finanzas/products")
 async def create_product(
     product: ProductCreate,
     company_id: str,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Crear un nuevo producto/servicio"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    username = ctx.username
+    workspace_id = ctx.workspace_id
     
     now = datetime.now(timezone.utc).isoformat()
     product_id = str(uuid.uuid4())
@@ -10047,6 +10954,7 @@ async def create_product(
         "workspace_id": workspace_id,
         "username": username,
         "name": product.name,
+        "code": product.code,
         "type": product.type.value,
         "base_price": product.base_price,
         "includes_igv": product.includes_igv,
@@ -10057,7 +10965,7 @@ async def create_product(
         "updated_at": now
     }
     
-    await db.finanzas_products.insert_one(product_doc)
+    await db.finanzas_products.insert_one({**product_doc, **build_product_search_fields(product_doc)})
     
     return {**product_doc, "_id": None}
 
@@ -10072,7 +10980,7 @@ async def get_product(
     
     product = await db.finanzas_products.find_one(
         {"id": product_id, "workspace_id": workspace_id},
-        {"_id": 0}
+        PRODUCT_PROJECTION
     )
     
     if not product:
@@ -10098,13 +11006,15 @@ async def update_product(
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
     # Verificar acceso a la empresa
-    await verify_company_access(existing["company_id"], username)
+    await resolve_finance_context(username, existing["company_id"])
     
     # Construir actualización
     update_data = {"updated_at": datetime.now(timezone.utc).isoformat()}
     
     if product.name is not None:
         update_data["name"] = product.name
+    if product.code is not None:
+        update_data["code"] = product.code
     if product.type is not None:
         update_data["type"] = product.type.value
     if product.base_price is not None:
@@ -10118,6 +11028,10 @@ async def update_product(
     if product.status is not None:
         update_data["status"] = product.status.value
     
+    # Mantener los campos de búsqueda al cambiar nombre o código
+    if "name" in update_data or "code" in update_data:
+        update_data.update(build_product_search_fields({**existing, **update_data}))
+    
     await db.finanzas_products.update_one(
         {"id": product_id},
         {"$set": update_data}
@@ -10125,7 +11039,7 @@ async def update_product(
     
     updated = await db.finanzas_products.find_one(
         {"id": product_id},
-        {"_id": 0}
+        PRODUCT_PROJECTION
     )
     
     return updated
@@ -10146,7 +11060,7 @@ async def delete_product(
     if not existing:
         raise HTTPException(status_code=404, detail="Producto no encontrado")
     
-    await verify_company_access(existing["company_id"], username)
+    await resolve_finance_context(username, existing["company_id"])
     
     await db.finanzas_products.delete_one({"id": product_id})
     
@@ -10160,12 +11074,10 @@ async def delete_product(
 async def get_fixed_expenses(
     company_id: str,
     status: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Obtener lista de gastos fijos (catálogo)"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     query = {
         "company_id": company_id,
@@ -10188,8 +11100,8 @@ async def create_fixed_expense(
 ):
     """Crear nuevo gasto fijo en el catálogo"""
     username = current_user["username"]
-    await verify_company_access(fixed_expense.company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    ctx = await resolve_finance_context(username, fixed_expense.company_id)
+    workspace_id = ctx.workspace_id
     
     now = get_current_timestamp()
     
@@ -10219,6 +11131,7 @@ async def create_fixed_expense(
     }
     
     await db.finanzas_fixed_expenses.insert_one(fixed_expense_data)
+    invalidate_forecast(fixed_expense.company_id)
     
     # Si tiene recordatorios habilitados y fecha de vencimiento, crear recordatorio inicial
     if fixed_expense.reminder_enabled and fixed_expense.next_due_date:
@@ -10241,7 +11154,7 @@ async def get_fixed_expense(
     if not fixed_expense:
         raise HTTPException(status_code=404, detail="Gasto fijo no encontrado")
     
-    await verify_company_access(fixed_expense["company_id"], username)
+    await resolve_finance_context(username, fixed_expense["company_id"])
     
     return FixedExpenseResponse(**fixed_expense)
 
@@ -10261,7 +11174,7 @@ async def update_fixed_expense(
     if not existing:
         raise HTTPException(status_code=404, detail="Gasto fijo no encontrado")
     
-    await verify_company_access(existing["company_id"], username)
+    await resolve_finance_context(username, existing["company_id"])
     
     update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
     
@@ -10278,6 +11191,7 @@ async def update_fixed_expense(
             {"id": fixed_expense_id},
             {"$set": update_dict}
         )
+        invalidate_forecast(existing["company_id"])
     
     updated = await db.finanzas_fixed_expenses.find_one(
         {"id": fixed_expense_id}, {"_id": 0}
@@ -10304,10 +11218,11 @@ async def delete_fixed_expense(
     if not existing:
         raise HTTPException(status_code=404, detail="Gasto fijo no encontrado")
     
-    await verify_company_access(existing["company_id"], username)
+    await resolve_finance_context(username, existing["company_id"])
     
     # Eliminar el gasto fijo
     await db.finanzas_fixed_expenses.delete_one({"id": fixed_expense_id})
+    invalidate_forecast(existing["company_id"])
     
     # Eliminar recordatorios asociados
     await db.finanzas_fixed_expense_reminders.delete_many({"fixed_expense_id": fixed_expense_id})
@@ -10333,7 +11248,7 @@ async def get_fixed_expense_payments(
     if not fixed_expense:
         raise HTTPException(status_code=404, detail="Gasto fijo no encontrado")
     
-    await verify_company_access(fixed_expense["company_id"], username)
+    await resolve_finance_context(username, fixed_expense["company_id"])
     
     payments = await db.finanzas_fixed_expense_payments.find(
         {"fixed_expense_id": fixed_expense_id}, {"_id": 0}
@@ -10361,8 +11276,8 @@ async def create_fixed_expense_payment(
     if not fixed_expense:
         raise HTTPException(status_code=404, detail="Gasto fijo no encontrado")
     
-    await verify_company_access(fixed_expense["company_id"], username)
-    workspace_id = await get_user_workspace_id(username)
+    ctx = await resolve_finance_context(username, fixed_expense["company_id"])
+    workspace_id = ctx.workspace_id
     
     now = get_current_timestamp()
     
@@ -10402,15 +11317,18 @@ async def create_fixed_expense_payment(
         "project_id": fixed_expense.get("project_id"),
         "project_name": fixed_expense.get("project_name"),
         "includes_igv": fixed_expense.get("includes_igv", False),
-        "base_imponible": payment.amount / 1.18 if fixed_expense.get("includes_igv") else payment.amount,
-        "igv_gasto": (payment.amount - payment.amount / 1.18) if fixed_expense.get("includes_igv") else 0,
+        "base_imponible": payment.amount / (1 + IGV_RATE) if fixed_expense.get("includes_igv") else payment.amount,
+        "igv_gasto": (payment.amount - payment.amount / (1 + IGV_RATE)) if fixed_expense.get("includes_igv") else 0,
         "fixed_expense_id": payment.fixed_expense_id,  # Referencia al gasto fijo
         "fixed_expense_payment_id": payment_data["id"],  # Referencia al pago
         "created_at": now,
         "updated_at": now,
     }
     
-    await db.finanzas_expenses.insert_one(expense_data)
+    async with ledger_write(db):
+        await db.finanzas_expenses.insert_one(expense_data)
+        expense_data.pop("_id", None)
+        await record_finance_movement("expense", None, expense_data)
     
     # Actualizar próxima fecha de vencimiento del gasto fijo
     await update_next_due_date(fixed_expense)
@@ -10432,13 +11350,18 @@ async def delete_fixed_expense_payment(
     if not payment:
         raise HTTPException(status_code=404, detail="Pago no encontrado")
     
-    await verify_company_access(payment["company_id"], username)
+    await resolve_finance_context(username, payment["company_id"])
     
     # Eliminar el pago
     await db.finanzas_fixed_expense_payments.delete_one({"id": payment_id})
     
     # Eliminar el gasto asociado
-    await db.finanzas_expenses.delete_one({"fixed_expense_payment_id": payment_id})
+    async with ledger_write(db):
+        deleted_expense = await db.finanzas_expenses.find_one_and_delete(
+            {"fixed_expense_payment_id": payment_id},
+            projection={"_id": 0}
+        )
+        await record_finance_movement("expense", deleted_expense, None)
     
     return {"message": "Pago eliminado correctamente"}
 
@@ -10447,94 +11370,148 @@ async def delete_fixed_expense_payment(
 # ==========================================
 
 async def update_next_due_date(fixed_expense: dict):
-    """Calcular y actualizar la próxima fecha de vencimiento"""
-    from datetime import datetime, timedelta
-    from dateutil.relativedelta import relativedelta
-    
-    periodicity = fixed_expense.get("periodicity", "mensual")
-    current_due = fixed_expense.get("next_due_date")
-    day_of_month = fixed_expense.get("day_of_month")
-    
-    if not current_due:
+    """
+    Avanzar el gasto fijo tras registrar un pago.
+    Si hay periodos vencidos pendientes, el pago salda el más antiguo;
+    si no, next_due_date avanza un periodo y se reconcilian los periodos perdidos.
+    """
+    if fixed_expense.get("overdue_periods"):
+        await db.finanzas_fixed_expenses.update_one(
+            {"id": fixed_expense["id"]},
+            {"$pop": {"overdue_periods": -1}, "$set": {"updated_at": get_current_timestamp()}}
+        )
+        invalidate_forecast(fixed_expense.get("company_id"))
         return
     
-    try:
-        current_date = datetime.fromisoformat(current_due.replace('Z', '+00:00'))
-    except:
+    next_due_date = next_fixed_expense_due(fixed_expense)
+    if not next_due_date:
         return
     
-    # Calcular próxima fecha según periodicidad
-    if periodicity == "semanal":
-        next_date = current_date + timedelta(days=7)
-    elif periodicity == "quincenal":
-        next_date = current_date + timedelta(days=15)
-    elif periodicity == "mensual":
-        next_date = current_date + relativedelta(months=1)
-        if day_of_month:
-            try:
-                next_date = next_date.replace(day=min(day_of_month, 28))
-            except:
-                pass
-    elif periodicity == "trimestral":
-        next_date = current_date + relativedelta(months=3)
-    elif periodicity == "anual":
-        next_date = current_date + relativedelta(years=1)
-    elif periodicity == "personalizada":
-        custom_days = fixed_expense.get("custom_days", 30)
-        next_date = current_date + timedelta(days=custom_days)
-    else:
-        next_date = current_date + relativedelta(months=1)
-    
-    # Actualizar en la base de datos
-    await db.finanzas_fixed_expenses.update_one(
-        {"id": fixed_expense["id"]},
-        {"$set": {"next_due_date": next_date.isoformat(), "updated_at": get_current_timestamp()}}
+    # Avanzar solo desde el vencimiento leído: la reconciliación exige el valor guardado
+    advanced = await db.finanzas_fixed_expenses.update_one(
+        {"id": fixed_expense["id"], "next_due_date": fixed_expense.get("next_due_date")},
+        {"$set": {"next_due_date": next_due_date, "updated_at": get_current_timestamp()}}
     )
+    if not advanced.modified_count:
+        return
     
-    # Crear nuevo recordatorio
-    updated = await db.finanzas_fixed_expenses.find_one(
-        {"id": fixed_expense["id"]}, {"_id": 0}
-    )
-    if updated and updated.get("reminder_enabled"):
-        await create_fixed_expense_reminder(updated, updated["username"])
+    await reconcile_fixed_expense_periods([{**fixed_expense, "next_due_date": next_due_date}])
 
-async def create_fixed_expense_reminder(fixed_expense: dict, username: str):
-    """Crear recordatorio para un gasto fijo (Email + WhatsApp obligatorios)"""
-    from datetime import datetime, timedelta
+async def reconcile_fixed_expense_periods(fixed_expenses: List[dict]) -> int:
+    """
+    Reconciliar de una vez los periodos de varios gastos fijos:
+    los vencimientos ya pasados se guardan en overdue_periods, next_due_date queda en el
+    próximo vencimiento futuro y se reemplazan los recordatorios pendientes por uno solo.
+    Cada actualización exige el next_due_date leído: si otro barrido o un pago lo movió
+    antes, no se aplica (los periodos perdidos se agregan una sola vez).
+    Escribe gastos y recordatorios con un bulk_write por colección.
+    Retorna la cantidad de gastos fijos que tenían periodos perdidos.
+    """
+    today = forecast_today()
+    now = get_current_timestamp()
     
-    if not fixed_expense.get("reminder_enabled") or not fixed_expense.get("next_due_date"):
-        return
+    expense_ops = []
+    planned = []  # (id, next_due_date nuevo, tenía periodos perdidos, recordatorio)
+    
+    for fixed_expense in fixed_expenses:
+        # Un documento antiguo con datos incompletos se registra y se omite sin detener el resto
+        try:
+            fixed_expense_id = fixed_expense["id"]
+            read_due_date = fixed_expense["next_due_date"]
+            update = {"$set": {"next_due_date": read_due_date, "updated_at": now}}
+            
+            catch_up = catch_up_fixed_expense(fixed_expense, today)
+            if catch_up:
+                fixed_expense = {**fixed_expense, "next_due_date": catch_up["next_due_date"]}
+                update["$set"]["next_due_date"] = catch_up["next_due_date"]
+                if catch_up["missed_periods"]:
+                    update["$push"] = {"overdue_periods": {"$each": catch_up["missed_periods"], "$sort": 1}}
+            
+            reminder = build_fixed_expense_reminder(fixed_expense, fixed_expense.get("username"))
+        except Exception as e:
+            logger.error(f"❌ Gasto fijo {fixed_expense.get('id')} omitido al reconciliar periodos: {str(e)}")
+            continue
+        
+        expense_ops.append(UpdateOne({"id": fixed_expense_id, "next_due_date": read_due_date}, update))
+        planned.append((fixed_expense_id, fixed_expense["next_due_date"], bool(catch_up), reminder))
+        invalidate_forecast(fixed_expense.get("company_id"))
+    
+    if not expense_ops:
+        return 0
+    
+    result = await db.finanzas_fixed_expenses.bulk_write(expense_ops, ordered=False)
+    if result.matched_count < len(expense_ops):
+        # Alguno cambió desde la lectura: sus recordatorios los deja quien lo actualizó
+        current = {
+            doc["id"]: doc.get("next_due_date")
+            async for doc in db.finanzas_fixed_expenses.find(
+                {"id": {"$in": [item[0] for item in planned]}},
+                {"_id": 0, "id": 1, "next_due_date": 1}
+            )
+        }
+        planned = [item for item in planned if current.get(item[0]) == item[1]]
+    
+    reminder_ops = []
+    for fixed_expense_id, _, _, reminder in planned:
+        # Un solo recordatorio pendiente por gasto fijo (el del próximo vencimiento)
+        reminder_ops.append(DeleteMany({"fixed_expense_id": fixed_expense_id, "status": "pending"}))
+        if reminder:
+            reminder_ops.append(InsertOne(reminder))
+    
+    if reminder_ops:
+        # Ordenado: cada borrado debe ejecutarse antes de su inserción
+        await db.finanzas_fixed_expense_reminders.bulk_write(reminder_ops, ordered=True)
+    
+    return sum(1 for item in planned if item[2])
+
+def build_fixed_expense_reminder(fixed_expense: dict, username: str) -> Optional[dict]:
+    """
+    Construir el recordatorio del próximo vencimiento (None si no corresponde).
+    Tolera documentos antiguos: los campos opcionales toman valores por defecto.
+    """
+    if not fixed_expense.get("reminder_enabled") or not isinstance(fixed_expense.get("next_due_date"), str):
+        return None
+    if not fixed_expense.get("id") or not username:
+        return None
     
     try:
         due_date = datetime.fromisoformat(fixed_expense["next_due_date"].replace('Z', '+00:00'))
-        days_before = fixed_expense.get("reminder_days_before", 3)
-        reminder_date = due_date - timedelta(days=days_before)
-        
-        # Si la fecha del recordatorio ya pasó, no crear
-        if reminder_date < datetime.now(timezone.utc):
+    except ValueError:
+        return None
+    if due_date.tzinfo is None:
+        due_date = due_date.replace(tzinfo=timezone.utc)
+    days_before = fixed_expense.get("reminder_days_before")
+    reminder_date = due_date - timedelta(days=days_before if isinstance(days_before, (int, float)) else 3)
+    
+    # Si la fecha del recordatorio ya pasó, no crear
+    if reminder_date < datetime.now(timezone.utc):
+        return None
+    
+    return {
+        "id": generate_id(),
+        "fixed_expense_id": fixed_expense["id"],
+        "fixed_expense_name": fixed_expense.get("name") or "Gasto fijo",
+        "company_id": fixed_expense.get("company_id"),
+        "workspace_id": fixed_expense.get("workspace_id"),
+        "username": username,
+        "type": "fixed_expense",
+        "reminder_date": reminder_date.isoformat(),
+        "due_date": fixed_expense["next_due_date"],
+        "amount": fixed_expense.get("estimated_amount") or 0,
+        "category": fixed_expense.get("category"),
+        "status": "pending",
+        "email_sent": False,
+        "whatsapp_sent": False,
+        "created_at": get_current_timestamp(),
+    }
+
+async def create_fixed_expense_reminder(fixed_expense: dict, username: str):
+    """Crear recordatorio para un gasto fijo (Email + WhatsApp obligatorios)"""
+    try:
+        reminder_data = build_fixed_expense_reminder(fixed_expense, username)
+        if not reminder_data:
             return
         
-        reminder_id = generate_id()
-        now = get_current_timestamp()
-        
-        reminder_data = {
-            "id": reminder_id,
-            "fixed_expense_id": fixed_expense["id"],
-            "fixed_expense_name": fixed_expense["name"],
-            "company_id": fixed_expense["company_id"],
-            "workspace_id": fixed_expense["workspace_id"],
-            "username": username,
-            "type": "fixed_expense",
-            "reminder_date": reminder_date.isoformat(),
-            "due_date": fixed_expense["next_due_date"],
-            "amount": fixed_expense["estimated_amount"],
-            "category": fixed_expense["category"],
-            "status": "pending",
-            "email_sent": False,
-            "whatsapp_sent": False,
-            "created_at": now,
-        }
-        
         # Eliminar recordatorios anteriores pendientes para este gasto fijo
         await db.finanzas_fixed_expense_reminders.delete_many({
             "fixed_expense_id": fixed_expense["id"],
@@ -10542,7 +11519,7 @@ async def create_fixed_expense_reminder(fixed_expense: dict, username: str):
         })
         
         await db.finanzas_fixed_expense_reminders.insert_one(reminder_data)
-        logger.info(f"📅 Recordatorio creado para gasto fijo '{fixed_expense['name']}' - Fecha: {reminder_date.isoformat()}")
+        logger.info(f"📅 Recordatorio creado para gasto fijo '{fixed_expense['name']}' - Fecha: {reminder_data['reminder_date']}")
         
     except Exception as e:
         logger.error(f"Error creando recordatorio de gasto fijo: {e}")
@@ -10562,12 +11539,10 @@ async def update_fixed_expense_reminder(fixed_expense: dict, username: str):
 @api_router.get("/finanzas/payables")
 async def get_payables(
     company_id: str,
-    current_user: dict = Depends(get_current_user)
+    ctx: FinanceContext = Depends(get_finance_context)
 ):
     """Obtener gastos por pagar ordenados por prioridad y fecha"""
-    username = current_user["username"]
-    await verify_company_access(company_id, username)
-    workspace_id = await get_user_workspace_id(username)
+    workspace_id = ctx.workspace_id
     
     # Ordenar por prioridad (high > medium > low) y luego por fecha
     payables = await db.finanzas_expenses.find(
@@ -10579,13 +11554,155 @@ async def get_payables(
     priority_order = {"high": 0, "medium": 1, "low": 2}
     payables.sort(key=lambda x: (priority_order.get(x.get("priority", "medium"), 1), x.get("due_date", "9999")))
     
-    total = sum(p["amount"] for p in payables)
+    # Totales exactos (no limitados al listado) desde el libro mensual
+    totals = (await get_open_balances(db, company_id, workspace_id))["payables"]
     
     return {
         "payables": payables,
-        "total": total,
-        "count": len(payables)
+        "total": totals["total"],
+        "count": totals["count"]
+    }
+
+@api_router.get("/finanzas/tax-report")
+async def get_igv_tax_report(
+    company_id: str,
+    start_period: Optional[str] = None,  # YYYY-MM (por defecto: 11 meses antes del fin)
+    end_period: Optional[str] = None,    # YYYY-MM (por defecto: mes en curso)
+    format: str = "json",                # 'json' | 'csv'
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Determinación mensual del IGV: ventas e IGV de ventas (sobre lo cobrado),
+    compras e IGV de compras (gastos con IGV) e IGV neto a pagar o a favor.
+    """
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="format debe ser 'json' o 'csv'")
+    
+    end_period = end_period or current_tax_period()
+    
+    try:
+        start_period = start_period or shift_tax_period(end_period, -11)
+        report = await get_tax_report(db, company_id, ctx.workspace_id, start_period, end_period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if format == "csv":
+        filename = export_filename(f"igv_{report['start_period']}_{report['end_period']}", "csv", ctx.company.get("name"))
+        return StreamingResponse(
+            stream_csv(iter_tax_rows(report)),
+            media_type=EXPORT_FORMATS["csv"],
+            headers={"Content-Disposition": export_content_disposition(filename)}
+        )
+    
+    return report
+
+@api_router.get("/finanzas/aging/{kind}")
+async def get_aging(
+    kind: str,
+    company_id: str,
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Antigüedad de cuentas por cobrar (receivables) o por pagar (payables):
+    saldos abiertos por tramo de atraso, por cliente/proveedor y por proyecto.
+    """
+    if kind not in AGING_KINDS:
+        raise HTTPException(status_code=400, detail="kind debe ser 'receivables' o 'payables'")
+    
+    return await get_aging_report(db, kind, company_id, ctx.workspace_id)
+
+@api_router.get("/finanzas/aging/{kind}/items")
+async def get_aging_detail(
+    kind: str,
+    company_id: str,
+    bucket: Optional[str] = None,      # 'current' | '1_30' | '31_60' | '61_90' | '90_plus'
+    party_id: Optional[str] = None,    # id (o nombre) del cliente/proveedor
+    project_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=AGING_PAGE_MAX),
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """Detalle paginado de saldos abiertos, del vencimiento más antiguo al más reciente"""
+    if kind not in AGING_KINDS:
+        raise HTTPException(status_code=400, detail="kind debe ser 'receivables' o 'payables'")
+    if bucket and bucket not in {key for key, _, _ in AGING_BUCKETS}:
+        raise HTTPException(status_code=400, detail="Tramo de antigüedad no válido")
+    
+    try:
+        return await get_aging_items(
+            db, kind, company_id, ctx.workspace_id,
+            bucket=bucket, party_id=party_id, project_id=project_id,
+            cursor=cursor, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# ==========================================
+# DASHBOARD DE FINANZAS (carga inicial en una sola llamada)
+# ==========================================
+
+async def timed_section(name: str, coroutine) -> tuple:
+    """Ejecutar una sección del dashboard midiendo su duración; un error no afecta al resto"""
+    started = time.perf_counter()
+    try:
+        data, error = await coroutine, None
+    except HTTPException as e:
+        data, error = None, e.detail
+    except Exception as e:
+        logger.error(f"❌ Error en sección '{name}' del dashboard: {str(e)}")
+        data, error = None, "Error al cargar la sección"
+    
+    return name, data, error, round((time.perf_counter() - started) * 1000, 1)
+
+@api_router.get("/finanzas/dashboard")
+async def get_finance_dashboard(
+    company_id: str,
+    period: Optional[str] = None,  # "2026-01" formato año-mes
+    ctx: FinanceContext = Depends(get_finance_context)
+):
+    """
+    Datos de la pantalla inicial de finanzas en una sola llamada: resumen, cuentas por
+    cobrar y por pagar, gastos fijos, productos activos, categorías, fuentes y rol.
+    El acceso se verifica una vez y las secciones se consultan en paralelo;
+    `timings` indica cuánto tardó cada una (ms).
+    """
+    started = time.perf_counter()
+    
+    # El libro mensual se construye una vez antes de las secciones que lo leen en paralelo
+    await ensure_company_ledger(db, company_id)
+    
+    results = await asyncio.gather(
+        timed_section("summary", get_financial_summary(company_id, period, ctx=ctx)),
+        timed_section("receivables", get_receivables(company_id, ctx=ctx)),
+        timed_section("payables", get_payables(company_id, ctx=ctx)),
+        timed_section("fixed_expenses", get_fixed_expenses(company_id, None, ctx=ctx)),
+        timed_section("products", get_products(company_id, "activo", None, ctx=ctx)),
+        timed_section("categories", list_finance_categories(ctx.workspace_id, "expense")),
+        timed_section("income_sources", list_finance_categories(ctx.workspace_id, "income")),
+    )
+    
+    bundle = {
+        "company_id": company_id,
+        "role": {
+            "company_id": company_id,
+            "company_name": ctx.company.get("name", ""),
+            "role": ctx.role,
+            "is_owner": ctx.role == "owner",
+            "permissions": get_role_permissions(ctx.role)
+        },
+        "errors": {},
+        "timings": {}
     }
+    
+    for name, data, error, elapsed_ms in results:
+        bundle[name] = data
+        bundle["timings"][name] = elapsed_ms
+        if error:
+            bundle["errors"][name] = error
+    
+    bundle["timings"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+    return bundle
 
 
 # ==========================================
@@ -10746,7 +11863,7 @@ async def get_companies_for_user(username: str, user_email: str = None) -> List[
     
     # Empresas propias
     owned = await db.finanzas_companies.find(
-        {"owner_username": username},
+        {"owner_username": username, "deleting": {"$ne": True}},
         {"_id": 0}
     ).to_list(100)
     
@@ -10762,7 +11879,7 @@ async def get_companies_for_user(username: str, user_email: str = None) -> List[
     
     for collab in collaborations:
         company = await db.finanzas_companies.find_one(
-            {"id": collab["company_id"]},
+            {"id": collab["company_id"], "deleting": {"$ne": True}},
             {"_id": 0}
         )
         if company:
@@ -10879,12 +11996,35 @@ async def get_company_collaborators(
     if not company:
         raise HTTPException(status_code=404, detail="Empresa no encontrada")
     
+    # Obtener colaboradores
+    collabs = await db.company_collaborators.find(
+        {"company_id": company_id},
+        {"_id": 0}
+    ).to_list(100)
+    
+    # Usuarios y perfiles del owner y colaboradores (una consulta cada uno)
+    usernames = [company["owner_username"]] + [c["username"] for c in collabs]
+    users = {
+        u["username"]: u
+        for u in await db.users.find(
+            {"username": {"$in": usernames}},
+            {"_id": 1, "username": 1, "email": 1}
+        ).to_list(len(usernames))
+    }
+    profiles = {
+        p["username"]: p
+        for p in await db.user_profiles.find(
+            {"username": {"$in": usernames}},
+            {"_id": 0, "username": 1, "full_name": 1}
+        ).to_list(len(usernames))
+    }
+    
     # Agregar propietario a la lista
-    owner = await db.users.find_one({"username": company["owner_username"]})
+    owner = users.get(company["owner_username"])
     collaborators = []
     
     if owner:
-        profile = await db.user_profiles.find_one({"username": company["owner_username"]})
+        profile = profiles.get(company["owner_username"])
         collaborators.append({
             "id": f"owner_{company['owner_username']}",
             "user_id": str(owner.get("_id", "")),
@@ -10897,15 +12037,9 @@ async def get_company_collaborators(
             "invited_by": None
         })
     
-    # Obtener colaboradores
-    collabs = await db.company_collaborators.find(
-        {"company_id": company_id},
-        {"_id": 0}
-    ).to_list(100)
-    
     for collab in collabs:
-        user = await db.users.find_one({"username": collab["username"]})
-        profile = await db.user_profiles.find_one({"username": collab["username"]})
+        user = users.get(collab["username"])
+        profile = profiles.get(collab["username"])
         
         if user:
             collaborators.append({
@@ -11142,6 +12276,7 @@ async def accept_invitation(
     }
     
     await db.company_collaborators.insert_one(collaborator)
+    invalidate_finance_context(collaborator["company_id"], username)
     
     # Actualizar estado de invitación
     await db.company_invitations.update_one(
@@ -11318,6 +12453,7 @@ async def update_collaborator_role_endpoint(
         {"company_id": company_id, "username": collaborator_username},
         {"$set": {"role": new_role, "updated_at": get_current_timestamp()}}
     )
+    invalidate_finance_context(company_id, collaborator_username)
     
     # Notificar al colaborador
     changer_profile = await db.user_profiles.find_one({"username": username})
@@ -11396,6 +12532,7 @@ async def remove_company_collaborator(
         "company_id": company_id,
         "username": collaborator_username
     })
+    invalidate_finance_context(company_id, collaborator_username)
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Colaborador no encontrado")
@@ -11551,7 +12688,42 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     """Iniciar scheduler al arrancar la aplicación"""
+    try:
+        await ensure_notification_digest_indexes(db)
+        await ensure_finanzas_indexes(db)
+        await ensure_ledger_indexes(db)
+        await ensure_aging_indexes(db)
+        await ensure_deletion_job_indexes(db)
+        await ensure_contact_indexes(db)
+        await ensure_dedupe_job_indexes(db)
+        await ensure_whatsapp_conversation_indexes(db)
+    except Exception as e:
+        logger.error(f"❌ Error creando índices: {str(e)}")
+    
+    try:
+        backfilled = await backfill_product_search_fields(db)
+        if backfilled:
+            logger.info(f"🔎 Campos de búsqueda completados en {backfilled} producto(s)")
+        backfilled = await backfill_contact_search_fields(db)
+        if backfilled:
+            logger.info(f"🔎 Campos de búsqueda completados en {backfilled} contacto(s)")
+    except Exception as e:
+        logger.error(f"❌ Error completando campos de búsqueda: {str(e)}")
+    
+    try:
+        if await backfill_whatsapp_conversations(db):
+            logger.info("💬 Resúmenes de conversaciones de WhatsApp generados")
+    except Exception as e:
+        logger.error(f"❌ Error generando resúmenes de WhatsApp: {str(e)}")
+    
     await start_scheduler()
+    
+    resumed = await resume_deletion_jobs(db)
+    if resumed:
+        logger.info(f"🗑️ {resumed} trabajo(s) de eliminación reanudado(s)")
+    resumed = await resume_dedupe_jobs(db)
+    if resumed:
+        logger.info(f"👥 {resumed} búsqueda(s) de duplicados reanudada(s)")
     logger.info("Aplicación iniciada con scheduler de recordatorios")
 
 @app.on_event("shutdown")
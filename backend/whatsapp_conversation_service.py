@@ -0,0 +1,157 @@
+"""
+WhatsApp Conversation Service - Resumen de conversaciones para la bandeja
+Cada conversación (workspace + teléfono) tiene un documento en whatsapp_conversations
+con el último mensaje, su fecha, el nombre del contacto y los no leídos. El bridge lo
+actualiza de forma atómica al guardar cada mensaje (ver WhatsAppManager.updateConversation)
+y aquí se actualiza al marcar como leída, así la bandeja es una lectura indexada.
+"""
+
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+CONVERSATIONS_PAGE_MAX = 500
+
+# Marcador (colección migrations) de la construcción inicial de los resúmenes
+CONVERSATIONS_MIGRATION_ID = "whatsapp_conversations_v1"
+
+UNREAD_FILTER = {"direction": "inbound", "status": {"$ne": "read"}}
+
+
+async def get_conversations(db, workspace_id: str, limit: int = 100) -> List[dict]:
+    """Conversaciones del workspace, de la más reciente a la más antigua"""
+    conversations = await db.whatsapp_conversations.find(
+        {"workspace_id": workspace_id},
+        {"_id": 0}
+    ).sort([("last_timestamp", -1)]).limit(limit).to_list(limit)
+
+    return [
+        {
+            "phone": conversation["phone"],
+            "name": conversation.get("push_name") or conversation["phone"],
+            "last_message": conversation.get("last_message"),
+            "last_timestamp": conversation.get("last_timestamp"),
+            "direction": conversation.get("last_direction"),
+            # Puede quedar negativo un instante si se lee antes de que el bridge sume el mensaje
+            "unread_count": max(0, conversation.get("unread_count", 0))
+        }
+        for conversation in conversations
+    ]
+
+
+async def mark_conversation_read(db, workspace_id: str, phone: str) -> int:
+    """
+    Marcar como leídos los mensajes entrantes de una conversación.
+    Los no leídos se descuentan con $inc por los mensajes efectivamente marcados:
+    cada mensaje entrante suma 1 en el bridge y resta 1 aquí una sola vez, así un
+    mensaje que llegue entre ambas operaciones no se pierde ni se descuenta dos veces.
+    """
+    now = datetime.now(timezone.utc)
+    messages = {"workspace_id": workspace_id, "channel": "whatsapp", "contact_phone": phone}
+
+    result = await db.whatsapp_messages.update_many(
+        {**messages, **UNREAD_FILTER},
+        {"$set": {"status": "read", "updated_at": now}}
+    )
+
+    if result.modified_count:
+        await db.whatsapp_conversations.update_one(
+            {"workspace_id": workspace_id, "phone": phone},
+            {"$inc": {"unread_count": -result.modified_count}, "$set": {"updated_at": now}}
+        )
+    return result.modified_count
+
+
+async def rebuild_whatsapp_conversations(
+    db,
+    workspace_ids: Optional[List[str]] = None,
+    phones: Optional[List[str]] = None
+) -> None:
+    """
+    Recalcular los resúmenes desde los mensajes (todos, o de ciertos workspaces/teléfonos).
+    Se usa para completar la colección la primera vez y tras reasignar mensajes.
+    """
+    match = {"channel": "whatsapp"}
+    if workspace_ids is not None:
+        match["workspace_id"] = {"$in": workspace_ids}
+    if phones is not None:
+        match["contact_phone"] = {"$in": phones}
+
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"timestamp": -1}},
+        {"$group": {
+            "_id": {"workspace_id": "$workspace_id", "phone": "$contact_phone"},
+            "last_message": {"$first": "$content.text"},
+            "last_timestamp": {"$first": "$timestamp"},
+            "last_direction": {"$first": "$direction"},
+            "unread_count": {"$sum": {"$cond": [
+                {"$and": [{"$eq": ["$direction", "inbound"]}, {"$ne": ["$status", "read"]}]},
+                1, 0
+            ]}},
+            # Nombre más reciente: el máximo de {fecha, nombre} entre los mensajes que lo traen
+            "push_name": {"$max": {"$cond": [
+                {"$ifNull": ["$meta.push_name", False]},
+                {"t": "$timestamp", "n": "$meta.push_name"},
+                None
+            ]}}
+        }},
+        {"$project": {
+            "_id": 0,
+            "workspace_id": "$_id.workspace_id",
+            "phone": "$_id.phone",
+            "last_message": 1,
+            "last_timestamp": 1,
+            "last_direction": 1,
+            "unread_count": 1,
+            "push_name": "$push_name.n",
+            "updated_at": "$$NOW"
+        }},
+        {"$merge": {
+            "into": "whatsapp_conversations",
+            "on": ["workspace_id", "phone"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ]
+
+    async for _ in db.whatsapp_messages.aggregate(pipeline, allowDiskUse=True):
+        pass
+
+
+async def backfill_whatsapp_conversations(db) -> bool:
+    """
+    Construir los resúmenes a partir de los mensajes existentes, una sola vez.
+    El marcador en migrations se inserta antes de empezar (el _id único evita que dos
+    workers lo ejecuten a la vez) y se elimina si la construcción falla, para reintentar.
+    """
+    try:
+        await db.migrations.insert_one({
+            "_id": CONVERSATIONS_MIGRATION_ID,
+            "status": "running",
+            "started_at": datetime.now(timezone.utc).isoformat()
+        })
+    except DuplicateKeyError:
+        return False
+
+    try:
+        await rebuild_whatsapp_conversations(db)
+    except Exception:
+        await db.migrations.delete_one({"_id": CONVERSATIONS_MIGRATION_ID})
+        raise
+
+    await db.migrations.update_one(
+        {"_id": CONVERSATIONS_MIGRATION_ID},
+        {"$set": {"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    return True
+
+
+async def ensure_whatsapp_conversation_indexes(db) -> None:
+    await db.whatsapp_conversations.create_index([("workspace_id", 1), ("phone", 1)], unique=True)
+    await db.whatsapp_conversations.create_index([("workspace_id", 1), ("last_timestamp", -1)])
+    # Historial por conversación y no leídos
+    await db.whatsapp_messages.create_index([
+        ("workspace_id", 1), ("channel", 1), ("contact_phone", 1), ("timestamp", -1)
+    ])
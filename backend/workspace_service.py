@@ -8,6 +8,8 @@ from typing import Optional, List, Dict, Any
 import uuid
 import secrets
 
+from cache_service import TTLCache
+
 # ==========================================
 # MODELOS DE DATOS
 # ==========================================
@@ -143,6 +145,7 @@ async def create_personal_workspace(db, username: str, user_email: str, user_ful
         "invited_by": None
     }
     await db.workspace_members.insert_one(member)
+    invalidate_permission_cache(username=username)
     
     return workspace
 
@@ -219,6 +222,176 @@ async def get_resource_permissions(db, resource_type: str, resource_id: str) ->
     
     return permissions
 
+# Mapeo de acción a capacidad del rol de recurso
+RESOURCE_ACTION_MAP = {
+    "view": "can_view",
+    "edit": "can_edit",
+    "comment": "can_comment",
+    "share": "can_share",
+    "delete": "can_edit"  # Solo editores pueden eliminar
+}
+
+# Campos de ownership por tipo de recurso: (colección, campo owner)
+RESOURCE_OWNER_FIELDS = {
+    "mindmap": ("projects", "username"),
+    "board": ("boards", "owner_username"),
+    "contacts": ("contacts", "username")
+}
+
+# Cache de decisiones efectivas (usuario, tipo, recurso) → acceso,
+# indexado por usuario y por recurso para invalidar sin recorrer todas las claves
+PERMISSION_CACHE_TTL_SECONDS = 30
+PERMISSION_CACHE_MAX_ENTRIES = 50000
+_permission_cache = TTLCache(
+    PERMISSION_CACHE_MAX_ENTRIES,
+    PERMISSION_CACHE_TTL_SECONDS,
+    indexes={"user": lambda key: key[0], "resource": lambda key: (key[1], key[2])}
+)
+
+
+def invalidate_permission_cache(
+    resource_type: Optional[str] = None,
+    resource_id: Optional[str] = None,
+    username: Optional[str] = None
+) -> None:
+    """
+    Invalidar decisiones de permisos cacheadas.
+    Sin argumentos se vacía todo el cache.
+    """
+    if resource_type is None and resource_id is None and username is None:
+        _permission_cache.clear()
+        return
+    
+    if resource_type is not None and resource_id is not None:
+        if username is not None:
+            _permission_cache.pop((username, resource_type, resource_id))
+        else:
+            _permission_cache.invalidate("resource", (resource_type, resource_id))
+        return
+    
+    if username is not None and resource_type is None:
+        _permission_cache.invalidate("user", username)
+        return
+    
+    # Combinaciones parciales poco comunes (p. ej. solo por tipo): recorrido completo
+    for key in _permission_cache.keys():
+        cached_user, cached_type, cached_id = key
+        if username is not None and cached_user != username:
+            continue
+        if resource_type is not None and cached_type != resource_type:
+            continue
+        if resource_id is not None and cached_id != resource_id:
+            continue
+        _permission_cache.pop(key)
+
+
+async def get_resource_ownership(db, resource_type: str, resource_id: str) -> Optional[dict]:
+    """
+    Obtener solo owner y workspace de un recurso (sin cargar nodos ni contenido).
+    Retorna {"owner": ..., "workspace_id": ...} o None si no existe.
+    """
+    if resource_type not in RESOURCE_OWNER_FIELDS:
+        return None
+    
+    collection_name, owner_field = RESOURCE_OWNER_FIELDS[resource_type]
+    
+    if resource_type == "mindmap":
+        query = {"$or": [{"id": resource_id}, {"project_id": resource_id}]}
+    else:
+        query = {"id": resource_id}
+    
+    resource = await db[collection_name].find_one(
+        query,
+        {"_id": 0, owner_field: 1, "workspace_id": 1}
+    )
+    
+    if not resource:
+        return None
+    
+    return {
+        "owner": resource.get(owner_field),
+        "workspace_id": resource.get("workspace_id")
+    }
+
+
+async def resolve_resource_access(
+    db,
+    username: str,
+    resource_type: str,
+    resource_id: str
+) -> dict:
+    """
+    Resolver el acceso efectivo de un usuario sobre un recurso.
+    
+    Retorna {"source": "owner" | "resource" | "workspace" | None, "role": ...}.
+    El resultado se cachea por PERMISSION_CACHE_TTL_SECONDS y se invalida
+    cuando cambian permisos, colaboradores o miembros de workspace.
+    """
+    key = (username, resource_type, resource_id)
+    
+    cached = _permission_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    decision = {"source": None, "role": None}
+    
+    # 1. Owner del recurso
+    ownership = await get_resource_ownership(db, resource_type, resource_id)
+    if ownership and ownership["owner"] == username:
+        decision = {"source": "owner", "role": "owner"}
+    else:
+        # 2. Permiso directo
+        permission = await db.resource_permissions.find_one(
+            {
+                "resource_type": resource_type,
+                "resource_id": resource_id,
+                "principal_type": "user",
+                "principal_id": username
+            },
+            {"_id": 0, "role": 1}
+        )
+        
+        if permission:
+            decision = {"source": "resource", "role": permission.get("role", "viewer")}
+        
+        # 3. A través del workspace del recurso
+        elif ownership and ownership.get("workspace_id"):
+            membership = await db.workspace_members.find_one(
+                {"workspace_id": ownership["workspace_id"], "username": username},
+                {"_id": 0, "role": 1}
+            )
+            
+            if membership:
+                decision = {"source": "workspace", "role": membership.get("role", "viewer")}
+    
+    _permission_cache.set(key, decision)
+    return decision
+
+
+def access_allows_action(decision: dict, action: str) -> bool:
+    """
+    Evaluar si una decisión de acceso permite una acción.
+    """
+    source = decision.get("source")
+    
+    if source == "owner":
+        return True
+    
+    if source == "resource":
+        role_permissions = RESOURCE_ROLES.get(decision.get("role"), RESOURCE_ROLES["viewer"])
+        return role_permissions.get(RESOURCE_ACTION_MAP.get(action, "can_view"), False)
+    
+    if source == "workspace":
+        ws_permissions = WORKSPACE_ROLES.get(decision.get("role"), WORKSPACE_ROLES["viewer"])
+        
+        if action in ["view"]:
+            return ws_permissions.get("can_view", False)
+        elif action in ["edit", "delete"]:
+            return ws_permissions.get("can_edit", False)
+    
+    return False
+
+
 async def check_resource_permission(
     db, 
     username: str, 
@@ -234,68 +407,106 @@ async def check_resource_permission(
     2. Si tiene permiso directo sobre el recurso → verificar rol
     3. Si el recurso pertenece a un workspace donde el usuario es miembro → verificar rol
     """
-    # 1. Verificar si es owner del recurso
-    resource = None
-    if resource_type == "mindmap":
-        resource = await db.projects.find_one({"id": resource_id}, {"_id": 0})
-        if not resource:
-            resource = await db.projects.find_one({"project_id": resource_id}, {"_id": 0})
-        if resource and resource.get("username") == username:
-            return True
-    elif resource_type == "board":
-        resource = await db.boards.find_one({"id": resource_id}, {"_id": 0})
-        if resource and resource.get("owner_username") == username:
-            return True
-    elif resource_type == "contacts":
-        # Los contactos pertenecen al usuario
-        resource = await db.contacts.find_one({"id": resource_id}, {"_id": 0})
-        if resource and resource.get("username") == username:
-            return True
-    
-    # 2. Verificar permiso directo
-    permission = await db.resource_permissions.find_one(
+    decision = await resolve_resource_access(db, username, resource_type, resource_id)
+    return access_allows_action(decision, action)
+
+async def check_resource_permissions_bulk(
+    db,
+    username: str,
+    resources: List[tuple]  # [(resource_type, resource_id), ...]
+) -> List[dict]:
+    """
+    Resolver el acceso de un usuario sobre muchos recursos a la vez.
+    
+    Usa una consulta $in de ownership por colección, una de permisos directos
+    y una de membresías de workspace, sin importar cuántos recursos se pidan.
+    Retorna una entrada por recurso, en el mismo orden recibido.
+    """
+    ids_by_type: Dict[str, set] = {}
+    for resource_type, resource_id in resources:
+        ids_by_type.setdefault(resource_type, set()).add(resource_id)
+    
+    # 1. Ownership (solo campos de owner y workspace)
+    ownership: Dict[tuple, dict] = {}
+    for resource_type, ids in ids_by_type.items():
+        if resource_type not in RESOURCE_OWNER_FIELDS:
+            continue
+        
+        collection_name, owner_field = RESOURCE_OWNER_FIELDS[resource_type]
+        id_list = list(ids)
+        
+        if resource_type == "mindmap":
+            query = {"$or": [{"id": {"$in": id_list}}, {"project_id": {"$in": id_list}}]}
+        else:
+            query = {"id": {"$in": id_list}}
+        
+        docs = await db[collection_name].find(
+            query,
+            {"_id": 0, "id": 1, "project_id": 1, owner_field: 1, "workspace_id": 1}
+        ).to_list(len(id_list) * 2)
+        
+        for doc in docs:
+            entry = {"owner": doc.get(owner_field), "workspace_id": doc.get("workspace_id")}
+            for key_field in ("id", "project_id"):
+                if doc.get(key_field) in ids:
+                    ownership.setdefault((resource_type, doc[key_field]), entry)
+    
+    # 2. Permisos directos
+    all_ids = list({resource_id for _, resource_id in resources})
+    permissions = await db.resource_permissions.find(
         {
-            "resource_type": resource_type,
-            "resource_id": resource_id,
             "principal_type": "user",
-            "principal_id": username
+            "principal_id": username,
+            "resource_id": {"$in": all_ids}
         },
-        {"_id": 0}
-    )
+        {"_id": 0, "resource_type": 1, "resource_id": 1, "role": 1}
+    ).to_list(len(all_ids) * len(ids_by_type) or 1)
     
-    if permission:
-        role = permission.get("role", "viewer")
-        role_permissions = RESOURCE_ROLES.get(role, RESOURCE_ROLES["viewer"])
+    direct_roles = {
+        (p["resource_type"], p["resource_id"]): p.get("role", "viewer")
+        for p in permissions
+    }
+    
+    # 3. Membresías en los workspaces de los recursos
+    workspace_ids = list({
+        o["workspace_id"] for o in ownership.values() if o.get("workspace_id")
+    })
+    workspace_roles = {}
+    if workspace_ids:
+        memberships = await db.workspace_members.find(
+            {"username": username, "workspace_id": {"$in": workspace_ids}},
+            {"_id": 0, "workspace_id": 1, "role": 1}
+        ).to_list(len(workspace_ids))
+        workspace_roles = {m["workspace_id"]: m.get("role", "viewer") for m in memberships}
+    
+    results = []
+    for resource_type, resource_id in resources:
+        key = (resource_type, resource_id)
+        owner_info = ownership.get(key)
         
-        action_map = {
-            "view": "can_view",
-            "edit": "can_edit",
-            "comment": "can_comment",
-            "share": "can_share",
-            "delete": "can_edit"  # Solo editores pueden eliminar
-        }
+        decision = {"source": None, "role": None}
+        if owner_info and owner_info["owner"] == username:
+            decision = {"source": "owner", "role": "owner"}
+        elif key in direct_roles:
+            decision = {"source": "resource", "role": direct_roles[key]}
+        elif owner_info and workspace_roles.get(owner_info.get("workspace_id")):
+            decision = {"source": "workspace", "role": workspace_roles[owner_info["workspace_id"]]}
         
-        return role_permissions.get(action_map.get(action, "can_view"), False)
-    
-    # 3. Verificar a través de workspace
-    if resource:
-        workspace_id = resource.get("workspace_id")
-        if workspace_id:
-            membership = await db.workspace_members.find_one(
-                {"workspace_id": workspace_id, "username": username},
-                {"_id": 0}
-            )
-            
-            if membership:
-                ws_role = membership.get("role", "viewer")
-                ws_permissions = WORKSPACE_ROLES.get(ws_role, WORKSPACE_ROLES["viewer"])
-                
-                if action in ["view"]:
-                    return ws_permissions.get("can_view", False)
-                elif action in ["edit", "delete"]:
-                    return ws_permissions.get("can_edit", False)
+        _permission_cache.set((username, resource_type, resource_id), decision)
+        
+        results.append({
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "exists": owner_info is not None,
+            "source": decision["source"],
+            "role": decision["role"],
+            "permissions": {
+                action: access_allows_action(decision, action)
+                for action in RESOURCE_ACTION_MAP
+            }
+        })
     
-    return False
+    return results
 
 async def grant_resource_permission(
     db,
@@ -337,6 +548,8 @@ async def grant_resource_permission(
         upsert=True
     )
     
+    invalidate_permission_cache(resource_type, resource_id)
+    
     return permission
 
 async def revoke_resource_permission(
@@ -356,6 +569,8 @@ async def revoke_resource_permission(
         "principal_id": principal_id
     })
     
+    invalidate_permission_cache(resource_type, resource_id)
+    
     return result.deleted_count > 0
 
 # ==========================================
@@ -553,6 +768,28 @@ async def get_resource_share_link(db, resource_type: str, resource_id: str) -> O
 # FUNCIONES DE COLABORADORES
 # ==========================================
 
+async def get_users_by_username(
+    db,
+    usernames: List[str],
+    fields: tuple = ("username", "email", "full_name", "picture")
+) -> Dict[str, dict]:
+    """
+    Obtener varios usuarios en una sola consulta $in, indexados por username
+    """
+    usernames = list({u for u in usernames if u})
+    if not usernames:
+        return {}
+    
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    projection["username"] = 1
+    
+    users = await db.users.find(
+        {"username": {"$in": usernames}},
+        projection
+    ).to_list(len(usernames))
+    
+    return {u["username"]: u for u in users}
+
 async def get_resource_collaborators(db, resource_type: str, resource_id: str) -> List[dict]:
     """
     Obtener lista de colaboradores de un recurso
@@ -566,13 +803,12 @@ async def get_resource_collaborators(db, resource_type: str, resource_id: str) -
         {"_id": 0}
     ).to_list(100)
     
-    # Enriquecer con datos del usuario
+    # Enriquecer con datos de usuario (una sola consulta)
+    users = await get_users_by_username(db, [p["principal_id"] for p in permissions])
+    
     collaborators = []
     for perm in permissions:
-        user = await db.users.find_one(
-            {"username": perm["principal_id"]},
-            {"_id": 0, "username": 1, "email": 1, "full_name": 1, "picture": 1}
-        )
+        user = users.get(perm["principal_id"])
         
         if user:
             collaborators.append({
@@ -635,6 +871,8 @@ async def update_collaborator_role(
         }
     )
     
+    invalidate_permission_cache(resource_type, resource_id, username)
+    
     return result.modified_count > 0
 
 async def remove_collaborator(
@@ -653,6 +891,8 @@ async def remove_collaborator(
         "principal_id": username
     })
     
+    invalidate_permission_cache(resource_type, resource_id, username)
+    
     return result.deleted_count > 0
 
 # ==========================================
@@ -33,6 +33,12 @@ import { ShareModal } from '../sharing/ShareModal';
 // Use relative URLs for production compatibility
 const API_URL = '';
 
+// Contactos por página en el listado (el resto se carga con "Cargar más")
+const CONTACTS_PAGE_SIZE = 500;
+
+// Espera antes de enviar la búsqueda al servidor (ms)
+const SEARCH_DEBOUNCE_MS = 300;
+
 // Columnas predeterminadas (fijas del sistema)
 const DEFAULT_COLUMNS = [
   { id: 'nombre', label: 'Nombre completo', required: true },
@@ -188,11 +194,15 @@ const ContactsPage = () => {
   
   const [activeTab, setActiveTab] = useState('client');
   const [contacts, setContacts] = useState([]);
+  const [contactsCursor, setContactsCursor] = useState(null); // Cursor de la siguiente página
+  const [loadingMore, setLoadingMore] = useState(false);
   const [allContactsCounts, setAllContactsCounts] = useState({ client: 0, prospect: 0, supplier: 0 }); // Para gráfico por tipo
   const [customFields, setCustomFields] = useState([]);
   const [contactLabels, setContactLabels] = useState([]); // Etiquetas disponibles
   const [loading, setLoading] = useState(true);
   const [searchTerm, setSearchTerm] = useState('');
+  const [debouncedSearch, setDebouncedSearch] = useState('');
+  const [contactsTotal, setContactsTotal] = useState(null); // Total del filtro actual (primera página)
   const [userCountry, setUserCountry] = useState('PE'); // País del usuario desde configuración
   const [showVerificationAlert, setShowVerificationAlert] = useState(false);
   
@@ -329,12 +339,31 @@ const ContactsPage = () => {
     }
   }, [token]);
 
-  // Cargar contactos y campos personalizados
-  const loadData = useCallback(async () => {
+  // Búsqueda y filtros de etiquetas/campos que se resuelven en el servidor
+  const serverFilterParams = useMemo(() => {
+    const params = new URLSearchParams();
+    if (debouncedSearch.trim()) params.append('q', debouncedSearch.trim());
+    for (const [columnId, filterValues] of Object.entries(columnFilters)) {
+      if (!filterValues || filterValues.length === 0) continue;
+      if (columnId === 'labels') {
+        params.append('label', filterValues.join(','));
+        params.append('label_mode', 'any');
+      } else if (columnId.startsWith('custom_')) {
+        const fieldId = columnId.replace('custom_', '');
+        filterValues.forEach(value => params.append('custom_field', `${fieldId}:${value}`));
+      }
+    }
+    const query = params.toString();
+    return query ? `&${query}` : '';
+  }, [debouncedSearch, columnFilters]);
+
+  // Cargar la primera página de contactos del tipo actual (con búsqueda y filtros)
+  const loadContacts = useCallback(async () => {
     // No cargar si no hay empresa activa
     if (!activeCompany) {
       setLoading(false);
       setContacts([]);
+      setContactsTotal(null);
       return;
     }
     
@@ -344,30 +373,45 @@ const ContactsPage = () => {
       const companyParam = `&company_id=${activeCompany.id}`;
       const workspaceParam = currentContext !== 'personal' ? `&workspace_id=${currentContext}` : '';
       
-      // Cargar contactos del tipo actual
-      const contactsRes = await fetch(`${API_URL}/api/contacts?contact_type=${activeTab}${companyParam}${workspaceParam}`, {
+      const contactsRes = await fetch(`${API_URL}/api/contacts?contact_type=${activeTab}${companyParam}${workspaceParam}${serverFilterParams}&limit=${CONTACTS_PAGE_SIZE}`, {
         headers: { 'Authorization': `Bearer ${token}` }
       });
       if (contactsRes.ok) {
         const data = await contactsRes.json();
         setContacts(data.contacts || []);
+        setContactsCursor(data.has_more ? data.next_cursor : null);
+        setContactsTotal(data.total ?? null);
       }
+    } catch (error) {
+      console.error('Error loading contacts:', error);
+    } finally {
+      setLoading(false);
+    }
+  }, [activeTab, token, currentContext, activeCompany, serverFilterParams]);
+
+  // Cargar conteos por tipo, campos personalizados y etiquetas
+  const loadConfig = useCallback(async () => {
+    if (!activeCompany) return;
+    
+    try {
+      const companyParam = `&company_id=${activeCompany.id}`;
+      const workspaceParam = currentContext !== 'personal' ? `&workspace_id=${currentContext}` : '';
       
-      // Cargar conteos de todos los tipos (para el gráfico por tipo)
+      // Cargar conteos de todos los tipos (para el gráfico por tipo): solo el total
       const [clientRes, prospectRes, supplierRes] = await Promise.all([
-        fetch(`${API_URL}/api/contacts?contact_type=client${companyParam}${workspaceParam}`, { headers: { 'Authorization': `Bearer ${token}` } }),
-        fetch(`${API_URL}/api/contacts?contact_type=prospect${companyParam}${workspaceParam}`, { headers: { 'Authorization': `Bearer ${token}` } }),
-        fetch(`${API_URL}/api/contacts?contact_type=supplier${companyParam}${workspaceParam}`, { headers: { 'Authorization': `Bearer ${token}` } })
+        fetch(`${API_URL}/api/contacts?contact_type=client${companyParam}${workspaceParam}&limit=1&fields=id`, { headers: { 'Authorization': `Bearer ${token}` } }),
+        fetch(`${API_URL}/api/contacts?contact_type=prospect${companyParam}${workspaceParam}&limit=1&fields=id`, { headers: { 'Authorization': `Bearer ${token}` } }),
+        fetch(`${API_URL}/api/contacts?contact_type=supplier${companyParam}${workspaceParam}&limit=1&fields=id`, { headers: { 'Authorization': `Bearer ${token}` } })
       ]);
       
-      const clientData = clientRes.ok ? await clientRes.json() : { contacts: [] };
-      const prospectData = prospectRes.ok ? await prospectRes.json() : { contacts: [] };
-      const supplierData = supplierRes.ok ? await supplierRes.json() : { contacts: [] };
+      const clientData = clientRes.ok ? await clientRes.json() : { total: 0 };
+      const prospectData = prospectRes.ok ? await prospectRes.json() : { total: 0 };
+      const supplierData = supplierRes.ok ? await supplierRes.json() : { total: 0 };
       
       setAllContactsCounts({
-        client: clientData.contacts?.length || 0,
-        prospect: prospectData.contacts?.length || 0,
-        supplier: supplierData.contacts?.length || 0
+        client: clientData.total || 0,
+        prospect: prospectData.total || 0,
+        supplier: supplierData.total || 0
       });
       
       // Cargar campos personalizados
@@ -389,16 +433,52 @@ const ContactsPage = () => {
       }
     } catch (error) {
       console.error('Error loading data:', error);
-    } finally {
-      setLoading(false);
     }
   }, [activeTab, token, currentContext, activeCompany]);
 
-  useEffect(() => {
-    if (activeCompany) {
-      loadData();
+  // Recargar contactos y configuración (después de crear, editar o eliminar)
+  const loadData = useCallback(
+    () => Promise.all([loadContacts(), loadConfig()]),
+    [loadContacts, loadConfig]
+  );
+
+  // Cargar la siguiente página de contactos (paginación por cursor)
+  const loadMoreContacts = useCallback(async () => {
+    if (!activeCompany || !contactsCursor) return;
+    
+    setLoadingMore(true);
+    try {
+      const companyParam = `&company_id=${activeCompany.id}`;
+      const workspaceParam = currentContext !== 'personal' ? `&workspace_id=${currentContext}` : '';
+      const res = await fetch(
+        `${API_URL}/api/contacts?contact_type=${activeTab}${companyParam}${workspaceParam}${serverFilterParams}&limit=${CONTACTS_PAGE_SIZE}&cursor=${encodeURIComponent(contactsCursor)}`,
+        { headers: { 'Authorization': `Bearer ${token}` } }
+      );
+      if (res.ok) {
+        const data = await res.json();
+        setContacts(prev => [...prev, ...(data.contacts || [])]);
+        setContactsCursor(data.has_more ? data.next_cursor : null);
+      }
+    } catch (error) {
+      console.error('Error loading more contacts:', error);
+    } finally {
+      setLoadingMore(false);
     }
-  }, [loadData, activeCompany]);
+  }, [activeTab, token, currentContext, activeCompany, contactsCursor, serverFilterParams]);
+
+  useEffect(() => {
+    loadContacts();
+  }, [loadContacts]);
+
+  useEffect(() => {
+    loadConfig();
+  }, [loadConfig]);
+
+  // La búsqueda se envía al servidor cuando el usuario deja de escribir
+  useEffect(() => {
+    const timeout = setTimeout(() => setDebouncedSearch(searchTerm), SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timeout);
+  }, [searchTerm]);
 
   // Cargar configuración de columnas desde localStorage
   useEffect(() => {
@@ -1284,20 +1364,8 @@ const ContactsPage = () => {
     setShowCreateModal(true);
   };
 
-  // Filtrar contactos (búsqueda + filtros de columna)
+  // Filtrar contactos por fecha (búsqueda, etiquetas y campos se filtran en el servidor)
   const filteredContacts = contacts.filter(contact => {
-    // Text search filter
-    const searchLower = searchTerm.toLowerCase();
-    const matchesSearch = (
-      contact.nombre.toLowerCase().includes(searchLower) ||
-      contact.apellidos.toLowerCase().includes(searchLower) ||
-      contact.whatsapp.includes(searchLower) ||
-      (contact.email && contact.email.toLowerCase().includes(searchLower))
-    );
-    
-    if (!matchesSearch) return false;
-    
-    // Date filter
     const dateRange = getDateFilterRange();
     if (dateRange && dateRange.from) {
       const contactDate = contact.created_at ? parseISO(contact.created_at) : null;
@@ -1313,36 +1381,6 @@ const ContactsPage = () => {
       }
     }
     
-    // Column filters
-    for (const [columnId, filterValues] of Object.entries(columnFilters)) {
-      if (!filterValues || filterValues.length === 0) continue;
-      
-      if (columnId === 'labels') {
-        // Filter by labels
-        const contactLabelIds = contact.labels || [];
-        // Check if contact has ANY of the selected labels
-        const hasMatchingLabel = filterValues.some(labelId => contactLabelIds.includes(labelId));
-        if (!hasMatchingLabel) return false;
-      } else if (columnId.startsWith('custom_')) {
-        // Filter by custom field
-        const fieldId = columnId.replace('custom_', '');
-        const fieldValue = contact.custom_fields?.[fieldId];
-        const field = customFields.find(f => f.id === fieldId);
-        
-        if (field) {
-          if (field.field_type === 'multiselect') {
-            // Multiselect: check if any selected value matches
-            const contactValues = Array.isArray(fieldValue) ? fieldValue : [];
-            const hasMatchingValue = filterValues.some(v => contactValues.includes(v));
-            if (!hasMatchingValue) return false;
-          } else {
-            // Single select: check if value matches
-            if (!filterValues.includes(fieldValue)) return false;
-          }
-        }
-      }
-    }
-    
     return true;
   });
 
@@ -1749,6 +1787,9 @@ const ContactsPage = () => {
                 >
                   <Icon size={16} />
                   {type.label}
+                  {isActive && contactsTotal !== null && (
+                    <span className="text-xs text-gray-400" data-testid="contacts-total">({contactsTotal})</span>
+                  )}
                 </button>
               );
             })}
@@ -1864,7 +1905,7 @@ const ContactsPage = () => {
                   <div>
                     <h2 className="text-lg font-bold text-white">Dashboard de Reportes</h2>
                     <p className="text-sm text-slate-400">
-                      {filteredContacts.length} contactos • {currentType.label}
+                      {contactsTotal ?? filteredContacts.length} contactos • {currentType.label}
                       {hasActiveFilters && ' • Filtros aplicados'}
                     </p>
                   </div>
@@ -2085,7 +2126,7 @@ const ContactsPage = () => {
                   <div className="text-xs text-slate-400">Contactos mostrados</div>
                 </div>
                 <div className="bg-slate-800/30 rounded-xl p-4 border border-slate-700/50">
-                  <div className="text-2xl font-bold text-cyan-400">{contacts.length}</div>
+                  <div className="text-2xl font-bold text-cyan-400">{allContactsCounts[activeTab]}</div>
                   <div className="text-xs text-slate-400">Total {currentType.label.toLowerCase()}</div>
                 </div>
                 <div className="bg-slate-800/30 rounded-xl p-4 border border-slate-700/50">
@@ -2272,6 +2313,18 @@ const ContactsPage = () => {
                 </tbody>
               </table>
             </div>
+            {contactsCursor && (
+              <div className="flex justify-center py-4 border-t border-gray-100">
+                <button
+                  onClick={loadMoreContacts}
+                  disabled={loadingMore}
+                  className="px-4 py-2 text-sm font-medium text-cyan-600 hover:bg-cyan-50 rounded-lg transition-colors disabled:opacity-50"
+                  data-testid="load-more-contacts"
+                >
+                  {loadingMore ? 'Cargando...' : 'Cargar más'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
@@ -480,29 +480,24 @@ const FinanzasModule = ({ token, projects = [] }) => {
     setLoading(true);
     try {
       const companyId = selectedCompany.id;
-      const [summaryData, incomesData, expensesData, investmentsData, categoriesData, sourcesData, receivablesData, payablesData, productsData, fixedExpensesData] = await Promise.all([
-        fetchWithAuth(`/summary?company_id=${companyId}&period=${selectedPeriod}`),
+      // El dashboard trae resumen, cuentas, gastos fijos, productos y categorías en una sola llamada
+      const [dashboard, incomesData, expensesData, investmentsData] = await Promise.all([
+        fetchWithAuth(`/dashboard?company_id=${companyId}&period=${selectedPeriod}`),
         fetchWithAuth(`/incomes?company_id=${companyId}`),
         fetchWithAuth(`/expenses?company_id=${companyId}`),
         fetchWithAuth(`/investments?company_id=${companyId}`),
-        fetchWithAuth('/categories'),
-        fetchWithAuth('/income-sources'),
-        fetchWithAuth(`/receivables?company_id=${companyId}`),
-        fetchWithAuth(`/payables?company_id=${companyId}`),
-        fetchWithAuth(`/products?company_id=${companyId}&status=activo`),
-        fetchWithAuth(`/fixed-expenses?company_id=${companyId}`),
       ]);
       
-      setSummary(summaryData);
+      setSummary(dashboard.summary);
       setIncomes(incomesData);
       setExpenses(expensesData);
       setInvestments(investmentsData);
-      setCategories(categoriesData.categories || []);
-      setIncomeSources(sourcesData.sources || []);
-      setReceivables(receivablesData);
-      setPayables(payablesData);
-      setProducts(productsData || []);
-      setFixedExpenses(fixedExpensesData || []);
+      setCategories(dashboard.categories || []);
+      setIncomeSources(dashboard.income_sources || []);
+      setReceivables(dashboard.receivables || { receivables: [], total: 0, total_facturado: 0, total_abonado: 0, count: 0 });
+      setPayables(dashboard.payables || { payables: [], total: 0, count: 0 });
+      setProducts(dashboard.products || []);
+      setFixedExpenses(dashboard.fixed_expenses || []);
     } catch (err) {
       console.error('Error loading finanzas data:', err);
     } finally {
@@ -1249,6 +1244,7 @@ const FinanzasModule = ({ token, projects = [] }) => {
             onLoad={() => loadBalanceGeneral(balanceFilter, balanceDateRange.start, balanceDateRange.end, balanceProjectFilter)}
             formatCurrency={formatCurrency}
             companyId={selectedCompany?.id}
+            fetchWithAuth={fetchWithAuth}
           />
         )}
 
@@ -3472,6 +3468,7 @@ const AddPaymentModal = ({ income, onClose, onSave, formatCurrency }) => {
   
   const [form, setForm] = useState({
     income_id: income.id,
+    company_id: income.company_id,
     amount: '',
     date: getLocalDateString(),
     payment_method: 'efectivo',
@@ -3707,10 +3704,13 @@ const BalanceGeneralTab = ({
   onProjectFilterChange,
   onLoad,
   formatCurrency,
-  companyId
+  companyId,
+  fetchWithAuth
 }) => {
   const [showIncomeDetails, setShowIncomeDetails] = useState(false);
   const [showExpenseDetails, setShowExpenseDetails] = useState(false);
+  // Detalle de movimientos paginado: { items, nextCursor, loading }
+  const [movements, setMovements] = useState({ incomes: null, expenses: null });
 
   // Cargar datos al montar el componente
   useEffect(() => {
@@ -3719,6 +3719,45 @@ const BalanceGeneralTab = ({
     }
   }, [companyId]);
 
+  // Reiniciar el detalle cuando cambia el balance (período o proyecto)
+  useEffect(() => {
+    setMovements({ incomes: null, expenses: null });
+  }, [balance]);
+
+  const loadMovements = useCallback(async (kind, cursor = null) => {
+    if (!balance?.period) return;
+    
+    setMovements(prev => ({ ...prev, [kind]: { ...(prev[kind] || { items: [] }), loading: true } }));
+    
+    try {
+      const { start_date, end_date } = balance.period;
+      let url = `/balance-general/${kind}?company_id=${companyId}&start_date=${start_date}&end_date=${end_date}`;
+      if (projectFilter) url += `&project_id=${projectFilter}`;
+      if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+      
+      const data = await fetchWithAuth(url);
+      setMovements(prev => ({
+        ...prev,
+        [kind]: {
+          items: [...(cursor && prev[kind] ? prev[kind].items : []), ...data.items],
+          nextCursor: data.next_cursor,
+          loading: false
+        }
+      }));
+    } catch (err) {
+      console.error(`Error loading balance ${kind}:`, err);
+      setMovements(prev => ({ ...prev, [kind]: { ...(prev[kind] || { items: [] }), loading: false } }));
+    }
+  }, [balance, companyId, projectFilter, fetchWithAuth]);
+
+  useEffect(() => {
+    if (showIncomeDetails && !movements.incomes) loadMovements('incomes');
+  }, [showIncomeDetails, movements.incomes, loadMovements]);
+
+  useEffect(() => {
+    if (showExpenseDetails && !movements.expenses) loadMovements('expenses');
+  }, [showExpenseDetails, movements.expenses, loadMovements]);
+
   const formatDate = (dateStr) => {
     if (!dateStr) return '-';
     try {
@@ -3758,13 +3797,29 @@ const BalanceGeneralTab = ({
     total_expense_real, 
     resultado_neto, 
     is_profit,
-    incomes,
-    expenses,
     income_count,
     expense_count,
     context,
     projects_balance
   } = balance;
+  const incomes = movements.incomes?.items;
+  const expenses = movements.expenses?.items;
+
+  const renderLoadMore = (kind) => {
+    const state = movements[kind];
+    if (!state?.nextCursor && !state?.loading) return null;
+    return (
+      <div className="py-3 text-center">
+        <button
+          onClick={() => loadMovements(kind, state.nextCursor)}
+          disabled={state.loading}
+          className="text-sm text-blue-600 hover:text-blue-700 disabled:text-gray-400"
+        >
+          {state.loading ? 'Cargando...' : 'Cargar más'}
+        </button>
+      </div>
+    );
+  };
 
   return (
     <div className="space-y-6">
@@ -4015,9 +4070,12 @@ const BalanceGeneralTab = ({
                     </tr>
                   </tfoot>
                 </table>
+              ) : movements.incomes?.loading || !movements.incomes ? (
+                <p className="text-center py-8 text-gray-500">Cargando...</p>
               ) : (
                 <p className="text-center py-8 text-gray-500">No hay ingresos en este período</p>
               )}
+              {incomes && incomes.length > 0 && renderLoadMore('incomes')}
             </div>
           )}
         </div>
@@ -4081,9 +4139,12 @@ const BalanceGeneralTab = ({
                     </tr>
                   </tfoot>
                 </table>
+              ) : movements.expenses?.loading || !movements.expenses ? (
+                <p className="text-center py-8 text-gray-500">Cargando...</p>
               ) : (
                 <p className="text-center py-8 text-gray-500">No hay gastos en este período</p>
               )}
+              {expenses && expenses.length > 0 && renderLoadMore('expenses')}
             </div>
           )}
         </div>
@@ -112,10 +112,28 @@ const WhatsAppInbox = () => {
     }
   };
 
+  // Mark conversation as read - uses relative URL
+  const markConversationRead = useCallback(async (phone) => {
+    if (!phone || !token) return;
+    
+    try {
+      await fetch(`/api/whatsapp/conversations/${phone}/read`, {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${token}` }
+      });
+      setConversations(prev => prev.map(c => c.phone === phone ? { ...c, unread_count: 0 } : c));
+    } catch (err) {
+      console.error('Error marking conversation as read:', err);
+    }
+  }, [token]);
+
   // Select conversation
   const handleSelectConversation = (conversation) => {
     setSelectedConversation(conversation);
     fetchMessages(conversation.phone);
+    if (conversation.unread_count > 0) {
+      markConversationRead(conversation.phone);
+    }
   };
 
   // Scroll to bottom of messages
@@ -280,6 +280,7 @@ export class WhatsAppManager {
       };
       
       await this.db.collection('whatsapp_messages').insertOne(messageDoc);
+      await this.updateConversation(messageDoc);
       
       // Broadcast new message event
       this.broadcast(workspaceId, 'message_received', {
@@ -294,6 +295,47 @@ export class WhatsAppManager {
     }
   }
 
+  /**
+   * Update the conversation summary (whatsapp_conversations) for a stored message.
+   * Single atomic upsert: last message only if it is newer, unread +1 for inbound.
+   */
+  private async updateConversation(messageDoc: {
+    workspace_id: string;
+    contact_phone: string;
+    direction: string;
+    content: { text: string };
+    timestamp: Date;
+    meta: { push_name?: string | null };
+  }) {
+    const isNewer = { $gte: [messageDoc.timestamp, { $ifNull: ['$last_timestamp', new Date(0)] }] };
+    const pushName = messageDoc.meta.push_name || null;
+    
+    try {
+      await this.db.collection('whatsapp_conversations').updateOne(
+        { workspace_id: messageDoc.workspace_id, phone: messageDoc.contact_phone },
+        [
+          { $set: { _newer: isNewer } },
+          {
+            $set: {
+              last_message: { $cond: ['$_newer', { $literal: messageDoc.content.text }, '$last_message'] },
+              last_timestamp: { $cond: ['$_newer', messageDoc.timestamp, '$last_timestamp'] },
+              last_direction: { $cond: ['$_newer', messageDoc.direction, '$last_direction'] },
+              push_name: pushName ? { $literal: pushName } : '$push_name',
+              unread_count: {
+                $add: [{ $ifNull: ['$unread_count', 0] }, messageDoc.direction === 'inbound' ? 1 : 0]
+              },
+              updated_at: '$$NOW'
+            }
+          },
+          { $unset: '_newer' }
+        ],
+        { upsert: true }
+      );
+    } catch (error) {
+      this.logger.error({ error }, `Failed to update conversation summary for ${messageDoc.contact_phone}`);
+    }
+  }
+
   /**
    * Handle message status updates (delivered, read)
    */
@@ -308,10 +350,33 @@ export class WhatsAppManager {
         };
         
         const newStatus = statusMap[update.update.status] || 'unknown';
+        const now = new Date();
+        
+        // Inbound message read on the phone: only an unread one counts down the summary
+        // (same rule as mark_conversation_read, so unread_count never drifts)
+        if (newStatus === 'read') {
+          const inbound = await this.db.collection('whatsapp_messages').findOneAndUpdate(
+            { 'meta.wa_message_id': update.key.id, direction: 'inbound', status: { $ne: 'read' } },
+            { $set: { status: 'read', updated_at: now } },
+            { projection: { workspace_id: 1, contact_phone: 1 } }
+          );
+          
+          if (inbound) {
+            try {
+              await this.db.collection('whatsapp_conversations').updateOne(
+                { workspace_id: inbound.workspace_id, phone: inbound.contact_phone },
+                { $inc: { unread_count: -1 }, $set: { updated_at: now } }
+              );
+            } catch (error) {
+              this.logger.error({ error }, `Failed to update conversation summary for ${inbound.contact_phone}`);
+            }
+          }
+        }
         
+        // Delivery statuses only apply to our own (outbound) messages
         await this.db.collection('whatsapp_messages').updateOne(
-          { 'meta.wa_message_id': update.key.id },
-          { $set: { status: newStatus, updated_at: new Date() } }
+          { 'meta.wa_message_id': update.key.id, direction: { $ne: 'inbound' } },
+          { $set: { status: newStatus, updated_at: now } }
         );
         
         this.broadcast(workspaceId, 'message_status', {
@@ -422,6 +487,7 @@ export class WhatsAppManager {
       };
       
       await this.db.collection('whatsapp_messages').insertOne(messageDoc);
+      await this.updateConversation(messageDoc);
       
       return { success: true, messageId: result?.key?.id || undefined };
     } catch (error: any) {
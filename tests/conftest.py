@@ -0,0 +1,45 @@
+"""
+Fixtures compartidas.
+Las pruebas de servicios se conectan directamente a MongoDB (MONGO_URL) en una base
+separada (<DB_NAME>_service_tests) para no tocar los datos del servidor de pruebas.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+class ServiceDB:
+    """Base de datos motor con su propio event loop (las pruebas son síncronas)"""
+
+    def __init__(self, db, loop):
+        self.db = db
+        self.loop = loop
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+
+@pytest.fixture
+def service_db():
+    mongo_url = os.environ.get("MONGO_URL")
+    if not mongo_url:
+        pytest.skip("MONGO_URL no configurado")
+    motor_asyncio = pytest.importorskip("motor.motor_asyncio")
+
+    loop = asyncio.new_event_loop()
+    client = motor_asyncio.AsyncIOMotorClient(mongo_url, io_loop=loop)
+    db_name = f"{os.environ.get('DB_NAME', 'mindmap_db')}_service_tests"
+    service = ServiceDB(client[db_name], loop)
+
+    yield service
+
+    loop.run_until_complete(client.drop_database(db_name))
+    client.close()
+    loop.close()
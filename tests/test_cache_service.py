@@ -0,0 +1,82 @@
+"""
+Test Suite for the bounded in-process cache (cache_service.TTLCache)
+Tests: LRU eviction, expiry, indexed invalidation (permissions, contact configs)
+"""
+
+import time
+
+from cache_service import TTLCache
+import contacts_service
+import workspace_service
+
+
+class TestTTLCache:
+    """Test suite for TTLCache"""
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # "b" queda como el menos usado
+        cache.set("c", 3)
+
+        assert cache.keys() == ["a", "c"]
+        assert cache.get("b") is None
+        print("✅ LRU eviction keeps the cache bounded")
+
+    def test_expired_entries_are_dropped(self):
+        cache = TTLCache(maxsize=10, ttl=0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
+        print("✅ Expired entries are dropped")
+
+    def test_invalidate_by_index(self):
+        cache = TTLCache(maxsize=10, ttl=60, indexes={"user": lambda key: key[0]})
+        cache.set(("ana", 1), "x")
+        cache.set(("ana", 2), "y")
+        cache.set(("luis", 1), "z")
+
+        assert cache.invalidate("user", "ana") == 2
+        assert cache.keys() == [("luis", 1)]
+        print("✅ Indexed invalidation removes only matching entries")
+
+
+class TestPermissionCacheInvalidation:
+    """Test suite for invalidate_permission_cache on the bounded cache"""
+
+    def test_invalidate_by_resource_and_user(self):
+        cache = workspace_service._permission_cache
+        cache.clear()
+        cache.set(("ana", "board", "b1"), {"source": "owner"})
+        cache.set(("luis", "board", "b1"), {"source": "resource"})
+        cache.set(("luis", "board", "b2"), {"source": "workspace"})
+
+        workspace_service.invalidate_permission_cache("board", "b1")
+        assert cache.keys() == [("luis", "board", "b2")]
+
+        workspace_service.invalidate_permission_cache(username="luis")
+        assert len(cache) == 0
+        print("✅ Permission cache invalidated by resource and by user")
+
+
+class TestContactConfigCacheInvalidation:
+    """Test suite for invalidate_contact_config on the bounded caches"""
+
+    def test_invalidate_by_owner_and_type(self):
+        contacts_service._contact_config_cache.clear()
+        contacts_service._custom_field_validators.clear()
+        contacts_service._contact_config_cache.set(("contact_field_configs", "ana", "client"), None)
+        contacts_service._contact_config_cache.set(("contact_field_configs", "ana", "provider"), {"fields": []})
+        contacts_service._custom_field_validators.set(("ana", "client", 3), lambda fields: [])
+        contacts_service._custom_field_validators.set(("luis", "client", 1), lambda fields: [])
+
+        contacts_service.invalidate_contact_config("ana", "client")
+        assert contacts_service._contact_config_cache.keys() == [("contact_field_configs", "ana", "provider")]
+        assert contacts_service._custom_field_validators.keys() == [("luis", "client", 1)]
+
+        contacts_service.invalidate_contact_config("ana")
+        assert len(contacts_service._contact_config_cache) == 0
+        print("✅ Contact config caches invalidated by owner and type")
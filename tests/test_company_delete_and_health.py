@@ -10,6 +10,7 @@ Tests:
 import pytest
 import requests
 import os
+import time
 import uuid
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
@@ -308,9 +309,21 @@ class TestCompanyDeletion:
         
         result = delete_response.json()
         
-        # Verify deleted_data stats are returned
-        assert "deleted_data" in result, "Expected deleted_data in response"
-        deleted_data = result["deleted_data"]
+        # The data is deleted by a background job; its steps report what was deleted
+        assert "job_id" in result, "Expected job_id in response"
+        assert result["job_id"] in result["message"]
+        
+        job = None
+        for _ in range(50):
+            job_response = requests.get(f"{BASE_URL}/api/deletion-jobs/{result['job_id']}", headers=self.headers)
+            assert job_response.status_code == 200, f"Failed to get deletion job: {job_response.text}"
+            job = job_response.json()
+            if job["status"] in ("completed", "failed"):
+                break
+            time.sleep(0.2)
+        
+        assert job["status"] == "completed", f"Deletion job did not complete: {job}"
+        deleted_data = {step["label"]: step["processed"] for step in job["steps"]}
         assert deleted_data["incomes"] >= 1, f"Expected at least 1 income deleted, got {deleted_data['incomes']}"
         assert deleted_data["expenses"] >= 1, f"Expected at least 1 expense deleted, got {deleted_data['expenses']}"
         assert deleted_data["investments"] >= 1, f"Expected at least 1 investment deleted, got {deleted_data['investments']}"
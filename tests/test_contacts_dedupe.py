@@ -0,0 +1,80 @@
+"""
+Test Suite for contact dedupe jobs and merges (contacts_dedupe_service)
+Tests: merges re-point incomes and expenses, jobs are claimed by a single worker
+"""
+
+import uuid
+
+from contacts_dedupe_service import merge_contacts, run_dedupe_job
+from contacts_service import build_contact_search_fields
+
+
+def make_contact(scope, nombre, **overrides):
+    contact = {
+        "id": f"contact_{uuid.uuid4().hex[:12]}",
+        "contact_type": "client",
+        "nombre": nombre,
+        "apellidos": "",
+        "whatsapp": "",
+        "email": "",
+        "custom_fields": {},
+        "labels": [],
+        **scope
+    }
+    contact.update(overrides)
+    contact.update(build_contact_search_fields(contact))
+    return contact
+
+
+class TestMergeContacts:
+    """Test suite for merge_contacts"""
+
+    def test_merge_repoints_incomes_and_expenses(self, service_db):
+        """Incomes and expenses of the duplicates end up on the primary contact"""
+        db = service_db.db
+        scope = {"company_id": f"cmp_{uuid.uuid4().hex[:8]}"}
+        primary = make_contact(scope, "Ana Torres", whatsapp="+51 987 654 321")
+        duplicate = make_contact(scope, "Ana Torres P.", email="ana@test.com", labels=["vip"])
+        other = make_contact(scope, "Luis Díaz")
+        service_db.run(db.contacts.insert_many([dict(primary), dict(duplicate), dict(other)]))
+        service_db.run(db.finanzas_incomes.insert_many([
+            {"id": "inc_1", "client_id": duplicate["id"], "client_name": "Ana Torres P.", **scope},
+            {"id": "inc_2", "client_id": other["id"], "client_name": "Luis Díaz", **scope}
+        ]))
+        service_db.run(db.finanzas_expenses.insert_one(
+            {"id": "exp_1", "vendor_id": duplicate["id"], "vendor_name": "Ana Torres P.", **scope}
+        ))
+
+        result = service_db.run(merge_contacts(db, primary, [duplicate], []))
+
+        assert result["repointed"]["incomes"] == 1
+        assert result["repointed"]["expenses"] == 1
+        income = service_db.run(db.finanzas_incomes.find_one({"id": "inc_1"}))
+        assert (income["client_id"], income["client_name"]) == (primary["id"], "Ana Torres")
+        expense = service_db.run(db.finanzas_expenses.find_one({"id": "exp_1"}))
+        assert (expense["vendor_id"], expense["vendor_name"]) == (primary["id"], "Ana Torres")
+        untouched = service_db.run(db.finanzas_incomes.find_one({"id": "inc_2"}))
+        assert untouched["client_id"] == other["id"]
+
+        assert service_db.run(db.contacts.find_one({"id": duplicate["id"]})) is None
+        merged = service_db.run(db.contacts.find_one({"id": primary["id"]}))
+        assert merged["email"] == "ana@test.com"
+        assert merged["labels"] == ["vip"]
+        print("✅ Merge re-pointed incomes and expenses to the primary contact")
+
+
+class TestDedupeJobClaim:
+    """Test suite for the queued → running claim of dedupe jobs"""
+
+    def test_job_not_queued_is_not_run_again(self, service_db):
+        """A job already claimed by another worker is left untouched"""
+        db = service_db.db
+        job = {"id": str(uuid.uuid4()), "status": "running", "scope": {}, "started_at": "2026-01-01T00:00:00"}
+        service_db.run(db.contact_dedupe_jobs.insert_one(dict(job)))
+
+        service_db.run(run_dedupe_job(db, job["id"]))
+
+        stored = service_db.run(db.contact_dedupe_jobs.find_one({"id": job["id"]}))
+        assert stored["status"] == "running"
+        assert stored["started_at"] == job["started_at"]
+        print("✅ Running job not executed twice")
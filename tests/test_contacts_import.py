@@ -0,0 +1,71 @@
+"""
+Test Suite for the contacts import (contacts_import_service.import_contacts)
+Tests: dedupe report against existing contacts and within the same file
+"""
+
+import io
+import uuid
+
+from contacts_import_service import import_contacts
+
+
+def csv_file(lines):
+    return io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+class TestImportContactsDedupe:
+    """Test suite for the duplicates report of import_contacts"""
+
+    def test_duplicates_reported_against_db_and_file(self, service_db):
+        """Existing phone/email and repeated rows are skipped and reported with their origin"""
+        db = service_db.db
+        company_id = f"cmp_{uuid.uuid4().hex[:8]}"
+        username = f"user_{uuid.uuid4().hex[:8]}"
+        service_db.run(db.contacts.insert_one({
+            "id": "contact_existing", "company_id": company_id, "contact_type": "client",
+            "nombre": "Ana", "apellidos": "Pérez", "whatsapp": "+51 987 654 321",
+            "match_keys": ["email:ana@example.com", "name:ana perez", "tel:987654321"]
+        }))
+
+        report = service_db.run(import_contacts(db, csv_file([
+            "nombre,apellidos,telefono,email",
+            "Ana María,Pérez,987654321,",                    # 2: mismo teléfono que la base
+            "Luis,Soto,912345678,luis@example.com",          # 3: nuevo
+            "Luis,Soto Díaz,+51 912 345 678,",               # 4: repite el teléfono de la fila 3
+            "Carla,Ruiz,923456789,ANA@example.com",          # 5: mismo email que la base
+            "Ana,Pérez,934567890,",                          # 6: mismo nombre (no es duplicado)
+        ]), "csv", "client", username, company_id=company_id))
+
+        assert report["rows"] == 5
+        assert report["imported"] == 2
+        assert report["duplicates"] == 3
+        assert report["failed"] == 0
+        assert report["duplicate_rows"] == [
+            {"row": 2, "reason": "tel", "existing_id": "contact_existing", "existing_row": None},
+            {"row": 4, "reason": "tel", "existing_id": None, "existing_row": 3},
+            {"row": 5, "reason": "email", "existing_id": "contact_existing", "existing_row": None},
+        ]
+        assert not report["errors_truncated"]
+
+        names = service_db.run(db.contacts.find(
+            {"company_id": company_id, "id": {"$ne": "contact_existing"}}, {"_id": 0, "nombre": 1}
+        ).sort("nombre", 1).to_list(None))
+        assert [c["nombre"] for c in names] == ["Ana", "Luis"]
+        print("✅ Import dedupe report lists database and in-file duplicates")
+
+    def test_dry_run_reports_without_writing(self, service_db):
+        db = service_db.db
+        company_id = f"cmp_{uuid.uuid4().hex[:8]}"
+        username = f"user_{uuid.uuid4().hex[:8]}"
+
+        report = service_db.run(import_contacts(db, csv_file([
+            "nombre,apellidos,telefono",
+            "Luis,Soto,912345678",
+            "Luis,Soto,912345678",
+        ]), "csv", "client", username, company_id=company_id, dry_run=True))
+
+        assert report["imported"] == 1
+        assert report["duplicates"] == 1
+        assert report["duplicate_rows"][0]["existing_row"] == 2
+        assert service_db.run(db.contacts.count_documents({"company_id": company_id})) == 0
+        print("✅ Dry run reports duplicates without inserting")
@@ -0,0 +1,79 @@
+"""
+Test Suite for background deletion jobs (deletion_job_service)
+Tests: atomic claim across workers, stale running jobs are taken over
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from deletion_job_service import (
+    DELETION_JOB_TIMEOUT_MINUTES, deletion_step, get_deletion_job, run_deletion_job
+)
+
+
+def make_job(collection, tag, **overrides):
+    job = {
+        "id": f"job_{uuid.uuid4().hex[:12]}",
+        "type": "test",
+        "requested_by": "tester",
+        "target": {},
+        "status": "queued",
+        "steps": [deletion_step(collection, {"tag": tag})],
+        "expected": None,
+        "processed": 0,
+        "error": None,
+        "started_at": None
+    }
+    job.update(overrides)
+    return job
+
+
+class TestDeletionJobClaim:
+    """Test suite for run_deletion_job claims"""
+
+    def seed(self, service_db, count=3):
+        db = service_db.db
+        tag = uuid.uuid4().hex[:8]
+        service_db.run(db.deletion_test_docs.insert_many([{"tag": tag, "n": n} for n in range(count)]))
+        return db, tag
+
+    def test_job_claimed_by_another_worker_is_not_run(self, service_db):
+        """A running job with a recent heartbeat belongs to another worker"""
+        db, tag = self.seed(service_db)
+        now = datetime.now(timezone.utc).isoformat()
+        job = make_job("deletion_test_docs", tag, status="running", claim_id="otro", heartbeat_at=now)
+        service_db.run(db.deletion_jobs.insert_one(dict(job)))
+
+        service_db.run(run_deletion_job(db, job["id"]))
+
+        assert service_db.run(db.deletion_test_docs.count_documents({"tag": tag})) == 3
+        stored = service_db.run(get_deletion_job(db, job["id"]))
+        assert stored["claim_id"] == "otro"
+        assert stored["processed"] == 0
+        print("✅ Claimed job left to its worker")
+
+    def test_stale_running_job_is_taken_over(self, service_db):
+        """A running job without progress for the timeout is reclaimed and completed"""
+        db, tag = self.seed(service_db)
+        stale = (datetime.now(timezone.utc) - timedelta(minutes=DELETION_JOB_TIMEOUT_MINUTES + 1)).isoformat()
+        job = make_job("deletion_test_docs", tag, status="running", claim_id="caido", heartbeat_at=stale)
+        service_db.run(db.deletion_jobs.insert_one(dict(job)))
+
+        service_db.run(run_deletion_job(db, job["id"]))
+
+        assert service_db.run(db.deletion_test_docs.count_documents({"tag": tag})) == 0
+        stored = service_db.run(db.deletion_jobs.find_one({"id": job["id"]}))
+        assert stored["status"] == "completed"
+        assert stored["claim_id"] != "caido"
+        assert stored["expected"] == 3 and stored["processed"] == 3
+        print("✅ Stale job reclaimed and completed once")
+
+    def test_completed_job_is_not_claimed_again(self, service_db):
+        db, tag = self.seed(service_db)
+        job = make_job("deletion_test_docs", tag, status="completed")
+        service_db.run(db.deletion_jobs.insert_one(dict(job)))
+
+        service_db.run(run_deletion_job(db, job["id"]))
+
+        assert service_db.run(db.deletion_test_docs.count_documents({"tag": tag})) == 3
+        print("✅ Completed job is not run again")
@@ -0,0 +1,67 @@
+"""
+Test Suite for the aging detail pagination (finanzas_aging_service.get_aging_items)
+Tests: keyset pages over due_date/date + id, bucket filter as a due date range
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from finanzas_aging_service import get_aging_items
+
+
+def days_ago(days):
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+class TestAgingItems:
+    """Test suite for get_aging_items"""
+
+    def seed(self, service_db):
+        db = service_db.db
+        company_id, workspace_id = f"cmp_{uuid.uuid4().hex[:8]}", f"ws_{uuid.uuid4().hex[:8]}"
+        incomes = [
+            # (id, date, due_date)
+            ("inc_a", days_ago(100), days_ago(95)),
+            ("inc_b", days_ago(40), ""),
+            ("inc_c", days_ago(20), days_ago(10)),
+            ("inc_d", days_ago(5), None),
+            ("inc_e", days_ago(1), days_ago(-15)),
+        ]
+        service_db.run(db.finanzas_incomes.insert_many([
+            {
+                "id": doc_id, "company_id": company_id, "workspace_id": workspace_id,
+                "date": date, "due_date": due_date, "amount": 100, "paid_amount": 0, "status": "pending"
+            }
+            for doc_id, date, due_date in incomes
+        ]))
+        return db, company_id, workspace_id
+
+    def test_pages_follow_effective_due_date(self, service_db):
+        """Pages mix documents with and without due_date in effective due order"""
+        db, company_id, workspace_id = self.seed(service_db)
+
+        ids, cursor = [], None
+        while True:
+            page = service_db.run(get_aging_items(db, "receivables", company_id, workspace_id, cursor=cursor, limit=2))
+            ids += [item["id"] for item in page["items"]]
+            assert all("sort_key" not in item for item in page["items"])
+            if not page["has_more"]:
+                break
+            cursor = page["next_cursor"]
+
+        assert ids == ["inc_a", "inc_b", "inc_c", "inc_d", "inc_e"]
+        print("✅ Aging items paginated on the stored due date and id")
+
+    def test_bucket_filter_uses_due_date_range(self, service_db):
+        db, company_id, workspace_id = self.seed(service_db)
+
+        def bucket_ids(bucket):
+            page = service_db.run(get_aging_items(db, "receivables", company_id, workspace_id, bucket=bucket))
+            assert all(item["aging_bucket"] == bucket for item in page["items"])
+            return [item["id"] for item in page["items"]]
+
+        assert bucket_ids("90_plus") == ["inc_a"]
+        assert bucket_ids("31_60") == ["inc_b"]
+        assert bucket_ids("1_30") == ["inc_c", "inc_d"]
+        assert bucket_ids("current") == ["inc_e"]
+        print("✅ Bucket filter matches the computed aging bucket")
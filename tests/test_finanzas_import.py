@@ -0,0 +1,45 @@
+"""
+Test Suite for the CSV import of incomes and expenses (finanzas_import_service)
+Tests: contacts resolved per chunk, categories created only for imported rows
+"""
+
+import io
+import uuid
+
+from finanzas_import_service import import_movements_csv
+
+
+def csv_file(lines):
+    return io.BytesIO(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+class TestImportMovements:
+    """Test suite for import_movements_csv"""
+
+    def test_contacts_and_categories_resolved_for_imported_rows(self, service_db):
+        """Names match contacts without accents; unknown categories of rejected rows are not created"""
+        db = service_db.db
+        company_id, workspace_id = f"cmp_{uuid.uuid4().hex[:8]}", f"ws_{uuid.uuid4().hex[:8]}"
+        service_db.run(db.contacts.insert_one({
+            "id": "contact_ana", "company_id": company_id, "nombre": "Ána", "apellidos": "Pérez",
+            "search_name": "ana perez", "created_at": "2026-01-01"
+        }))
+
+        report = service_db.run(import_movements_csv(db, "incomes", csv_file([
+            "fecha,monto,fuente,cliente,client_id",
+            "2026-03-01,100,Consultoría externa,ANA PEREZ,",
+            "2026-03-02,-5,Fuente rechazada,,",
+            "2026-03-03,50,ventas,Desconocido,contact_ajeno",
+        ]), company_id, workspace_id, "tester"))
+
+        assert report["imported"] == 2
+        assert report["failed"] == 1
+        assert report["created_categories"] == ["Consultoría externa"]
+
+        incomes = service_db.run(db.finanzas_incomes.find({"company_id": company_id}).sort("date", 1).to_list(None))
+        assert incomes[0]["client_id"] == "contact_ana"
+        assert incomes[1].get("client_id") is None
+
+        categories = service_db.run(db.finanzas_categories.find({"workspace_id": workspace_id}).to_list(None))
+        assert [c["name"] for c in categories] == ["Consultoría externa"]
+        print("✅ Contacts resolved per chunk, categories only for imported rows")
@@ -0,0 +1,123 @@
+"""
+Test Suite for the monthly finance ledger (finanzas_ledger_service)
+Tests: concurrent first builds and reads, changes recorded during a build,
+movements written before the aggregation and applied after it
+"""
+
+import asyncio
+import uuid
+
+import finanzas_ledger_service
+from finanzas_ledger_service import (
+    apply_ledger_change, ensure_ledger_indexes, get_ledger_entries, ledger_write, rebuild_company_ledger,
+    sum_ledger
+)
+
+
+def make_income(company_id, workspace_id, amount, **overrides):
+    income = {
+        "id": f"inc_{uuid.uuid4().hex[:12]}",
+        "company_id": company_id,
+        "workspace_id": workspace_id,
+        "date": "2026-03-15",
+        "amount": amount,
+        "paid_amount": 0,
+        "status": "pending",
+        "source": "ventas",
+        "project_id": None
+    }
+    income.update(overrides)
+    return income
+
+
+class TestLedgerBuild:
+    """Test suite for the versioned ledger build"""
+
+    def setup_scope(self, service_db, amounts):
+        db = service_db.db
+        company_id, workspace_id = f"cmp_{uuid.uuid4().hex[:8]}", f"ws_{uuid.uuid4().hex[:8]}"
+        service_db.run(ensure_ledger_indexes(db))
+        service_db.run(db.finanzas_incomes.insert_many(
+            [make_income(company_id, workspace_id, amount) for amount in amounts]
+        ))
+        return db, company_id, workspace_id
+
+    def test_concurrent_first_reads_do_not_double_rows(self, service_db):
+        """Concurrent first reads and a rebuild leave a single ledger version with exact totals"""
+        db, company_id, workspace_id = self.setup_scope(service_db, [100, 250.5, 49.5])
+
+        async def read_and_rebuild():
+            return await asyncio.gather(
+                *[get_ledger_entries(db, company_id, workspace_id, month="2026-03") for _ in range(5)],
+                rebuild_company_ledger(db, company_id)
+            )
+
+        *reads, _ = service_db.run(read_and_rebuild())
+
+        for entries in reads:
+            assert sum_ledger(entries, "income") == {"amount": 400, "paid_amount": 0, "count": 3}
+
+        state = service_db.run(db.finanzas_ledger_state.find_one({"company_id": company_id}))
+        assert state["status"] == "built"
+        stored = service_db.run(db.finanzas_ledger_monthly.find({"company_id": company_id}).to_list(None))
+        assert {doc["version"] for doc in stored} == {state["version"]}
+        assert sum(doc["amount"] for doc in stored) == 400
+        print("✅ Concurrent builds publish a single ledger version")
+
+    def test_change_during_build_is_not_lost(self, service_db, monkeypatch):
+        """A movement written while the ledger is being aggregated is included once published"""
+        db, company_id, workspace_id = self.setup_scope(service_db, [100])
+        late = make_income(company_id, workspace_id, 30)
+        aggregate = finanzas_ledger_service.aggregate_ledger_entries
+        calls = []
+
+        async def aggregate_with_concurrent_write(db, company_id):
+            entries = await aggregate(db, company_id)
+            if not calls:
+                # Escritura concurrente tras la agregación: la versión debe descartarse
+                await db.finanzas_incomes.insert_one(dict(late))
+                await apply_ledger_change(db, "income", None, late)
+            calls.append(1)
+            return entries
+
+        monkeypatch.setattr(finanzas_ledger_service, "aggregate_ledger_entries", aggregate_with_concurrent_write)
+        entries = service_db.run(get_ledger_entries(db, company_id, workspace_id))
+
+        assert len(calls) == 2
+        assert sum_ledger(entries, "income")["amount"] == 130
+
+        service_db.run(apply_ledger_change(db, "income", late, {**late, "amount": 50}))
+        entries = service_db.run(get_ledger_entries(db, company_id, workspace_id))
+        assert sum_ledger(entries, "income") == {"amount": 150, "paid_amount": 0, "count": 2}
+        print("✅ Changes recorded during a build trigger a fresh aggregation")
+
+    def test_write_applied_after_aggregation_is_counted_once(self, service_db, monkeypatch):
+        """A movement aggregated by a rebuild whose change lands later is not added twice"""
+        db, company_id, workspace_id = self.setup_scope(service_db, [100])
+        service_db.run(get_ledger_entries(db, company_id, workspace_id))
+        late = make_income(company_id, workspace_id, 30)
+        aggregate = finanzas_ledger_service.aggregate_ledger_entries
+
+        async def scenario():
+            aggregated = asyncio.Event()
+
+            async def aggregate_and_signal(db, company_id):
+                entries = await aggregate(db, company_id)
+                aggregated.set()
+                return entries
+
+            monkeypatch.setattr(finanzas_ledger_service, "aggregate_ledger_entries", aggregate_and_signal)
+
+            # El movimiento ya está en la base cuando la reconstrucción agrega;
+            # su apply_ledger_change llega después
+            async with ledger_write(db):
+                await db.finanzas_incomes.insert_one(dict(late))
+                build = asyncio.create_task(rebuild_company_ledger(db, company_id))
+                await aggregated.wait()
+                await apply_ledger_change(db, "income", None, late)
+            await build
+            return await get_ledger_entries(db, company_id, workspace_id)
+
+        entries = service_db.run(scenario())
+        assert sum_ledger(entries, "income") == {"amount": 130, "paid_amount": 0, "count": 2}
+        print("✅ Open writes delay the publish: no double count")
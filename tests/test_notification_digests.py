@@ -0,0 +1,137 @@
+"""
+Test Suite for notification digest delivery (flush_notification_digests)
+Tests: send failures are retried with backoff, abandoned claims are reclaimed,
+one pending digest per user and mode
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from pymongo import UpdateOne
+
+from activity_service import (
+    DIGEST_CLAIM_TIMEOUT_MINUTES, MAX_DIGEST_ATTEMPTS, ensure_notification_digest_indexes,
+    flush_notification_digests, upsert_pending_digests
+)
+
+
+def make_digest(**overrides):
+    past = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+    digest = {
+        "id": f"dig_{uuid.uuid4().hex[:12]}",
+        "username": f"TEST_{uuid.uuid4().hex[:6]}",
+        "digest_mode": "instant",
+        "status": "pending",
+        "send_after": past,
+        "recipient_email": f"{uuid.uuid4().hex[:8]}@test.com",
+        "event_count": 1,
+        "events": [{
+            "subject": "Nuevo comentario",
+            "template": "activity_notification",
+            "actor_name": "Tester",
+            "resource_name": "Mapa",
+            "resource_type": "mindmap",
+            "action": "commented"
+        }]
+    }
+    digest.update(overrides)
+    return digest
+
+
+class TestNotificationDigestFlush:
+    """Test suite for flush_notification_digests"""
+
+    def test_send_failure_is_retried_and_loop_continues(self, service_db):
+        """A failing send returns the digest to pending with backoff; other digests are still sent"""
+        db = service_db.db
+        failing, working = make_digest(), make_digest()
+        service_db.run(db.notification_digests.insert_many([dict(failing), dict(working)]))
+
+        delivered = []
+
+        async def send(recipient_email, subject, template, context):
+            # Como send_activity_notification_email: no lanza, informa el error
+            if recipient_email == failing["recipient_email"]:
+                return {"success": False, "error": "SMTP caído"}
+            delivered.append(recipient_email)
+            return {"success": True}
+
+        sent = service_db.run(flush_notification_digests(db, send))
+
+        assert sent == 1
+        assert delivered == [working["recipient_email"]]
+        assert service_db.run(db.notification_digests.find_one({"id": working["id"]})) is None
+
+        retried = service_db.run(db.notification_digests.find_one({"id": failing["id"]}))
+        assert retried["status"] == "pending"
+        assert retried["attempts"] == 1
+        assert retried["last_error"] == "SMTP caído"
+        assert "claimed_at" not in retried
+        assert retried["send_after"] > datetime.now(timezone.utc).isoformat()
+        print("✅ Failed digest returned to pending with backoff")
+
+    def test_digest_fails_after_max_attempts(self, service_db):
+        """After MAX_DIGEST_ATTEMPTS failures the digest is marked failed"""
+        db = service_db.db
+        digest = make_digest(attempts=MAX_DIGEST_ATTEMPTS - 1)
+        service_db.run(db.notification_digests.insert_one(dict(digest)))
+
+        async def send(**kwargs):
+            return {"success": False, "error": "rebote permanente"}
+
+        assert service_db.run(flush_notification_digests(db, send)) == 0
+
+        failed = service_db.run(db.notification_digests.find_one({"id": digest["id"]}))
+        assert failed["status"] == "failed"
+        assert failed["attempts"] == MAX_DIGEST_ATTEMPTS
+        print("✅ Digest marked failed after max attempts")
+
+    def test_abandoned_sending_digest_is_reclaimed(self, service_db):
+        """A digest stuck in 'sending' longer than the claim timeout is sent again"""
+        db = service_db.db
+        claimed_at = datetime.now(timezone.utc) - timedelta(minutes=DIGEST_CLAIM_TIMEOUT_MINUTES + 1)
+        stale = make_digest(status="sending", claimed_at=claimed_at.isoformat())
+        recent = make_digest(status="sending", claimed_at=datetime.now(timezone.utc).isoformat())
+        service_db.run(db.notification_digests.insert_many([dict(stale), dict(recent)]))
+
+        delivered = []
+
+        async def send(recipient_email, **kwargs):
+            delivered.append(recipient_email)
+            return {"success": True}
+
+        assert service_db.run(flush_notification_digests(db, send)) == 1
+        assert delivered == [stale["recipient_email"]]
+
+        in_flight = service_db.run(db.notification_digests.find_one({"id": recent["id"]}))
+        assert in_flight["status"] == "sending"
+        print("✅ Abandoned digest reclaimed, in-flight digest untouched")
+
+
+class TestNotificationDigestFanOut:
+    """Test suite for the pending digest upserts"""
+
+    def test_concurrent_fan_outs_share_the_pending_digest(self, service_db):
+        """A second upsert for the same user and mode joins the pending digest"""
+        db = service_db.db
+        service_db.run(ensure_notification_digest_indexes(db))
+        username = f"TEST_{uuid.uuid4().hex[:6]}"
+
+        def operation(event_id):
+            return UpdateOne(
+                {"username": username, "digest_mode": "instant", "status": "pending"},
+                {
+                    "$push": {"events": {"activity_id": event_id}},
+                    "$inc": {"event_count": 1},
+                    "$setOnInsert": {"id": f"dig_{uuid.uuid4().hex[:12]}"}
+                },
+                upsert=True
+            )
+
+        service_db.run(upsert_pending_digests(db, [operation("a")]))
+        service_db.run(upsert_pending_digests(db, [operation("b")]))
+
+        digests = service_db.run(db.notification_digests.find({"username": username}).to_list(None))
+        assert len(digests) == 1
+        assert digests[0]["event_count"] == 2
+        print("✅ One pending digest per user and mode")
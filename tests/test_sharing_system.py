@@ -467,6 +467,69 @@ class TestSharingSystem:
         print(f"✅ Shared boards: {len(data['boards'])}")
 
 
+class TestBulkPermissionCheck:
+    """Test suite for POST /api/permissions/bulk-check"""
+    
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """Setup: Login and get auth token"""
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        
+        login_response = self.session.post(
+            f"{BASE_URL}/api/auth/login",
+            json={"username": TEST_USER, "password": TEST_PASSWORD}
+        )
+        
+        if login_response.status_code == 200:
+            self.token = login_response.json().get("access_token")
+            self.session.headers.update({"Authorization": f"Bearer {self.token}"})
+        else:
+            pytest.skip(f"Login failed: {login_response.status_code}")
+    
+    def test_bulk_check_own_boards(self):
+        """Owned boards resolve as owner with full permissions, in request order"""
+        boards_response = self.session.get(f"{BASE_URL}/api/boards")
+        if boards_response.status_code != 200:
+            pytest.skip("Could not fetch boards")
+        
+        boards = boards_response.json().get("boards", [])[:5]
+        if not boards:
+            pytest.skip("No boards available for testing")
+        
+        resources = [{"resource_type": "board", "resource_id": b["id"]} for b in boards]
+        resources.append({"resource_type": "board", "resource_id": f"missing_{uuid.uuid4().hex[:8]}"})
+        
+        response = self.session.post(
+            f"{BASE_URL}/api/permissions/bulk-check",
+            json={"resources": resources}
+        )
+        
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}: {response.text}"
+        results = response.json()["results"]
+        assert [r["resource_id"] for r in results] == [r["resource_id"] for r in resources]
+        
+        for result in results[:-1]:
+            assert result["exists"] is True
+            assert result["role"] == "owner"
+            assert all(result["permissions"].values())
+        
+        missing = results[-1]
+        assert missing["exists"] is False
+        assert missing["role"] is None
+        assert not any(missing["permissions"].values())
+        print(f"✅ Bulk check resolved {len(results)} resources")
+    
+    def test_bulk_check_invalid_resource_type(self):
+        """Invalid resource types are rejected"""
+        response = self.session.post(
+            f"{BASE_URL}/api/permissions/bulk-check",
+            json={"resources": [{"resource_type": "invalid", "resource_id": "x"}]}
+        )
+        
+        assert response.status_code == 400
+
+
 class TestSharingEdgeCases:
     """Edge case tests for sharing system"""
     
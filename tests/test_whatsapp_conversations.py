@@ -0,0 +1,74 @@
+"""
+Test Suite for WhatsApp conversation summaries (whatsapp_conversation_service)
+Tests: unread count recompute when marking as read, one-time backfill marker
+"""
+
+import uuid
+from datetime import datetime, timezone
+
+from whatsapp_conversation_service import (
+    CONVERSATIONS_MIGRATION_ID, backfill_whatsapp_conversations, get_conversations, mark_conversation_read
+)
+
+
+def make_message(workspace_id, phone, direction="inbound", status="delivered"):
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:12]}",
+        "workspace_id": workspace_id,
+        "channel": "whatsapp",
+        "contact_phone": phone,
+        "direction": direction,
+        "status": status,
+        "content": {"text": "hola"},
+        "timestamp": datetime.now(timezone.utc)
+    }
+
+
+class TestMarkConversationRead:
+    """Test suite for mark_conversation_read"""
+
+    def test_unread_count_recomputed_after_read(self, service_db):
+        """Reading subtracts the marked messages; a message arriving later is counted again"""
+        db = service_db.db
+        workspace_id, phone = f"ws_{uuid.uuid4().hex[:8]}", "51987654321"
+        service_db.run(db.whatsapp_messages.insert_many([
+            make_message(workspace_id, phone),
+            make_message(workspace_id, phone),
+            make_message(workspace_id, phone, direction="outbound", status="sent"),
+            make_message(workspace_id, "51900000000")
+        ]))
+        service_db.run(db.whatsapp_conversations.insert_many([
+            {"workspace_id": workspace_id, "phone": phone, "unread_count": 2},
+            {"workspace_id": workspace_id, "phone": "51900000000", "unread_count": 1}
+        ]))
+
+        assert service_db.run(mark_conversation_read(db, workspace_id, phone)) == 2
+        assert service_db.run(mark_conversation_read(db, workspace_id, phone)) == 0
+
+        # Mensaje nuevo: el bridge lo guarda y suma 1 al resumen
+        service_db.run(db.whatsapp_messages.insert_one(make_message(workspace_id, phone)))
+        service_db.run(db.whatsapp_conversations.update_one(
+            {"workspace_id": workspace_id, "phone": phone}, {"$inc": {"unread_count": 1}}
+        ))
+
+        unread = {c["phone"]: c["unread_count"] for c in service_db.run(get_conversations(db, workspace_id))}
+        assert unread == {phone: 1, "51900000000": 1}
+
+        assert service_db.run(mark_conversation_read(db, workspace_id, phone)) == 1
+        unread = {c["phone"]: c["unread_count"] for c in service_db.run(get_conversations(db, workspace_id))}
+        assert unread == {phone: 0, "51900000000": 1}
+        print("✅ Unread count follows the messages marked as read")
+
+
+class TestConversationBackfill:
+    """Test suite for backfill_whatsapp_conversations"""
+
+    def test_backfill_skipped_once_marker_exists(self, service_db):
+        """The migration marker prevents running the backfill again"""
+        db = service_db.db
+        service_db.run(db.migrations.insert_one({"_id": CONVERSATIONS_MIGRATION_ID, "status": "completed"}))
+        service_db.run(db.whatsapp_messages.insert_one(make_message("ws_backfill", "51911111111")))
+
+        assert service_db.run(backfill_whatsapp_conversations(db)) is False
+        assert service_db.run(db.whatsapp_conversations.count_documents({})) == 0
+        print("✅ Backfill runs only once")